@@ -0,0 +1,430 @@
+"""
+Benchmarks of preprocessing and partitioning for every data format, against local storage.
+
+For each format, a synthetic input is generated and uploaded, then every phase runs in its own process:
+
+- ``preprocess``: monolithic preprocessing
+- ``preprocess-mapreduce``: mapreduce preprocessing, for formats with a finalizer function
+- ``partition-get``: partition the object and get() every slice
+
+For each phase, the wall time, throughput over the object size, peak RSS and the number of storage requests are
+recorded. Requests go through the local S3 stand-in server (see ``dataplug.storage.s3server``), which can emulate
+the latency and bandwidth of object storage, or directly to the file system backend (without request counts).
+
+Usage::
+
+    python benchmarks/bench.py --formats csv fastqgz --size 256 --latency 0.02 --output results.json
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from math import ceil
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+
+logger = logging.getLogger("dataplug.benchmarks")
+
+BUCKET = "benchmarks"
+MiB = 1024 * 1024
+PHASES = ("preprocess", "preprocess-mapreduce", "partition-get")
+
+
+@dataclass
+class FormatCase:
+    generator: Callable
+    filename: str
+    data_format: str  # "module:attribute" of the data format, imported in the benchmark process
+    strategy: str  # "module:attribute" of the partitioning strategy
+    strategy_args: Callable[[int, int], dict]  # (number of partitions, object size) -> strategy arguments
+    requires: List[str] = field(default_factory=list)  # optional modules or executables
+    upload: Callable[[str], List[str]] = lambda path: [path]  # files to upload for an input
+    monolithic: bool = True  # whether the preprocessing function can run without chunking
+    # Checks of the preprocessing attributes (cloud object, input path) and of the data of a slice
+    # (slice, data, input path) against the input written by datagen, raise ValidationError on a mismatch
+    check_attributes: Optional[Callable[[Any, str], None]] = None
+    check_slice: Optional[Callable[[Any, Any, str], None]] = None
+
+
+class ValidationError(Exception):
+    pass
+
+
+def _expect(condition: bool, message: str):
+    if not condition:
+        raise ValidationError(message)
+
+
+def _expect_lines_in_input(body: str, text: str, what: str):
+    # The data of a slice of a text format are whole consecutive lines of the input
+    _expect(body.endswith("\n"), f"{what} does not end with a whole line")
+    position = text.find(body)
+    _expect(position != -1, f"{what} is not a contiguous range of lines of the input")
+    _expect(position == 0 or text[position - 1] == "\n", f"{what} does not start with a whole line")
+
+
+def _check_csv_attributes(co, path: str):
+    with open(path) as f:
+        columns = f.readline().rstrip("\n").split(",")
+    _expect(list(co["columns"]) == columns, f"columns are {co['columns']}, expected {columns}")
+
+
+def _check_csv_slice(data_slice, data: str, path: str):
+    with open(path) as f:
+        text = f.read()
+    # Slices other than the first one start with the columns header
+    body = data if data_slice.range_0 == 0 else data.split("\n", 1)[1]
+    _expect_lines_in_input(body, text, f"CSV slice {data_slice.range_0}-{data_slice.range_1}")
+
+
+def _check_fasta_attributes(co, path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    expected = data.count(b"\n>") + data.startswith(b">")
+    _expect(co["num_sequences"] == expected, f"num_sequences is {co['num_sequences']}, expected {expected}")
+
+
+def _check_fasta_slice(data_slice, data: bytes, path: str):
+    with open(path, "rb") as f:
+        content = f.read()
+    if data_slice.header is not None:
+        # Slices that start within a sequence start with its identifier line, annotated with the offset
+        header_line, data = data.split(b"\n", 1)
+        header_0, header_1 = data_slice.header
+        _expect(header_line.startswith(content[header_0:header_1 - 1]) and header_line.startswith(b">"),
+                f"FASTA slice {data_slice.range_0}-{data_slice.range_1} has a wrong sequence identifier")
+    _expect(data == content[data_slice.range_0:data_slice.range_1],
+            f"FASTA slice {data_slice.range_0}-{data_slice.range_1} does not match the input")
+
+
+def _fastq_lines(path: str) -> List[str]:
+    with gzip.open(path, "rt") as f:
+        return f.read().splitlines()
+
+
+def _check_fastq_attributes(co, path: str):
+    expected = len(_fastq_lines(path))
+    _expect(int(co["total_lines"]) == expected, f"total_lines is {co['total_lines']}, expected {expected}")
+
+
+def _check_fastq_slice(data_slice, data: List[str], path: str):
+    expected = _fastq_lines(path)[data_slice.line_0 - 1:data_slice.line_1 - 1]
+    _expect(list(data) == expected, f"FASTQ slice of lines {data_slice.line_0}-{data_slice.line_1} "
+                                    f"does not match the input")
+
+
+def _check_vcf_attributes(co, path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    expected = data.index(b"\n", data.index(b"#CHROM")) + 1
+    _expect(co["body_offset"] == expected, f"body_offset is {co['body_offset']}, expected {expected}")
+
+
+def _check_vcf_slice(data_slice, data: str, path: str):
+    with open(path) as f:
+        text = f.read()
+    # Slices start with the VCF header, up to the columns line
+    header = text[:text.index("\n", text.index("#CHROM"))]
+    _expect(data.startswith(header + "\n"), f"VCF slice {data_slice.range_0}-{data_slice.range_1} has a wrong header")
+    _expect_lines_in_input(data[len(header) + 1:], text, f"VCF slice {data_slice.range_0}-{data_slice.range_1}")
+
+
+FORMATS: Dict[str, FormatCase] = {
+    "csv": FormatCase(
+        datagen.generate_csv, "data.csv",
+        "dataplug.formats.generic.csv:CSV",
+        "dataplug.formats.generic.csv:partition_num_chunks",
+        lambda n, size: {"num_chunks": n},
+        check_attributes=_check_csv_attributes,
+        check_slice=_check_csv_slice,
+    ),
+    "fasta": FormatCase(
+        datagen.generate_fasta, "data.fasta",
+        "dataplug.formats.genomics.fasta:FASTA",
+        "dataplug.formats.genomics.fasta:partition_chunks_strategy",
+        lambda n, size: {"num_chunks": n},
+        monolithic=False,
+        check_attributes=_check_fasta_attributes,
+        check_slice=_check_fasta_slice,
+    ),
+    "fastqgz": FormatCase(
+        datagen.generate_fastq_gz, "data.fastq.gz",
+        "dataplug.formats.genomics.fastq:FASTQGZip",
+        "dataplug.formats.genomics.fastq:partition_reads_batches",
+        lambda n, size: {"num_batches": n},
+        check_attributes=_check_fastq_attributes,
+        check_slice=_check_fastq_slice,
+    ),
+    "vcf": FormatCase(
+        datagen.generate_vcf, "data.vcf",
+        "dataplug.formats.genomics.vcf:VCF",
+        "dataplug.formats.genomics.vcf:partition_num_chunks",
+        lambda n, size: {"num_chunks": n},
+        check_attributes=_check_vcf_attributes,
+        check_slice=_check_vcf_slice,
+    ),
+    "las": FormatCase(
+        datagen.generate_las, "data.las",
+        "dataplug.formats.geospatial.laspc:LiDARPointCloud",
+        "dataplug.formats.geospatial.laspc:square_split_strategy",
+        lambda n, size: {"num_chunks": n},
+        requires=["laspy", "lasindex"],
+    ),
+    "imzml": FormatCase(
+        datagen.generate_imzml, "data.ibd",
+        "dataplug.formats.metabolomics.imzml:ImzML",
+        "dataplug.formats.metabolomics.imzml:partition_chunks_strategy",
+        lambda n, size: {"chunk_size": max(size // n, 1)},
+        requires=["pyimzml"],
+        upload=lambda path: [path, os.path.splitext(path)[0] + ".imzML"],
+    ),
+}
+
+
+def _missing_requirements(case: FormatCase) -> List[str]:
+    import importlib.util
+
+    missing = []
+    for requirement in case.requires:
+        if importlib.util.find_spec(requirement) is None and shutil.which(requirement) is None:
+            missing.append(requirement)
+    return missing
+
+
+def _import(path: str):
+    import importlib
+
+    module, attribute = path.split(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def _peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    unit = 1 if platform.system() == "Darwin" else 1024
+    return {
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / MiB,
+        "peak_children_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / MiB,
+    }
+
+
+def _run_phase(case_name: str, phase: str, storage_kwargs: dict, args: dict, queue: multiprocessing.Queue):
+    """
+    Run a benchmark phase, in a process of its own so that its peak RSS is not affected by other phases
+    """
+    try:
+        from dataplug import CloudObject, tracing
+
+        # Phase breakdown of slice reads and preprocessing (only of spans in this process, e.g. joblib threads)
+        tracer = tracing.RecordingTracer()
+        tracing.set_tracer(tracer)
+        case = FORMATS[case_name]
+        data_format = _import(case.data_format)
+        co = CloudObject.from_s3(data_format, f"s3://{BUCKET}/{case_name}/{case.filename}", **storage_kwargs)
+        baseline = _peak_rss_mb()["peak_rss_mb"]
+        result = {}
+
+        t0 = time.perf_counter()
+        if phase == "preprocess":
+            co.preprocess(parallel_config=args["parallel_config"], force=True)
+        elif phase == "preprocess-mapreduce":
+            chunk_size = max(ceil(co.size / args["map_chunks"]), 1)
+            co.preprocess(parallel_config=args["parallel_config"], chunk_size=chunk_size, force=True)
+            result["chunk_size"] = chunk_size
+        elif phase == "partition-get":
+            strategy = _import(case.strategy)
+            slices = co.partition(strategy, **case.strategy_args(args["partitions"], co.size))
+            t_partition = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args["workers"]) as pool:
+                latencies = list(pool.map(_timed_get, slices))
+            result["partition_s"] = t_partition - t0
+            result["slices"] = len(slices)
+            result["get_mean_s"] = sum(latencies) / len(latencies) if latencies else 0
+            result["get_max_s"] = max(latencies, default=0)
+        elapsed = time.perf_counter() - t0
+
+        # Results are checked against the input after timing, so that checks are not measured
+        input_path = os.path.join(args["inputs_dir"], case.filename)
+        if phase in ("preprocess", "preprocess-mapreduce") and case.check_attributes is not None:
+            case.check_attributes(co, input_path)
+        if phase == "partition-get" and case.check_slice is not None:
+            _expect(len(slices) > 0, "Partitioning returned no slices")
+            for data_slice in {id(s): s for s in (slices[0], slices[len(slices) // 2], slices[-1])}.values():
+                case.check_slice(data_slice, data_slice.get(), input_path)
+        result["validated"] = case.check_attributes is not None or case.check_slice is not None
+
+        result.update({
+            "elapsed_s": elapsed,
+            "throughput_mb_s": co.size / MiB / elapsed if elapsed else None,
+            "baseline_rss_mb": baseline,
+            **_peak_rss_mb(),
+            "spans": tracer.summary(),
+        })
+        queue.put(result)
+    except BaseException as e:
+        logger.exception("Phase %s of %s failed", phase, case_name)
+        queue.put({"error": repr(e)})
+
+
+def _timed_get(data_slice) -> float:
+    t0 = time.perf_counter()
+    data_slice.get()
+    return time.perf_counter() - t0
+
+
+def run_benchmarks(formats: List[str], size: int, phases: List[str], work_dir: str, partitions: int = 8,
+                   workers: int = 8, map_chunks: int = 8, backend: str = "s3server", latency: float = 0.0,
+                   bandwidth: Optional[float] = None, parallel_config: Optional[dict] = None,
+                   seed: int = 0) -> List[dict]:
+    from dataplug.storage.filesystem import FileSystemS3API
+    from dataplug.storage.s3server import S3Server
+
+    storage_root = os.path.join(work_dir, "storage")
+    inputs_dir = os.path.join(work_dir, "inputs")
+    os.makedirs(storage_root, exist_ok=True)
+    os.makedirs(inputs_dir, exist_ok=True)
+
+    server = S3Server(storage_root, latency=latency, bandwidth=bandwidth).start() if backend == "s3server" else None
+    storage = FileSystemS3API(storage_root)
+    storage.create_bucket(Bucket=BUCKET)
+    if server is not None:
+        storage_kwargs = {"s3_config": server.storage_config()}
+    else:
+        storage_kwargs = {"storage": storage}
+
+    args = {"partitions": partitions, "workers": workers, "map_chunks": map_chunks,
+            "parallel_config": parallel_config or {}, "inputs_dir": inputs_dir}
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for name in formats:
+            case = FORMATS[name]
+            missing = _missing_requirements(case)
+            if missing:
+                logger.warning("Skipping %s, missing %s", name, ", ".join(missing))
+                results.append({"format": name, "skipped": f"missing {', '.join(missing)}"})
+                continue
+
+            path = os.path.join(inputs_dir, case.filename)
+            t0 = time.perf_counter()
+            case.generator(path, size, seed=seed)
+            logger.info("Generated %s input in %.2f s", name, time.perf_counter() - t0)
+            # Upload directly to the storage directory, uploads are not benchmarked
+            for file_path in case.upload(path):
+                with open(file_path, "rb") as f:
+                    storage.put_object(Bucket=BUCKET, Key=f"{name}/{os.path.basename(file_path)}", Body=f)
+            input_size = os.path.getsize(path)
+
+            data_format = _import(case.data_format)
+            for phase in phases:
+                if phase == "preprocess" and not case.monolithic:
+                    continue
+                if phase == "preprocess-mapreduce" and data_format.finalizer_function is None:
+                    continue
+                if server is not None:
+                    server.reset_stats()
+                queue = ctx.Queue()
+                proc = ctx.Process(target=_run_phase, args=(name, phase, storage_kwargs, args, queue))
+                proc.start()
+                result = queue.get()
+                proc.join()
+
+                result.update({"format": name, "phase": phase, "object_size_mb": input_size / MiB})
+                if server is not None:
+                    stats = server.stats
+                    result["requests"] = stats["total_requests"]
+                    result["requests_by_operation"] = stats["requests"]
+                    result["bytes_sent_mb"] = stats["bytes_sent"] / MiB
+                logger.info("%s %s: %s", name, phase, result)
+                results.append(result)
+    finally:
+        if server is not None:
+            server.stop()
+    return results
+
+
+def _print_table(results: List[dict]):
+    columns = ["format", "phase", "elapsed_s", "throughput_mb_s", "peak_rss_mb", "requests", "bytes_sent_mb"]
+    print(" | ".join(f"{c:>16}" for c in columns))
+    for result in results:
+        if "skipped" in result or "error" in result:
+            print(f"{result['format']:>16} | {result.get('phase', ''):>16} | {result.get('skipped') or result['error']}")
+            continue
+        cells = []
+        for c in columns:
+            value = result.get(c)
+            cells.append(f"{value:>16.2f}" if isinstance(value, float) else f"{str(value):>16}")
+        print(" | ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dataplug benchmarks")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS))
+    parser.add_argument("--phases", nargs="+", default=list(PHASES), choices=list(PHASES))
+    parser.add_argument("--size", type=float, default=64, help="Approximate size of the inputs in MiB")
+    parser.add_argument("--partitions", type=int, default=8, help="Number of slices to partition the inputs in")
+    parser.add_argument("--workers", type=int, default=8, help="Number of threads that get() slices concurrently")
+    parser.add_argument("--map-chunks", type=int, default=8, help="Number of chunks for mapreduce preprocessing")
+    parser.add_argument("--n-jobs", type=int, default=None, help="joblib n_jobs for preprocessing")
+    parser.add_argument("--joblib-backend", default=None, help="joblib backend for preprocessing, e.g. threading")
+    parser.add_argument("--backend", choices=["s3server", "filesystem"], default="s3server",
+                        help="Access storage through the S3 stand-in server (with request counts) or directly")
+    parser.add_argument("--latency", type=float, default=0.0, help="Emulated latency of each request in seconds")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Emulated bandwidth per request in MiB/s")
+    parser.add_argument("--work-dir", default=None, help="Directory for inputs and storage, temporary if not set")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    parallel_config = {}
+    if args.n_jobs is not None:
+        parallel_config["n_jobs"] = args.n_jobs
+    if args.joblib_backend is not None:
+        parallel_config["backend"] = args.joblib_backend
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="dataplug-bench-")
+    try:
+        results = run_benchmarks(
+            args.formats, int(args.size * MiB), args.phases, work_dir, partitions=args.partitions,
+            workers=args.workers, map_chunks=args.map_chunks, backend=args.backend, latency=args.latency,
+            bandwidth=args.bandwidth * MiB if args.bandwidth else None, parallel_config=parallel_config,
+            seed=args.seed,
+        )
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    _print_table(results)
+    if args.output:
+        report = {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    # Failed phases, e.g. results that do not match the inputs, fail the run
+    if any("error" in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
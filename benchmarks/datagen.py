@@ -0,0 +1,142 @@
+"""
+Synthetic inputs for the benchmarks. Every generator writes a file of approximately ``size`` bytes to ``path``
+and is deterministic for a given seed.
+"""
+from __future__ import annotations
+
+import gzip
+import os
+import random
+
+import numpy as np
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+QUALITIES = np.arange(ord("!"), ord("J") + 1, dtype=np.uint8)
+WRITE_SIZE = 8 * 1024 * 1024
+
+
+def _sequence(rng: np.random.Generator, length: int) -> bytes:
+    return BASES[rng.integers(0, 4, length)].tobytes()
+
+
+def generate_csv(path: str, size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as f:
+        f.write("id,sample,value,score,label\n")
+        written, row = 0, 0
+        while written < size:
+            n = 50_000
+            ids = np.arange(row, row + n)
+            samples = rng.integers(0, 1000, n)
+            values = rng.random(n)
+            scores = rng.normal(0, 100, n)
+            labels = rng.choice(["alpha", "beta", "gamma", "delta"], n)
+            lines = "".join(f"{i},{s},{v:.6f},{sc:.3f},{lb}\n"
+                            for i, s, v, sc, lb in zip(ids, samples, values, scores, labels))
+            f.write(lines)
+            written += len(lines)
+            row += n
+
+
+def generate_fasta(path: str, size: int, seed: int = 0, line_length: int = 80,
+                   min_sequence: int = 10_000, max_sequence: int = 1_000_000):
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as f:
+        written, seq = 0, 0
+        while written < size:
+            length = int(rng.integers(min_sequence, max_sequence))
+            data = _sequence(rng, length)
+            lines = b"\n".join(data[i:i + line_length] for i in range(0, length, line_length))
+            record = b">seq%d synthetic sequence length=%d\n" % (seq, length) + lines + b"\n"
+            f.write(record)
+            written += len(record)
+            seq += 1
+
+
+def generate_fastq_gz(path: str, size: int, seed: int = 0, read_length: int = 150, level: int = 6):
+    """
+    ``size`` is the approximate uncompressed size
+    """
+    rng = np.random.default_rng(seed)
+    with gzip.open(path, "wb", compresslevel=level) as f:
+        written, read = 0, 0
+        while written < size:
+            n = 10_000
+            bases = BASES[rng.integers(0, 4, (n, read_length))]
+            quals = QUALITIES[rng.integers(0, len(QUALITIES), (n, read_length))]
+            records = b"".join(
+                b"@read%d\n%s\n+\n%s\n" % (read + i, bases[i].tobytes(), quals[i].tobytes()) for i in range(n)
+            )
+            f.write(records)
+            written += len(records)
+            read += n
+
+
+def generate_vcf(path: str, size: int, seed: int = 0, num_samples: int = 4):
+    rnd = random.Random(seed)
+    samples = [f"SAMPLE{i}" for i in range(num_samples)]
+    with open(path, "w") as f:
+        f.write("##fileformat=VCFv4.2\n")
+        f.write("##source=dataplug-benchmarks\n")
+        f.write('##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">\n')
+        f.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t" + "\t".join(samples) + "\n")
+        written, pos = 0, 1
+        buff = []
+        while written < size:
+            pos += rnd.randint(1, 500)
+            ref, alt = rnd.sample("ACGT", 2)
+            genotypes = "\t".join(rnd.choice(("0/0", "0/1", "1/1")) for _ in samples)
+            line = f"chr1\t{pos}\trs{pos}\t{ref}\t{alt}\t{rnd.randint(10, 99)}\tPASS\tDP={rnd.randint(1, 200)}\tGT\t" \
+                   f"{genotypes}\n"
+            buff.append(line)
+            written += len(line)
+            if len(buff) == 10_000:
+                f.write("".join(buff))
+                buff = []
+        f.write("".join(buff))
+
+
+def generate_las(path: str, size: int, seed: int = 0):
+    import laspy
+
+    rng = np.random.default_rng(seed)
+    header = laspy.LasHeader(point_format=3, version="1.2")
+    header.scales = np.array([0.01, 0.01, 0.01])
+    header.offsets = np.array([0.0, 0.0, 0.0])
+    num_points = max(size // header.point_format.size, 1)
+    las = laspy.LasData(header)
+    las.x = rng.uniform(0, 1000, num_points)
+    las.y = rng.uniform(0, 1000, num_points)
+    las.z = rng.uniform(0, 100, num_points)
+    las.intensity = rng.integers(0, 65535, num_points, dtype=np.uint16)
+    las.write(path)
+
+
+def generate_imzml(path: str, size: int, seed: int = 0, peaks: int = 1000):
+    """
+    Writes a processed-mode imzML file at ``path`` (with .imzML extension) and its binary data (.ibd),
+    ``size`` is the approximate size of the .ibd file
+    """
+    from pyimzml.ImzMLWriter import ImzMLWriter
+
+    rng = np.random.default_rng(seed)
+    spectrum_size = peaks * (8 + 4)
+    num_spectra = max(size // spectrum_size, 1)
+    side = int(np.ceil(np.sqrt(num_spectra)))
+    with ImzMLWriter(os.path.splitext(path)[0], mz_dtype=np.float64, intensity_dtype=np.float32,
+                     mode="processed") as writer:
+        for i in range(num_spectra):
+            mzs = np.sort(rng.uniform(100, 1000, peaks))
+            intensities = rng.random(peaks).astype(np.float32)
+            writer.addSpectrum(mzs, intensities, (i % side + 1, i // side + 1, 1))
+
+
+GENERATORS = {
+    "csv": generate_csv,
+    "fasta": generate_fasta,
+    "fastqgz": generate_fastq_gz,
+    "vcf": generate_vcf,
+    "las": generate_las,
+    "imzml": generate_imzml,
+}
@@ -1,2 +1,3 @@
 from .cloudobject import CloudObject
+from .dataset import CloudDataset
 from .formats import *
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from typing import Any, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_CACHE_BYTES = 512 * 1024 * 1024  # 512 MiB
+
+
+def sizeof(obj: Any) -> int:
+    """
+    Approximate in-memory size in bytes of a parsed index object
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(sizeof(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(sizeof(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class IndexCache:
+    """
+    Thread-safe LRU cache for parsed partition indexes, bounded by the total size in bytes of the cached entries.
+
+    Entries are keyed by the metadata object path and its version (ETag), so that a re-preprocessed object
+    never serves a stale index. Cached values are shared, callers must not modify them in place.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_INDEX_CACHE_BYTES):
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @property
+    def current_bytes(self) -> int:
+        return self._current_bytes
+
+    def resize(self, max_bytes: int):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        size = sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                _, old_size = self._entries.pop(key)
+                self._current_bytes -= old_size
+            if size > self._max_bytes:
+                logger.debug("Index of %d bytes is larger than cache capacity, not caching it", size)
+                return
+            self._entries[key] = (value, size)
+            self._current_bytes += size
+            self._evict()
+
+    def invalidate(self, prefix: Optional[Hashable] = None):
+        """
+        Remove all entries, or only entries whose key starts with the given prefix element (metadata path)
+        """
+        with self._lock:
+            if prefix is None:
+                self._entries.clear()
+                self._current_bytes = 0
+                return
+            for key in [k for k in self._entries if k[0] == prefix]:
+                _, size = self._entries.pop(key)
+                self._current_bytes -= size
+
+    def _evict(self):
+        while self._current_bytes > self._max_bytes and self._entries:
+            key, (_, size) = self._entries.popitem(last=False)
+            self._current_bytes -= size
+            logger.debug("Evicted index %s from cache", key)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Process-wide cache shared by all CloudObject instances
+index_cache = IndexCache()
@@ -4,6 +4,7 @@ import copy
 import logging
 import pickle
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from functools import partial
 from types import SimpleNamespace
@@ -12,19 +13,25 @@ from typing import TYPE_CHECKING
 import botocore.exceptions
 import smart_open
 
+from .cache import index_cache
 from .entities import CloudDataFormat, CloudObjectSlice
-from .preprocessing.preprocess import monolithic_preprocessing, mapreduce_preprocessing
-from .storage.picklableS3 import PickleableS3ClientProxy, S3Path
+from .preprocessing.preprocess import adaptive_chunk_size, monolithic_preprocessing, mapreduce_preprocessing
+from .storage.metrics import submit_in_context
+from .storage.picklableS3 import DEFAULT_MAX_POOL_CONNECTIONS, PickleableS3ClientProxy, S3Path
 from .util import head_object, upload_file_with_progress
 
 if TYPE_CHECKING:
     from mypy_boto3_s3 import S3Client
-    from typing import List, Dict, Optional, Any
+    from typing import Callable, Iterable, List, Dict, Optional, Any
 else:
     S3Client = object
 
 logger = logging.getLogger(__name__)
 
+# Placeholder headers of objects of folder formats
+FOLDER_HEADERS = {"Information": "The data was marked as a folder, therefore it cannot generate headers correctly. "
+                                 "This is set in place of the headers"}
+
 
 class CloudObject:
     def __init__(
@@ -34,7 +41,8 @@ class CloudObject:
             meta_path: S3Path,
             attrs_path: S3Path,
             storage_config: Optional[Dict[str, Any]] = None,
-            is_folder: bool = False                         # Allows to process formats that are defined as folders
+            is_folder: bool = False,                        # Allows to process formats that are defined as folders
+            storage: Optional[S3Client] = None              # Storage backend, overrides storage_config if provided
     ):
         self._obj_headers: Optional[Dict[str, str]] = None  # Storage headers of the data object
         self._meta_headers: Optional[Dict[str, str]] = None  # Storage headers of the metadata object
@@ -55,8 +63,12 @@ class CloudObject:
 
         self._is_folder = is_folder
 
-        storage_config = storage_config or {}
-        self._s3: S3Client = PickleableS3ClientProxy(**storage_config)
+        if storage is not None:
+            # Any pickleable object with the S3 client API, e.g. FileSystemS3API
+            self._s3: S3Client = storage
+        else:
+            storage_config = storage_config or {}
+            self._s3: S3Client = PickleableS3ClientProxy(**storage_config)
 
         logger.info(f"Created reference for %s", self)
         logger.debug(f"{self._obj_path=},{self._meta_path=}")
@@ -110,35 +122,107 @@ class CloudObject:
             storage_uri: str,
             fetch: Optional[bool] = True,
             metadata_bucket: Optional[str] = None,
-            s3_config: Optional[Dict[str, Any]] = None
+            s3_config: Optional[Dict[str, Any]] = None,
+            storage: Optional[S3Client] = None
     ) -> CloudObject:
         obj_path = S3Path.from_uri(storage_uri)
         if metadata_bucket is None:
             metadata_bucket = obj_path.bucket + ".meta"
         metadata_path = S3Path.from_bucket_key(metadata_bucket, obj_path.key)
         attributes_path = S3Path.from_bucket_key(metadata_bucket, obj_path.key + ".attrs")
-        co = cls(data_format, obj_path, metadata_path, attributes_path, s3_config,data_format.is_folder)
+        co = cls(data_format, obj_path, metadata_path, attributes_path, s3_config, data_format.is_folder, storage)
         if fetch:
             co.fetch()
         return co
 
     @classmethod
-    def from_bucket_key(cls, data_format, bucket, key, fetch=True) -> CloudObject:
+    def from_s3_many(
+            cls,
+            data_format: CloudDataFormat,
+            storage_uris: Iterable[str],
+            fetch: Optional[bool] = True,
+            metadata_bucket: Optional[str] = None,
+            s3_config: Optional[Dict[str, Any]] = None,
+            storage: Optional[S3Client] = None,
+            max_workers: int = DEFAULT_MAX_POOL_CONNECTIONS,
+            ignore_missing: bool = False,
+    ) -> List[CloudObject]:
+        """
+        Create the CloudObjects of many objects of the same format, which share a storage client. The HEAD requests
+        of the objects and their metadata, and the GET requests of their attributes, are made concurrently by a
+        pool of ``max_workers`` threads.
+        :param ignore_missing: Leave out objects that do not exist, instead of raising KeyError
+        """
+        if storage is None:
+            storage = PickleableS3ClientProxy(**(s3_config or {}))
+        cloud_objects = [
+            cls.from_s3(data_format, uri, fetch=False, metadata_bucket=metadata_bucket, storage=storage)
+            for uri in storage_uris
+        ]
+        if not fetch:
+            return cloud_objects
+        return cls.fetch_many(cloud_objects, max_workers=max_workers, ignore_missing=ignore_missing)
+
+    @staticmethod
+    def fetch_many(cloud_objects: List[CloudObject], max_workers: int = DEFAULT_MAX_POOL_CONNECTIONS,
+                   ignore_missing: bool = False) -> List[CloudObject]:
+        """
+        Fetch the headers, metadata headers and attributes of many objects, concurrently by a pool of
+        ``max_workers`` threads. Returns the objects that exist.
+        :param ignore_missing: Leave out objects that do not exist, instead of raising KeyError
+        """
+        if not cloud_objects:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, 3 * len(cloud_objects))) as pool:
+            submit = partial(submit_in_context, pool)
+            futures = []
+            for co in cloud_objects:
+                futures.append((
+                    None if co._is_folder or co._obj_headers
+                    else submit(head_object, co.storage, co.path.bucket, co.path.key),
+                    submit(co._head_metadata),
+                    submit(co._get_attributes),
+                ))
+
+            found = []
+            for co, (obj_future, meta_future, attrs_future) in zip(cloud_objects, futures):
+                try:
+                    if obj_future is not None:
+                        co._obj_headers = obj_future.result()[0]
+                    elif co._is_folder:
+                        co._obj_headers = dict(FOLDER_HEADERS)
+                except KeyError:
+                    if not ignore_missing:
+                        # Requests that have not started are not made, the running ones are waited for on exit
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise KeyError(f"Object {co.path.as_uri()} not found")
+                    continue
+                co._meta_headers = meta_future.result()
+                co._set_attributes(attrs_future.result() if co._meta_headers else None)
+                found.append(co)
+
+        logger.info("Fetched %d objects", len(found))
+        return found
+
+    @classmethod
+    def from_bucket_key(cls, data_format, bucket, key, fetch=True, storage=None) -> CloudObject:
         obj_path = S3Path.from_bucket_key(bucket, key)
         metadata_path = S3Path.from_bucket_key(bucket + ".meta", key)
         attributes_path = S3Path.from_bucket_key(bucket + ".meta", key + ".attrs")
 
-        co = cls(data_format, obj_path, metadata_path, attributes_path)
+        co = cls(data_format, obj_path, metadata_path, attributes_path, storage=storage)
         if fetch:
             co.fetch()
         return co
 
     @classmethod
-    def new_from_file(cls, data_format, file_path, cloud_path, s3_config=None, override=False) -> "CloudObject":
+    def new_from_file(cls, data_format, file_path, cloud_path, s3_config=None, override=False,
+                      storage=None) -> "CloudObject":
         obj_path = S3Path.from_uri(cloud_path)
         metadata_path = S3Path.from_bucket_key(obj_path.bucket + ".meta", obj_path.key)
         attributes_path = S3Path.from_bucket_key(obj_path.bucket + ".meta", obj_path.key + ".attrs")
-        co_instance = cls(data_format, obj_path, metadata_path, attributes_path, s3_config)
+        co_instance = cls(data_format, obj_path, metadata_path, attributes_path, s3_config, storage=storage)
 
         if co_instance.exists():
             if not override:
@@ -169,7 +253,7 @@ class CloudObject:
         if not self._obj_headers:
             if self._is_folder:
                 logger.info("Working with folder from S3")
-                self._obj_headers = {'Information': 'The data was marked as a folder, therefore it cannot generate headers correctly. This is set in place of the headers'} 
+                self._obj_headers = dict(FOLDER_HEADERS)
             else:
                 logger.info("Fetching object from S3")
                 self._fetch_object()
@@ -181,38 +265,106 @@ class CloudObject:
         self._obj_headers, _ = head_object(self._s3, self._obj_path.bucket, self._obj_path.key)
     
     def _fetch_metadata(self):
+        self._meta_headers = self._head_metadata()
+        self._set_attributes(self._get_attributes() if self._meta_headers else None)
+
+    def _head_metadata(self) -> Optional[Dict[str, str]]:
         try:
             res, _ = head_object(self._s3, self._meta_path.bucket, self._meta_path.key)
-            self._meta_headers = res
-            res, _ = head_object(self._s3, self._attrs_path.bucket, self._attrs_path.key)
-            self._attrs_headers = res
-            get_res = self.storage.get_object(Bucket=self._attrs_path.bucket, Key=self._attrs_path.key)
-            try:
-                attrs_dict = pickle.load(get_res["Body"])
-                # Get default attributes from the class,
-                # so we can have default attributes different from None set in the Class
-                base_attrs = deepcopy(self._format_cls.attrs_types)
-                # Replace attributes that have been set in the preprocessing stage
-                base_attrs.update(attrs_dict)
-                # Create namedtuple so that the attributes object is immutable
-                co_named_tuple = namedtuple(self._format_cls.co_class.__name__ + "Attributes", base_attrs.keys())
-                self._attrs = co_named_tuple(**base_attrs)
-            except Exception as e:
-                logger.error(e)
-                self._attrs = None
-        except KeyError as e:
-            self._meta_headers = None
+            return res
+        except KeyError:
+            return None
+
+    def _get_attributes(self) -> Optional[Dict[str, Any]]:
+        """
+        GET the attributes object, None if it does not exist. The response headers replace a HEAD request.
+        The body is read at once, so that the response is released even if the attributes are not used.
+        """
+        try:
+            res = self.storage.get_object(Bucket=self._attrs_path.bucket, Key=self._attrs_path.key)
+        except botocore.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise error
+        body = res["Body"]
+        try:
+            res["Body"] = body.read()
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+        return res
+
+    def _set_attributes(self, get_res: Optional[Dict[str, Any]]):
+        if get_res is None:
+            self._attrs_headers = None
             self._attrs = None
+            return
+
+        self._attrs_headers = {k: v for k, v in get_res.items() if k not in ("Body", "ResponseMetadata", "Metadata")}
+        try:
+            attrs_dict = pickle.loads(get_res["Body"])
+            # Get default attributes from the class,
+            # so we can have default attributes different from None set in the Class
+            base_attrs = deepcopy(self._format_cls.attrs_types)
+            # Replace attributes that have been set in the preprocessing stage
+            base_attrs.update(attrs_dict)
+            # Create namedtuple so that the attributes object is immutable
+            co_named_tuple = namedtuple(self._format_cls.co_class.__name__ + "Attributes", base_attrs.keys())
+            self._attrs = co_named_tuple(**base_attrs)
+        except Exception as e:
+            logger.error(e)
+            self._attrs = None
+
+    def load_index(self, loader: Callable[[bytes], Any]) -> Any:
+        """
+        Download the metadata object and parse it with the given loader function. The parsed index is kept
+        in a process-wide LRU cache keyed by metadata path and ETag, so repeated partitioning calls over the
+        same object are served from memory. The returned object is shared and must not be modified.
+        """
+        if not self._meta_headers:
+            self._fetch_metadata()
+        if not self._meta_headers:
+            raise KeyError(f"Metadata object {self._meta_path.as_uri()} not found")
+
+        index = index_cache.get(self._index_cache_key(self._meta_headers, loader))
+        if index is None:
+            logger.debug("Index cache miss for %s", self._meta_path.as_uri())
+            res = self.storage.get_object(Bucket=self._meta_path.bucket, Key=self._meta_path.key)
+            index = loader(res["Body"].read())
+            # The metadata object may have been replaced since its headers were fetched, the index is cached with
+            # the version that was read
+            self._meta_headers = {**self._meta_headers,
+                                  **{k: res[k] for k in ("ETag", "LastModified", "ContentLength") if k in res}}
+            index_cache.put(self._index_cache_key(self._meta_headers, loader), index)
+        return index
+
+    def _index_cache_key(self, headers: Dict[str, Any], loader: Callable[[bytes], Any]) -> tuple:
+        version = (headers.get("ETag"), str(headers.get("LastModified")), headers.get("ContentLength"))
+        return self._meta_path.as_uri(), version, loader.__module__, loader.__qualname__
 
     def clean(self):
         logger.info("Cleaning indexes and metadata for %s", self)
+        index_cache.invalidate(self._meta_path.as_uri())
         self._s3.delete_object(Bucket=self._meta_path.bucket, Key=self._meta_path.key)
         self._meta_headers = None
         self.storage.delete_object(Bucket=self._attrs_path.bucket, Key=self._attrs_path.key)
         self._attrs_headers = None
         self._attrs = {}
 
-    def preprocess(self, parallel_config=None, extra_args=None, chunk_size=None, force=False, debug=False):
+    def preprocess(self, parallel_config=None, extra_args=None, chunk_size=None, force=False, debug=False,
+                   stage_partials=None, reduce_fanout=None, chunks_per_worker=None, resume=True):
+        """
+        Preprocess the object, as a single job or, with ``chunk_size``, with mapreduce in chunks of ``chunk_size``
+        bytes (the last chunk holds the remainder). With ``chunks_per_worker`` instead, the chunk size is picked to
+        split the object in about ``chunks_per_worker`` chunks per worker of the joblib backend.
+        Partial results of mapreduce are returned to the finalizer through joblib with local backends, and staged in
+        the meta bucket with distributed backends. Set ``stage_partials`` to override it.
+        Staged jobs are checkpointed: if a job fails, running it again with ``resume`` only maps the chunks that are
+        missing. Staged partial results of other jobs are deleted.
+        With ``reduce_fanout``, partial results are reduced in a tree with the combiner function of the format:
+        groups of ``reduce_fanout`` consecutive results are combined in parallel, level by level, and the finalizer
+        only merges the last ``reduce_fanout`` results.
+        """
         assert self.exists(), "Object not found in S3"
         if self.is_preprocessed() and not force:
             return
@@ -220,6 +372,31 @@ class CloudObject:
         parallel_config = parallel_config or {}
         extra_args = extra_args or {}
 
+        self._create_meta_bucket()
+
+        if chunk_size is not None or chunks_per_worker is not None:
+            assert self.size > 0, "Empty objects can not be preprocessed in chunks"
+        if chunks_per_worker is not None:
+            assert chunk_size is None, "Set either chunk size or chunks per worker"
+            chunk_size = min(adaptive_chunk_size(self.size, parallel_config, chunks_per_worker), self.size)
+
+        if chunk_size is None:
+            monolithic_preprocessing(self, parallel_config, self._format_cls.preprocessing_function, extra_args)
+        else:
+            assert chunk_size != 0 and chunk_size <= self.size, ("Chunk size must be greater than 0 "
+                                                                 "and less or equal to object size")
+            assert self._format_cls.finalizer_function is not None, "Finalizer function must be defined for mapreduce"
+            mapreduce_preprocessing(self, parallel_config, chunk_size, self._format_cls.preprocessing_function,
+                                    self._format_cls.finalizer_function, extra_args, stage_partials,
+                                    self._format_cls.combiner_function, reduce_fanout, self._format_cls.overlap,
+                                    resume)
+
+        # Metadata has been (re)written, drop stale headers and cached indexes before fetching them again
+        index_cache.invalidate(self._meta_path.as_uri())
+        self._meta_headers = None
+        self.fetch()
+
+    def _create_meta_bucket(self):
         # Check if the metadata bucket exists, if not create it
         try:
             meta_bucket_head = self.storage.head_bucket(Bucket=self.meta_path.bucket)
@@ -229,24 +406,13 @@ class CloudObject:
             meta_bucket_head = None
 
         if not meta_bucket_head:
-            logger.info("Creating meta bucket %s".format(self.meta_path.bucket))
+            logger.info("Creating meta bucket %s", self.meta_path.bucket)
             try:
                 self.storage.create_bucket(Bucket=self.meta_path.bucket)
             except botocore.exceptions.ClientError as error:
                 logger.error("Metadata bucket %s not found -- Also failed to create it", self.meta_path.bucket)
                 raise error
 
-        if chunk_size is None:
-            monolithic_preprocessing(self, parallel_config, self._format_cls.preprocessing_function, extra_args)
-        else:
-            assert chunk_size != 0 and chunk_size <= self.size, ("Chunk size must be greater than 0 "
-                                                                 "and less or equal to object size")
-            assert self._format_cls.finalizer_function is not None, "Finalizer function must be defined for mapreduce"
-            mapreduce_preprocessing(self, parallel_config, chunk_size, self._format_cls.preprocessing_function,
-                                    self._format_cls.finalizer_function, extra_args)
-
-        self.fetch()
-
     def get_attribute(self, key: str) -> Any:
         return getattr(self._attrs, key)
 
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import heapq
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from typing import TYPE_CHECKING
+
+from .cache import index_cache
+from .cloudobject import CloudObject
+from .entities import CloudDataFormat, CloudObjectSlice
+from .preprocessing.preprocess import adaptive_chunk_size, monolithic_preprocessing_many, mapreduce_preprocessing_many
+from .storage.metrics import map_in_context
+from .storage.picklableS3 import DEFAULT_MAX_POOL_CONNECTIONS, PickleableS3ClientProxy, S3Path
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3 import S3Client
+    from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetSlice(CloudObjectSlice):
+    """
+    Partition of a dataset, made of one or more slices of its objects
+    """
+
+    def __init__(self, slices: List[CloudObjectSlice], size: int):
+        super().__init__()
+        self.slices = slices
+        self.size = size  # Approximate size in bytes of the slices
+
+    def get(self) -> List[Any]:
+        return [s.get() for s in self.slices]
+
+
+class CloudDataset:
+    """
+    A set of objects of the same data format, e.g. all the objects under a prefix, that are preprocessed
+    and partitioned together
+    """
+
+    def __init__(self, data_format: CloudDataFormat, cloud_objects: List[CloudObject],
+                 max_workers: int = DEFAULT_MAX_POOL_CONNECTIONS):
+        self._format_cls = data_format
+        self._cloud_objects = cloud_objects
+        self._max_workers = max_workers
+
+    @classmethod
+    def from_s3(
+            cls,
+            data_format: CloudDataFormat,
+            storage_uri: str,
+            suffix: Optional[str] = None,
+            key_filter: Optional[Callable[[str], bool]] = None,
+            metadata_bucket: Optional[str] = None,
+            s3_config: Optional[Dict[str, Any]] = None,
+            storage: Optional[S3Client] = None,
+            max_workers: int = DEFAULT_MAX_POOL_CONNECTIONS,
+    ) -> CloudDataset:
+        """
+        Create a dataset with the objects under a prefix, e.g. ``s3://bucket/samples/``
+        :param suffix: Only include keys that end with this suffix, e.g. ``.vcf``
+        :param key_filter: Only include keys for which this function returns True
+        :param max_workers: Number of threads that make concurrent requests to fetch and partition the objects
+        """
+        path = S3Path.from_uri(storage_uri)
+        if storage is None:
+            storage = PickleableS3ClientProxy(**(s3_config or {}))
+
+        keys = []
+        kwargs = {"Bucket": path.bucket, "Prefix": path.key}
+        while True:
+            res = storage.list_objects_v2(**kwargs)
+            for obj in res.get("Contents", []):
+                key = obj["Key"]
+                if key.endswith("/") or (suffix is not None and not key.endswith(suffix)):
+                    continue
+                if key_filter is not None and not key_filter(key):
+                    continue
+                keys.append(key)
+            if not res.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = res["NextContinuationToken"]
+        logger.info("Found %d objects in %s", len(keys), storage_uri)
+
+        cloud_objects = CloudObject.from_s3_many(
+            data_format, [S3Path.from_bucket_key(path.bucket, key).as_uri() for key in keys],
+            metadata_bucket=metadata_bucket, storage=storage, max_workers=max_workers, ignore_missing=True
+        )
+        return cls(data_format, cloud_objects, max_workers)
+
+    @property
+    def cloud_objects(self) -> List[CloudObject]:
+        return self._cloud_objects
+
+    @property
+    def size(self) -> int:
+        return sum(co.size for co in self._cloud_objects)
+
+    def __len__(self) -> int:
+        return len(self._cloud_objects)
+
+    def __iter__(self) -> Iterator[CloudObject]:
+        return iter(self._cloud_objects)
+
+    def is_preprocessed(self) -> bool:
+        return all(co._meta_headers for co in self._cloud_objects)
+
+    def preprocess(self, parallel_config=None, extra_args=None, chunk_size=None, force=False, stage_partials=None,
+                   reduce_fanout=None, chunks_per_worker=None, resume=True):
+        """
+        Preprocess the objects of the dataset that are not preprocessed yet (all of them if ``force``), with all the
+        preprocessing jobs in a single joblib call. With ``chunk_size``, objects are preprocessed with mapreduce
+        in chunks of at most ``chunk_size`` bytes: the chunks of all objects are mapped together, then all objects
+        are reduced together. With ``chunks_per_worker`` instead, the chunk size is picked to split the objects in
+        about ``chunks_per_worker`` chunks per worker of the joblib backend. See ``CloudObject.preprocess`` for
+        ``stage_partials``, ``resume`` and ``reduce_fanout``. Objects whose metadata was stored by an interrupted
+        run are not preprocessed again, unless ``force``.
+        """
+        parallel_config = parallel_config or {}
+        extra_args = extra_args or {}
+
+        pending = [co for co in self._cloud_objects if force or not co._meta_headers]
+        if not pending:
+            return
+        logger.info("Preprocessing %d of %d objects", len(pending), len(self._cloud_objects))
+
+        meta_buckets = {}
+        for co in pending:
+            meta_buckets.setdefault(co.meta_path.bucket, co)
+        for co in meta_buckets.values():
+            co._create_meta_bucket()
+
+        if chunks_per_worker is not None:
+            assert chunk_size is None, "Set either chunk size or chunks per worker"
+            chunk_size = adaptive_chunk_size(sum(co.size for co in pending), parallel_config, chunks_per_worker)
+            logger.info("Preprocessing in chunks of %d bytes", chunk_size)
+
+        if chunk_size is None:
+            monolithic_preprocessing_many(pending, parallel_config, self._format_cls.preprocessing_function,
+                                          extra_args)
+        else:
+            assert chunk_size > 0, "Chunk size must be greater than 0"
+            assert self._format_cls.finalizer_function is not None, "Finalizer function must be defined for mapreduce"
+            empty = [co for co in pending if co.size == 0]
+            if empty:
+                logger.warning("Skipping %d empty objects, they can not be preprocessed in chunks", len(empty))
+                pending = [co for co in pending if co.size > 0]
+            # Objects smaller than the chunk size are preprocessed in a single chunk
+            mapreduce_preprocessing_many([(co, min(chunk_size, co.size)) for co in pending], parallel_config,
+                                         self._format_cls.preprocessing_function,
+                                         self._format_cls.finalizer_function, extra_args, stage_partials,
+                                         self._format_cls.combiner_function, reduce_fanout, self._format_cls.overlap,
+                                         resume)
+
+        # Metadata has been (re)written, drop stale headers and cached indexes before fetching them again
+        for co in pending:
+            index_cache.invalidate(co.meta_path.as_uri())
+            co._meta_headers = None
+        CloudObject.fetch_many(pending, max_workers=self._max_workers)
+
+    def partition(self, strategy, num_partitions: int, chunks_arg: str = "num_chunks",
+                  **kwargs) -> List[DatasetSlice]:
+        """
+        Partition the dataset in ``num_partitions`` balanced partitions. Objects larger than the partition size
+        (the dataset size divided by ``num_partitions``) are split with ``strategy``, which is called for each object
+        with the number of chunks for the object as ``chunks_arg`` (e.g. ``num_chunks`` or ``num_batches``) and
+        ``kwargs``. Slices of smaller objects are packed together in the same partition.
+        """
+        assert self.is_preprocessed(), "Dataset must be preprocessed before partitioning"
+        assert num_partitions > 0, "Number of partitions must be greater than 0"
+        partition_size = max(ceil(self.size / num_partitions), 1)
+
+        def _partition_object(co: CloudObject) -> List[CloudObjectSlice]:
+            num_chunks = max(ceil(co.size / partition_size), 1)
+            slices = strategy(co, **{chunks_arg: num_chunks}, **kwargs)
+            for s in slices:
+                s.cloud_object = co
+            return slices
+
+        # Strategies read the index of each object, which is done concurrently
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, max(len(self._cloud_objects), 1))) as pool:
+            object_slices = map_in_context(pool, _partition_object, self._cloud_objects)
+
+        items = []
+        for co, slices in zip(self._cloud_objects, object_slices):
+            for s in slices:
+                if s.range_0 is not None and s.range_1 is not None:
+                    slice_size = s.range_1 - s.range_0
+                else:
+                    slice_size = co.size // len(slices)
+                items.append((slice_size, len(items), s))
+
+        # Assign the largest slices first, each to the least loaded partition. Slices are at most the partition
+        # size, so partitions differ by less than one slice. Ties are broken by the number of slices, so that
+        # empty slices are spread over the partitions and none is left without slices.
+        bins = [(0, 0, i, []) for i in range(min(num_partitions, len(items)))]
+        heapq.heapify(bins)
+        for slice_size, order, s in sorted(items, key=lambda item: (-item[0], item[1])):
+            load, num_slices, i, members = heapq.heappop(bins)
+            members.append((order, s))
+            heapq.heappush(bins, (load + slice_size, num_slices + 1, i, members))
+
+        # Keep the order of the slices in the dataset within each partition, and of the partitions
+        partitions = [(min(members)[0], load, [s for _, s in sorted(members, key=lambda m: m[0])])
+                      for load, _, _, members in bins]
+        partitions.sort(key=lambda p: p[0])
+        return [DatasetSlice(slices, load) for _, load, slices in partitions]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}<{self._format_cls.co_class.__name__}>({len(self._cloud_objects)} objects)"
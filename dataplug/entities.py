@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import functools
 import inspect
 import logging
 from enum import Enum
 from pprint import pprint
 from typing import TYPE_CHECKING, Optional
 
+from . import tracing
+
 if TYPE_CHECKING:
     from typing import Callable
     from .cloudobject import CloudObject
@@ -19,11 +22,16 @@ class PreprocessingType(Enum):
 
 
 class CloudDataFormat:
-    def __init__(self, preprocessing_function: Callable = None, finalizer_function: Callable = None, is_folder=False):
+    def __init__(self, preprocessing_function: Callable = None, finalizer_function: Callable = None, is_folder=False,
+                 combiner_function: Callable = None, overlap: int = 0):
         self.co_class: object = None
 
         self.preprocessing_function = preprocessing_function
         self.finalizer_function = finalizer_function
+        # Associative merge of consecutive partial results into one, for tree reduction of mapreduce preprocessing
+        self.combiner_function = combiner_function
+        # Bytes read past the end of each chunk in mapreduce preprocessing, for records that straddle the boundary
+        self.overlap = overlap
         self.is_folder = is_folder
         self.attrs_types = {}
         self.default_attrs = {}
@@ -55,6 +63,8 @@ class CloudDataFormat:
             "co_class": self.co_class,
             "preprocessing_function": self.preprocessing_function,
             "finalizer_function": self.finalizer_function,
+            "combiner_function": self.combiner_function,
+            "overlap": self.overlap,
             "attrs_types": self.attrs_types,
             "default_attrs": self.default_attrs,
         })
@@ -66,9 +76,36 @@ class CloudObjectSlice:
         self.range_1: Optional[int] = range_1
         self.cloud_object: Optional[CloudObject] = None
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Run the get() of every slice type in a span, where formats time the phases of the read (see tracing)
+        if "get" in cls.__dict__:
+            cls.get = _traced_get(cls.get)
+
     def get(self):
         raise NotImplementedError()
 
+    def _span(self, name: str = "slice.get"):
+        """
+        Span of a read of the slice, for the read methods of slice types other than get()
+        """
+        return tracing.span(
+            name,
+            slice=type(self).__name__,
+            object=self.cloud_object.path.as_uri() if self.cloud_object is not None else "",
+            range_0=self.range_0 if self.range_0 is not None else -1,
+            range_1=self.range_1 if self.range_1 is not None else -1,
+        )
+
+
+def _traced_get(get):
+    @functools.wraps(get)
+    def traced_get(self, *args, **kwargs):
+        with self._span():
+            return get(self, *args, **kwargs)
+
+    return traced_get
+
 
 class PartitioningStrategy:
     """
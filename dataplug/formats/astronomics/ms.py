@@ -14,6 +14,7 @@ from casacore.tables import table
 
 from ...entities import CloudDataFormat, CloudObjectSlice, PartitioningStrategy
 from ...preprocessing.metadata import PreprocessingMetadata
+from ...storage.rangeread import read_object_ranges
 
 if TYPE_CHECKING:
     from typing import List
@@ -243,6 +244,26 @@ def _clone_template(template_path, output_path):
     print(f"[DATAPLUG] Cloned {template_path} to {output_path}")
 
 def _copy_byte_range(s3, bucket, ms_name, metadata, output_path, starting_row, end_row):
+    # Compute the byte range of every file first, so that all ranges are fetched concurrently
+    requests = []
+    for mutable in metadata:
+        key = f"{ms_name}/{mutable['file_name']}"
+        start_byte = mutable["block_size"] * starting_row
+        end_byte = mutable["block_size"] * (end_row +1) 
+        real_size = mutable["real_size"]
+
+        if start_byte < real_size:
+            # Range was requested inclusive of end_byte, clamped to the object size
+            requests.append((bucket, key, start_byte, min(end_byte + 1, real_size)))
+        else:
+            print("[DATAPLUG] Error with the range")
+
+    try:
+        file_datas = iter(read_object_ranges(s3, requests))
+    except Exception as e:
+        print(f"[DATAPLUG] Error retrieving the ranges of {ms_name}: {e}")
+        raise
+
     for mutable in metadata:
         file_name = mutable["file_name"]
         block_size = mutable["block_size"]
@@ -254,25 +275,7 @@ def _copy_byte_range(s3, bucket, ms_name, metadata, output_path, starting_row, e
         end_byte = block_size * (end_row +1) 
         requested_length = end_byte - start_byte
 
-        actual_end = min(end_byte, real_size)
-        if start_byte < real_size:
-            s3_range = f"bytes={start_byte}-{actual_end}"   # Consider if adjusting the range is needed
-            try:
-                try:
-                    response = s3.get_object(Bucket=bucket, Key=key, Range=s3_range)
-                except s3.exceptions.NoSuchKey:
-                    print(f"[DATAPLUG] Error: The object {key} does not exist.")                       
-                    file_data = b""
-                except s3.exceptions.InvalidRange:
-                    print(f"[DATAPLUG] Error: The range {s3_range} is invalid for the object {key}.")  
-                    file_data = b""
-                file_data = response["Body"].read()
-            except Exception as e:
-                print(f"[DATAPLUG] Error retrieving {key} with the range {s3_range}: {e}")
-                raise
-        else:
-            file_data = b""
-            print("[DATAPLUG] Error with the range")
+        file_data = next(file_datas) if start_byte < real_size else b""
 
         if requested_length % bucketsize == 0:
             padded_length = requested_length
@@ -2,105 +2,143 @@ from __future__ import annotations
 
 import io
 import logging
-import os
-import re
-import subprocess
+import pickle
 import tempfile
-import threading
 import time
+import zlib
+from dataclasses import dataclass
 from math import ceil
 from typing import TYPE_CHECKING
 
 import numpy as np
 import pandas as pd
 
+from ... import tracing
 from ...entities import CloudDataFormat, CloudObjectSlice, PartitioningStrategy
 from ...preprocessing.metadata import PreprocessingMetadata
 from ...util import force_delete_path
+from .zran import (
+    DEFAULT_SPACING,
+    AccessPoint,
+    ChunkBuffer,
+    GZipIndexBuilder,
+    index_gzip_chunk,
+    inflate_from_access_point,
+)
 
 if TYPE_CHECKING:
+    from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
     from ...cloudobject import CloudObject
 
 logger = logging.getLogger(__name__)
 
-# GZTool version 1.4.3
-# https://github.com/circulosmeos/gztool
-
 CHUNK_SIZE = 65536
-RE_WINDOWS = re.compile(r"#\d+: @ \d+ / \d+ L\d+ \( \d+ @\d+ \)")
-RE_NUMS = re.compile(r"\d+")
-RE_NLINES = re.compile(r"Number of lines\s+:\s+\d+")
-
-
-def _get_gztool_path():
+READ_SIZE = 1048576
+NEWLINE = ord("\n")
+INDEX_COLUMNS = ["window", "compressed_byte", "uncompressed_byte", "line_number", "window_size", "window_offset", "bits"]
+
+# Access point records in index files created by gztool (https://github.com/circulosmeos/gztool) v1.4.3
+# are preceded by a 16-byte header, indexes created with previous versions of dataplug are read from them
+GZTOOL_POINT_HEADER_SIZE = 16
+
+
+def preprocess_gzip(
+    cloud_object: CloudObject,
+    chunk_data: Optional[BinaryIO] = None,
+    chunk_id: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    num_chunks: Optional[int] = None,
+    spacing: int = DEFAULT_SPACING,
+) -> PreprocessingMetadata:
     """
-    Utility function that returns the absolute path for gzip file binary or raises exception if it is not found
-    TODO currently only works on unix-based systems
+    Create the access point index of a gzip archive.
+    The index is stored as a parquet offset table (metadata object) with one row per access point,
+    and a blob with the concatenated zlib-compressed windows of all access points (index_key object).
+
+    With monolithic preprocessing, the index is built in a single pass over the object body. With mapreduce
+    preprocessing, each chunk is indexed independently (see ``index_gzip_chunk``) and the chunk indexes
+    are merged by ``merge_gzip_index``.
     """
-    proc = subprocess.run(["which", "gztool"], check=True, capture_output=True, text=True)
-    path = proc.stdout.rstrip("\n")
-    logger.debug("Using gztool located in %s", path)
-    return path
+    if chunk_data is not None:
+        return _preprocess_gzip_chunk(cloud_object, chunk_data, chunk_id, chunk_size, num_chunks, spacing)
+
+    obj_res = cloud_object.storage.get_object(Bucket=cloud_object.path.bucket, Key=cloud_object.path.key)
+    assert obj_res.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200
+    data_stream = obj_res["Body"]
+
+    index_builder = GZipIndexBuilder(spacing=spacing)
+    try:
+        return _store_gzip_index(
+            cloud_object, index_builder, index_builder.build(iter(lambda: data_stream.read(READ_SIZE), b""))
+        )
+    finally:
+        if hasattr(data_stream, "close"):
+            data_stream.close()
+
+
+def _preprocess_gzip_chunk(cloud_object: CloudObject, chunk_data: BinaryIO, chunk_id: int, chunk_size: int,
+                           num_chunks: int, spacing: int) -> PreprocessingMetadata:
+    chunk_start = chunk_id * chunk_size
+    is_last = chunk_id == num_chunks - 1
+    chunk_end = cloud_object.size if is_last else min(chunk_start + chunk_size, cloud_object.size)
+
+    def _continuation(offset):
+        # Decoding of a chunk goes on until the next block boundary, which is past the end of the chunk data.
+        # Data is requested in ranges of READ_SIZE, as the boundary is usually close to the end of the chunk.
+        # Offsets past the end are not requested: storage ignores invalid ranges and returns the whole object.
+        while offset < cloud_object.size:
+            end = min(offset + READ_SIZE, cloud_object.size)
+            res = cloud_object.storage.get_object(
+                Bucket=cloud_object.path.bucket, Key=cloud_object.path.key, Range=f"bytes={offset}-{end - 1}"
+            )
+            yield res["Body"].read()
+            offset = end
 
+    t0 = time.perf_counter()
+    buffer = ChunkBuffer(chunk_data.read(), chunk_start, _continuation if chunk_start < cloud_object.size else None,
+                         cloud_object.size)
+    chunk_index = index_gzip_chunk(buffer, chunk_id, chunk_start, chunk_end, is_last, spacing)
+    t1 = time.perf_counter()
+    logger.debug("Indexed chunk %d (%d uncompressed bytes) in %.3f seconds",
+                 chunk_id, chunk_index.uncompressed_size, t1 - t0)
 
-def preprocess_gzip(cloud_object: CloudObject) -> PreprocessingMetadata:
+    return PreprocessingMetadata(metadata=pickle.dumps(chunk_index))
+
+
+def merge_gzip_index(cloud_object: CloudObject, chunk_metadata: Iterable[PreprocessingMetadata]) -> PreprocessingMetadata:
     """
-    Create index file from gzip archive using gztool (https://github.com/circulosmeos/gztool)
+    Merge the chunk indexes created by mapreduce preprocessing into the gzip index of the whole archive
     """
-    gztool = _get_gztool_path()
+    chunk_indexes = (pickle.loads(metadata.metadata) for metadata in chunk_metadata)
+    index_builder = GZipIndexBuilder()
+    return _store_gzip_index(cloud_object, index_builder, index_builder.merge(chunk_indexes, cloud_object.size))
+
+
+def _store_gzip_index(cloud_object: CloudObject, index_builder: GZipIndexBuilder,
+                      points: Iterable[AccessPoint]) -> PreprocessingMetadata:
     tmp_index_file_name = tempfile.mktemp()
     try:
-        obj_res = cloud_object.storage.get_object(Bucket=cloud_object.path.bucket, Key=cloud_object.path.key)
-        assert obj_res.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200
-        data_stream = obj_res["Body"]
-
-        force_delete_path(tmp_index_file_name)
         t0 = time.perf_counter()
+        columns = {column: [] for column in INDEX_COLUMNS}
+
+        with open(tmp_index_file_name, "wb") as index_file:
+            for window_id, point in enumerate(points):
+                compressed_window = zlib.compress(point.window) if point.window else b""
+                columns["window"].append(window_id + 1)
+                columns["compressed_byte"].append(point.compressed_byte)
+                columns["uncompressed_byte"].append(point.uncompressed_byte)
+                columns["line_number"].append(point.line_number)
+                columns["window_size"].append(len(compressed_window))
+                columns["window_offset"].append(index_file.tell())
+                columns["bits"].append(point.bits)
+                index_file.write(compressed_window)
+
+        total_lines = index_builder.total_lines
+        logger.debug("Indexed gzipped text file with %s total lines", total_lines)
+        t1 = time.perf_counter()
+        logger.debug("Index generated in %.3f seconds", t1 - t0)
 
-        # Create index and save to tmp file
-        # TODO tmp file is needed, sending to stdout is not working at the moment (todo fix)
-        index_proc = subprocess.Popen(
-            [gztool, "-i", "-x", "-I", tmp_index_file_name],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-
-        # TODO program might get stuck if subprocess fails, blocking io should be done in a background thread or using
-        #  async/await
-        try:
-            chunk = data_stream.read(CHUNK_SIZE)
-            while chunk != b"":
-                # logger.debug('Writing %d bytes to Pipe STDIN', len(chunk))
-                index_proc.stdin.write(chunk)
-                chunk = data_stream.read(CHUNK_SIZE)
-            if hasattr(data_stream, "close"):
-                data_stream.close()
-        except BrokenPipeError as e:
-            stdout, stderr = index_proc.communicate()
-            logger.error(stdout.decode("utf-8"))
-            logger.error(stderr.decode("utf-8"))
-            raise e
-
-        stdout, stderr = index_proc.communicate()
-        logger.debug(stdout.decode("utf-8"))
-        logger.debug(stderr.decode("utf-8"))
-        if index_proc.returncode > 0:
-            logger.debug(stdout.decode("utf-8"))
-            logger.debug(stderr.decode("utf-8"))
-            raise Exception("Error creating gz index")
-
-        # Generate list of access windows from index
-        proc = subprocess.run(
-            [gztool, "-ell", "-I", tmp_index_file_name],
-            check=True,
-            capture_output=True,
-            text=True,
-        )
-        output = proc.stdout
-        # logger.debug(output)
-
-        # Store index binary file
+        # Store windows binary file
         gzip_index_key = cloud_object.meta_path.key + ".idx"
         cloud_object.storage.upload_file(
             Filename=tmp_index_file_name,
@@ -108,40 +146,15 @@ def preprocess_gzip(cloud_object: CloudObject) -> PreprocessingMetadata:
             Key=gzip_index_key,
         )
 
-        # Get the total number of lines
-        total_lines = int(RE_NUMS.findall(RE_NLINES.findall(output).pop()).pop())
-        logger.debug("Indexed gzipped text file with %s total lines", total_lines)
-        t1 = time.perf_counter()
-        logger.debug("Index generated in %.3f seconds", t1 - t0)
-
-        # Generator function that parses output to avoid copying all window data as lists
-        def _lines_generator():
-            for f in RE_WINDOWS.finditer(output):
-                nums = [int(n) for n in RE_NUMS.findall(f.group())]
-                yield nums
-
         # Generate data frame that stores gzip index windows offsets
-        df = pd.DataFrame(
-            _lines_generator(),
-            columns=[
-                "window",
-                "compressed_byte",
-                "uncompressed_byte",
-                "line_number",
-                "window_size",
-                "window_offset",
-            ],
-        )
+        df = pd.DataFrame({column: np.asarray(values, dtype=np.int64) for column, values in columns.items()})
         df.set_index(["window"], inplace=True)
 
         # Store data frame as parquet
         out_stream = io.BytesIO()
         df.to_parquet(out_stream, engine="pyarrow")
-        # df.to_csv(os.path.join(tempfile.gettempdir(), f'{meta.obj_path.stem}.csv'))  # debug
-
-        os.remove(tmp_index_file_name)
-
         out_stream.seek(0)
+
         return PreprocessingMetadata(
             metadata=out_stream,
             attributes={
@@ -153,43 +166,105 @@ def preprocess_gzip(cloud_object: CloudObject) -> PreprocessingMetadata:
         force_delete_path(tmp_index_file_name)
 
 
-def _get_ranges_from_line_pairs(cloud_object: CloudObject, pairs):
-    meta_obj = cloud_object.storage.get_object(Bucket=cloud_object.meta_path.bucket, Key=cloud_object.meta_path.key)
-    meta_buff = io.BytesIO(meta_obj["Body"].read())
-    meta_buff.seek(0)
-    df = pd.read_parquet(meta_buff)
+def _read_gztool_access_point(cloud_object: CloudObject, index_key: str, window_offset: int, window_size: int,
+                               line_number: int):
+    """
+    Read a single access point record from a (legacy) gztool index file with a ranged GET.
+    The record fields preceding the compressed window are: bits (uint32), line number (uint64)
+    and window size (uint32), encoded as big-endian integers.
+    """
+    res = cloud_object.storage.get_object(
+        Bucket=cloud_object.meta_path.bucket,
+        Key=index_key,
+        Range=f"bytes={window_offset - GZTOOL_POINT_HEADER_SIZE}-{window_offset + window_size - 1}",
+    )
+    record = res["Body"].read()
+    header, compressed_window = record[:GZTOOL_POINT_HEADER_SIZE], record[GZTOOL_POINT_HEADER_SIZE:]
+
+    for byteorder in ("big", "little"):
+        bits = int.from_bytes(header[0:4], byteorder)
+        record_line = int.from_bytes(header[4:12], byteorder)
+        record_window_size = int.from_bytes(header[12:16], byteorder)
+        if record_window_size == window_size and record_line == line_number and bits < 8:
+            return bits, zlib.decompress(compressed_window)
+
+    raise Exception(f"Access point record at offset {window_offset} of {index_key} does not match the index")
+
+
+def _load_gzip_index(data: bytes) -> pd.DataFrame:
+    return pd.read_parquet(io.BytesIO(data))
+
+
+def _resolve_line_pairs(cloud_object: CloudObject, pairs) -> tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """
+    Resolve (line_0, line_1) pairs to compressed byte ranges using the gzip index windows.
+    All pairs are resolved at once with a binary search over the window line numbers.
+    :return: tuple with an array of shape (len(pairs), 2) with the (range_0, range_1) compressed offsets for each pair,
+             the index position of the head window of each pair, and the index data frame
+    """
+    df = cloud_object.load_index(_load_gzip_index)
     line_indexes = df["line_number"].to_numpy()
-    num_windows = df.shape[0]
-
-    byte_ranges = [None] * len(pairs)
-    for i, (line_0, line_1) in enumerate(pairs):
-        # Find the closest window index for line_0
-        window_head_idx = (np.abs(line_indexes - line_0)).argmin()
-        # Check if window line entry pont is past requested line_0, if so, get previous window
-        window_head_line = df.iloc[window_head_idx]["line_number"]
-        if window_head_line > line_0:
-            window_head_idx = window_head_idx - 1
-        # Get offset in compressed archive for window 0
-        window0_offset = df.iloc[window_head_idx]["compressed_byte"]
-
-        # Find the closest window index for line_0
-        widow_tail_idx = (np.abs(line_indexes - line_1)).argmin()
-        # Check if window line entry pont is before requested line_1, if so, get next window
-        window_tail_line = df.iloc[widow_tail_idx]["line_number"]
-        if window_tail_line < line_1:
-            widow_tail_idx = widow_tail_idx + 1
-        if widow_tail_idx >= num_windows:
-            # Adjust offset for lines inside last window, use end of compressed archive for 2nd offset
-            window1_offset = cloud_object.size
-        else:
-            window1_offset = df.iloc[widow_tail_idx]["compressed_byte"]
+    compressed_bytes = df["compressed_byte"].to_numpy()
+    num_windows = line_indexes.shape[0]
+
+    pairs = np.asarray(pairs, dtype=np.int64).reshape((-1, 2))
+    lines_0, lines_1 = pairs[:, 0], pairs[:, 1]
 
-        byte_ranges[i] = (window0_offset, window1_offset)
+    # Head window is the last window whose line entry point is before line_0. A window entering at line_0 may
+    # begin in the middle of that line, so the previous window is used to decompress the line from its start
+    window_head_idx = np.searchsorted(line_indexes, lines_0, side="left") - 1
+    window_head_idx = np.clip(window_head_idx, 0, num_windows - 1)
 
+    # Tail window is the first window whose line entry point is not before line_1
+    window_tail_idx = np.searchsorted(line_indexes, lines_1, side="left")
+
+    byte_ranges = np.empty((pairs.shape[0], 2), dtype=np.int64)
+    byte_ranges[:, 0] = compressed_bytes[window_head_idx]
+    # Lines inside last window use the end of the compressed archive for the 2nd offset
+    in_last_window = window_tail_idx >= num_windows
+    byte_ranges[:, 1] = np.where(
+        in_last_window, cloud_object.size, compressed_bytes[np.minimum(window_tail_idx, num_windows - 1)]
+    )
+
+    return byte_ranges, window_head_idx, df
+
+
+def _get_ranges_from_line_pairs(cloud_object: CloudObject, pairs) -> np.ndarray:
+    """
+    Resolve (line_0, line_1) pairs to compressed byte ranges using the gzip index windows.
+    :return: array of shape (len(pairs), 2) with the (range_0, range_1) compressed offsets for each pair
+    """
+    byte_ranges, _, _ = _resolve_line_pairs(cloud_object, pairs)
     return byte_ranges
 
 
-@CloudDataFormat(preprocessing_function=preprocess_gzip)
+def _get_slices_from_line_pairs(cloud_object: CloudObject, pairs) -> List[GZipTextSlice]:
+    """
+    Create slices for (line_0, line_1) pairs. The head access point of each slice is resolved here, so that
+    workers read only the compressed window they need from the index blob, without loading the offset table.
+    """
+    byte_ranges, window_head_idx, df = _resolve_line_pairs(cloud_object, pairs)
+    line_numbers = df["line_number"].to_numpy()[window_head_idx]
+    window_offsets = df["window_offset"].to_numpy()[window_head_idx]
+    window_sizes = df["window_size"].to_numpy()[window_head_idx]
+    # Indexes created with gztool store the bits of each access point in the window record
+    bits = df["bits"].to_numpy()[window_head_idx] if "bits" in df.columns else None
+
+    return [
+        GZipTextSlice(
+            int(line_0), int(line_1), int(range_0), int(range_1),
+            access_point=GZipAccessPoint(
+                line_number=int(line_numbers[i]),
+                bits=int(bits[i]) if bits is not None else None,
+                window_offset=int(window_offsets[i]),
+                window_size=int(window_sizes[i]),
+            ),
+        )
+        for i, ((line_0, line_1), (range_0, range_1)) in enumerate(zip(pairs, byte_ranges))
+    ]
+
+
+@CloudDataFormat(preprocessing_function=preprocess_gzip, finalizer_function=merge_gzip_index)
 class GZipText:
     total_lines: int
     index_key: str
@@ -208,156 +283,225 @@ def partition_chunk_lines(cloud_object: CloudObject, lines_per_chunk, strategy="
     """
     total_lines = int(cloud_object.get_attribute("total_lines"))
     parts = ceil(total_lines / lines_per_chunk)
-    pairs = [((lines_per_chunk * i) + 1, (lines_per_chunk * i) + lines_per_chunk) for i in range(parts)]
+    # Line pairs are [line_0, line_1) (first element is inclusive, second element is exclusive)
+    pairs = [((lines_per_chunk * i) + 1, (lines_per_chunk * (i + 1)) + 1) for i in range(parts)]
 
     # Adjust last pair
-    if pairs[-1][1] > total_lines:
-        if strategy == "expand":
+    if pairs[-1][1] > total_lines + 1:
+        if strategy == "expand" or len(pairs) == 1:
             l0, _ = pairs[-1]
-            pairs[-1] = (l0, total_lines)
+            pairs[-1] = (l0, total_lines + 1)
         elif strategy == "merge":
-            l0, l1 = pairs.pop()
-            extra = l1 - l0
-            pair = pairs[-1]
-            pairs[-1] = pair[0], pair[1] + extra
+            pairs.pop()
+            l0, _ = pairs[-1]
+            pairs[-1] = (l0, total_lines + 1)
         else:
             raise Exception(f"Unknown strategy {strategy}")
 
-    byte_ranges = _get_ranges_from_line_pairs(cloud_object, pairs)
-    chunks = [
-        GZipTextSlice(line_0, line_1, range_0, range_1)
-        for (line_0, line_1), (range_0, range_1) in zip(byte_ranges, pairs)
-    ]
-
-    return chunks
+    return _get_slices_from_line_pairs(cloud_object, pairs)
 
 
 @PartitioningStrategy(dataformat=GZipText)
-def partition_num_chunks(self, n_chunks):
-    # TODO implement this strategy
-    raise NotImplementedError()
+def partition_num_chunks(cloud_object: CloudObject, n_chunks: int, line_alignment: int = 1) -> List[GZipTextSlice]:
+    """
+    Partitioning strategy for GZipped compressed text files, it partitions the archive in a number of chunks
+    of balanced compressed size, so that each partition downloads and decompresses a similar amount of data
+    regardless of the length of its lines. Partitions start at the first line after the access point closest to
+    an even split of the compressed size, so they cannot be smaller than the index spacing: fewer than n_chunks
+    partitions may be returned for small archives.
+    :param cloud_object: Parent cloud object
+    :param n_chunks: Number of partitions
+    :param line_alignment: Number of lines of a record, the first line of every partition is the first line
+           of a record (e.g. 4 for FASTQ)
+    :return:
+    """
+    total_lines = int(cloud_object.get_attribute("total_lines"))
+    df = cloud_object.load_index(_load_gzip_index)
+    compressed_bytes = df["compressed_byte"].to_numpy()
+    line_indexes = df["line_number"].to_numpy()
+
+    # Access point closest to each split point of the compressed archive
+    targets = (np.arange(1, n_chunks, dtype=np.float64) * cloud_object.size / n_chunks).astype(np.int64)
+    idx = np.clip(np.searchsorted(compressed_bytes, targets), 1, compressed_bytes.shape[0] - 1)
+    closest = np.where(targets - compressed_bytes[idx - 1] < compressed_bytes[idx] - targets, idx - 1, idx)
+    # The first access point starts the first partition, and a partition can not start at the same point twice
+    closest = np.unique(closest[closest > 0])
+
+    # The line of an access point may begin before it, so partitions start at the next (aligned) line
+    first_lines = line_indexes[closest] + 1
+    first_lines += (-(first_lines - 1)) % line_alignment
+    first_lines = np.unique(first_lines[(first_lines > 1) & (first_lines <= total_lines)])
+
+    bounds = [1] + first_lines.tolist() + [total_lines + 1]
+    pairs = list(zip(bounds[:-1], bounds[1:]))
+
+    return _get_slices_from_line_pairs(cloud_object, pairs)
+
+
+@dataclass
+class GZipAccessPoint:
+    line_number: int  # Line number of the first uncompressed byte of the access point
+    bits: Optional[int]  # Bits of the previous compressed byte that belong to the access point, None for gztool indexes
+    window_offset: int  # Offset of the compressed window in the index blob
+    window_size: int  # Size of the compressed window, 0 if the access point has no window
 
 
 class GZipTextSlice(CloudObjectSlice):
-    def __init__(self, line_0, line_1, *args, **kwargs):
+    def __init__(self, line_0, line_1, *args, access_point: Optional[GZipAccessPoint] = None, **kwargs):
         self.line_0 = line_0
         self.line_1 = line_1
+        self.access_point = access_point
         super().__init__(*args, **kwargs)
 
-    def _lines_iterator(self):
-        tmp_index_file = tempfile.mktemp()
-        gztool = _get_gztool_path()
-        lines_to_read = self.line_1 - self.line_0 + 1
-        lines_read = 0
+    def _get_access_point(self):
+        """
+        Get the entry point window for this slice, returns (line_number, bits, window)
+        Only the compressed window of the access point at range_0 is read from the index file. If the slice was
+        created without its access point, it is looked up in the index offset table.
+        """
+        access_point = self.access_point
+        if access_point is None:
+            df = self.cloud_object.load_index(_load_gzip_index)
+            window_idx = np.searchsorted(df["compressed_byte"].to_numpy(), self.range_0)
+            access_point = GZipAccessPoint(
+                line_number=int(df["line_number"].iat[window_idx]),
+                bits=int(df["bits"].iat[window_idx]) if "bits" in df.columns else None,
+                window_offset=int(df["window_offset"].iat[window_idx]),
+                window_size=int(df["window_size"].iat[window_idx]),
+            )
 
-        try:
-            t0 = time.perf_counter()
-            # Get index and store it to temp file
-            self.cloud_object.storage.download_file(
-                Bucket=self.cloud_object.meta_path.bucket,
-                Key=self.cloud_object["index_key"],
-                Filename=tmp_index_file,
+        if access_point.window_size == 0:
+            # Access point at the start of a gzip member, it has no window
+            return access_point.line_number, 0, None
+
+        if access_point.bits is None:
+            bits, window = _read_gztool_access_point(
+                self.cloud_object, self.cloud_object["index_key"], access_point.window_offset,
+                access_point.window_size, access_point.line_number
             )
+            return access_point.line_number, bits, window
 
-            # Get compressed byte range
+        res = self.cloud_object.storage.get_object(
+            Bucket=self.cloud_object.meta_path.bucket,
+            Key=self.cloud_object["index_key"],
+            Range=f"bytes={access_point.window_offset}-{access_point.window_offset + access_point.window_size - 1}",
+        )
+        window = zlib.decompress(res["Body"].read())
+        return access_point.line_number, access_point.bits, window
+
+    def _chunks_iterator(self) -> Iterator[memoryview]:
+        """
+        Decompress the slice and yield the uncompressed data in chunks, trimmed to the first byte of line_0 and
+        the newline that ends line line_1 - 1. Lines may span consecutive chunks.
+        """
+        lines_to_read = self.line_1 - self.line_0
+        if lines_to_read <= 0:
+            return
+
+        span = tracing.current_span()
+        with span.phase("access_point"):
+            window_line, bits, window = self._get_access_point()
+        # Skip lines from the access point entry line up to line_0
+        lines_to_skip = self.line_0 - window_line
+
+        # Get compressed byte range, starting at the byte that holds the first bits of the access point if needed
+        range_0 = self.range_0 - 1 if bits else self.range_0
+        with span.phase("download"):
             res = self.cloud_object.storage.get_object(
                 Bucket=self.cloud_object.path.bucket,
                 Key=self.cloud_object.path.key,
-                Range=f"bytes={self.range_0 - 1}-{self.range_1 - 1}",
+                Range=f"bytes={range_0}-{self.range_1 - 1}",
             )
-            body = res["Body"]
-
-            cmd = [
-                gztool,
-                "-I",
-                tmp_index_file,
-                "-n",
-                str(self.range_0),
-                "-L",
-                str(self.line_0),
-            ]
-            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-
-            # TODO program might get stuck if subprocess fails
-            # blocking io should be done in a background thread or using async/await
-            def _writer_feeder():
-                logger.debug("Writer thread started")
-                input_chunk = body.read(CHUNK_SIZE)
-                while input_chunk != b"":
-                    # logger.debug('Writing %d bytes to pipe', len(chunk))
-                    try:
-                        proc.stdin.write(input_chunk)
-                    except BrokenPipeError:
-                        break
-                    input_chunk = body.read(CHUNK_SIZE)
-                try:
-                    proc.stdin.flush()
-                    proc.stdin.close()
-                except BrokenPipeError:
-                    pass
-                logger.debug("Writer thread finished")
-
-            writer_thread = threading.Thread(target=_writer_feeder)
-            writer_thread.start()
-
-            output_chunk = proc.stdout.read(CHUNK_SIZE)
-            last_line = None
-            while output_chunk != b"":
-                # logger.debug('Read %d bytes from pipe', len(chunk))
-                text = output_chunk.decode("utf-8")
-                chunk_lines = text.splitlines()
-
-                if last_line is not None:
-                    last_line = last_line + chunk_lines.pop(0)
-                    lines_read += 1
-                    if lines_read >= lines_to_read:
-                        proc.stdout.close()
-                        break
-                    yield last_line
-                    last_line = None
-                if text[-1] != "\n":
-                    last_line = chunk_lines.pop()
-
-                for line in chunk_lines:
-                    lines_read += 1
-                    if lines_read >= lines_to_read:
-                        # Stop decompressing lines if number of lines to read in this chunk is reached
-                        proc.stdout.close()
-                        break
-                    yield line
-
-                # Try to read next decompressed chunk
-                # a ValueError is raised if the pipe is closed, meaning the writer or the subprocess closed it
-                try:
-                    output_chunk = proc.stdout.read(CHUNK_SIZE)
-                except ValueError:
-                    output_chunk = b""
-
-            try:
-                proc.wait()
-            except ValueError as e:
-                logger.error(e)
-
-            writer_thread.join()
-
-            t1 = time.perf_counter()
-            logger.debug("Got partition in %.3f seconds", t1 - t0)
-        finally:
-            force_delete_path(tmp_index_file)
+        body = res["Body"]
+        compressed_chunks = span.iter("download", iter(lambda: body.read(CHUNK_SIZE), b""))
 
-    def get(self):
+        try:
+            for output_chunk in span.iter("inflate", inflate_from_access_point(compressed_chunks, bits, window)):
+                with span.phase("lines"):
+                    output_chunk = memoryview(output_chunk)
+                    if lines_to_skip > 0:
+                        newlines = np.flatnonzero(np.frombuffer(output_chunk, dtype=np.uint8) == NEWLINE)
+                        if newlines.shape[0] < lines_to_skip:
+                            lines_to_skip -= newlines.shape[0]
+                            continue
+                        output_chunk = output_chunk[newlines[lines_to_skip - 1] + 1:]
+                        lines_to_skip = 0
+
+                    newlines = np.flatnonzero(np.frombuffer(output_chunk, dtype=np.uint8) == NEWLINE)
+                    last_chunk = newlines.shape[0] >= lines_to_read
+                    if last_chunk:
+                        # Stop decompressing if number of lines to read in this slice is reached
+                        output_chunk = output_chunk[:newlines[lines_to_read - 1] + 1]
+                    else:
+                        lines_to_read -= newlines.shape[0]
+                if len(output_chunk):
+                    yield output_chunk
+                if last_chunk:
+                    break
+        finally:
+            body.close()
+
+    def _lines_iterator(self) -> Iterator[str]:
+        span = tracing.current_span()
+        last_line = b""
+        for chunk in self._chunks_iterator():
+            with span.phase("split"):
+                data = last_line + chunk
+                last_newline = data.rfind(b"\n")
+                if last_newline == -1:
+                    last_line = data
+                    continue
+                last_line = data[last_newline + 1:]
+                lines = data[:last_newline].decode("utf-8").split("\n")
+            yield from lines
+
+        if last_line:
+            # Last line of the archive without trailing newline
+            yield last_line.decode("utf-8")
+
+    def get(self) -> List[str]:
         return list(self._lines_iterator())
 
-    def iter_lines(self):
-        return self._lines_iterator()
+    def iter_lines(self) -> Iterator[str]:
+        with self._span("slice.iter_lines"):
+            yield from self._lines_iterator()
+
+    def iter_chunks(self) -> Iterator[memoryview]:
+        """
+        Iterate over the uncompressed data of the slice, without decoding it into lines.
+        Chunks are views of the decompressor output, lines may span consecutive chunks.
+        """
+        with self._span("slice.iter_chunks"):
+            yield from self._chunks_iterator()
+
+    def get_bytes(self, line_offsets: bool = False) -> Union[bytes, Tuple[bytes, np.ndarray]]:
+        """
+        Get the uncompressed data of the slice, from the start of line_0 to the end of line line_1 - 1 (including
+        its newline, if any).
+        :param line_offsets: Also return an array with the offset of the start of every line, plus the data length,
+                             so that line i is ``data[offsets[i]:offsets[i + 1]]`` (including its newline)
+        """
+        with self._span("slice.get_bytes"):
+            data = b"".join(self._chunks_iterator())
+        if not line_offsets:
+            return data
+
+        newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == NEWLINE)
+        offsets = np.empty(newlines.shape[0] + 1, dtype=np.int64)
+        offsets[0] = 0
+        offsets[1:] = newlines + 1
+        if data and data[-1] != NEWLINE:
+            offsets = np.append(offsets, len(data))
+        return data, offsets
 
     def to_file(self, file_name):
-        with open(file_name, "w") as f:
+        with open(file_name, "w") as f, self._span("slice.to_file"):
             for line in self._lines_iterator():
                 f.write(line + "\n")
 
     def to_file_obj(self, file_obj, close_fd=False):
-        for line in self._lines_iterator():
-            file_obj.write(line + "\n")
+        with self._span("slice.to_file"):
+            for line in self._lines_iterator():
+                file_obj.write(line + "\n")
         if close_fd and hasattr(file_obj, "close"):
             file_obj.close()
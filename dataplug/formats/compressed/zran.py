@@ -0,0 +1,790 @@
+"""
+Random access to gzip (deflate) streams from stored access points, in the spirit of zlib's zran.c example.
+
+An access point is a position in the compressed stream where a deflate block begins, together with the
+last 32 KiB of uncompressed data that precede it (the window). Inflation can be resumed at an access point
+by presetting the window as dictionary of a raw inflate stream.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import zlib
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from typing import Callable, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SIZE = 32768
+GZIP_TRAILER_SIZE = 8
+GZIP_MAGIC = b"\x1f\x8b"
+DEFAULT_SPACING = 10 * 1024 * 1024  # 10 MiB, same as gztool default span
+OUT_BUFFER_SIZE = 262144
+READ_SIZE = 1048576
+SCAN_SIZE = 65536
+MAX_HEADER_SIZE = 65536
+NEWLINE = ord("\n")
+
+# zlib constants not exposed by the Python zlib module
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BUF_ERROR = -5
+Z_BLOCK = 5
+
+# Dictionaries for inflating without the preceding data: each byte of the window encodes its own position, so bytes
+# copied from the window can be told apart from literals and mapped to the window position they were copied from
+_WINDOW_POSITIONS = np.arange(WINDOW_SIZE, dtype=np.uint16)
+_LO_WINDOW = (_WINDOW_POSITIONS & 0xFF).astype(np.uint8).tobytes()
+_HI_WINDOW = (_WINDOW_POSITIONS >> 8).astype(np.uint8).tobytes()
+_HI2_WINDOW = ((_WINDOW_POSITIONS >> 8) | 0x80).astype(np.uint8).tobytes()
+_DUMMY_WINDOW = _LO_WINDOW
+
+
+def _inflate_members(data: bytes, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Decompress the gzip members that follow the end of a member. ``data`` starts at the trailer of the previous member.
+    """
+    decompressor = None
+    skip = GZIP_TRAILER_SIZE
+
+    while True:
+        while data:
+            if skip:
+                skipped = min(skip, len(data))
+                data = data[skipped:]
+                skip -= skipped
+                continue
+
+            new_member = decompressor is None
+            if new_member:
+                decompressor = zlib.decompressobj(31)
+            try:
+                out = decompressor.decompress(data)
+            except zlib.error as e:
+                if new_member:
+                    # Data after the last gzip member which is not a gzip header (e.g. zero padding)
+                    logger.debug("Stopped inflating at non-gzip trailing data (%s)", e)
+                    return
+                raise
+            if out:
+                yield out
+
+            if decompressor.eof:
+                # The gzip wrapper consumes the trailer, continue with the next member if there is more data
+                data = decompressor.unused_data
+                decompressor = None
+            else:
+                data = b""
+
+        data = next(chunks, b"")
+        if not data:
+            break
+
+    if decompressor is not None:
+        out = decompressor.flush()
+        if out:
+            yield out
+
+
+def inflate_from_access_point(
+        chunks: Iterable[bytes], bits: int = 0, window: Optional[bytes] = None
+) -> Iterator[bytes]:
+    """
+    Decompress a gzip stream starting from an access point.
+
+    :param chunks: Iterable of compressed data chunks. If ``bits`` is not 0, the first byte is the partial byte that
+                   precedes the access point byte offset, otherwise data starts exactly at the access point
+    :param bits: Number of bits of the first byte that belong to the first deflate block
+    :param window: Uncompressed data preceding the access point (up to 32 KiB), or None if the access point
+                   has no history (start of a gzip member)
+    :return: Generator of decompressed data chunks. Decompression finishes when input is exhausted, which may happen
+             in the middle of the stream if only a byte range of the archive was provided
+    """
+    chunks = iter(chunks)
+    if bits:
+        yield from _inflate_primed(chunks, int(bits), window)
+        return
+
+    # The member of the access point is inflated as raw deflate, its trailer is handled in _inflate_members
+    decompressor = zlib.decompressobj(-15, zdict=window) if window else zlib.decompressobj(-15)
+
+    for data in chunks:
+        out = decompressor.decompress(data)
+        if out:
+            yield out
+
+        if decompressor.eof:
+            yield from _inflate_members(decompressor.unused_data, chunks)
+            return
+
+    out = decompressor.flush()
+    if out:
+        yield out
+
+
+def _inflate_primed(chunks: Iterator[bytes], bits: int, window: Optional[bytes]) -> Iterator[bytes]:
+    """
+    Decompress from an access point that starts in the middle of a byte. The remaining bits of that byte are
+    loaded with inflatePrime, which keeps the input aligned to the original bytes (stored blocks are byte-aligned),
+    so the Python zlib module can not be used.
+    """
+    data = b""
+    for data in chunks:
+        if data:
+            break
+    if not data:
+        return
+
+    inflater = Inflater(wbits=-15)
+    try:
+        if window:
+            inflater.set_dictionary(window)
+        inflater.prime(bits, data[0] >> (8 - bits))
+        inflater.feed(data[1:])
+        while True:
+            ret, out = inflater.inflate()
+            if out:
+                yield out
+            if ret == Z_STREAM_END:
+                # The trailer (and following members) start at the first unconsumed byte
+                rest = inflater.unused_data
+                inflater.close()
+                yield from _inflate_members(rest, chunks)
+                return
+            if inflater.avail_in == 0 and len(out) < OUT_BUFFER_SIZE:
+                data = next(chunks, b"")
+                if not data:
+                    return
+                inflater.feed(data)
+    finally:
+        inflater.close()
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ("next_in", ctypes.c_void_p),
+        ("avail_in", ctypes.c_uint),
+        ("total_in", ctypes.c_ulong),
+        ("next_out", ctypes.c_void_p),
+        ("avail_out", ctypes.c_uint),
+        ("total_out", ctypes.c_ulong),
+        ("msg", ctypes.c_char_p),
+        ("state", ctypes.c_void_p),
+        ("zalloc", ctypes.c_void_p),
+        ("zfree", ctypes.c_void_p),
+        ("opaque", ctypes.c_void_p),
+        ("data_type", ctypes.c_int),
+        ("adler", ctypes.c_ulong),
+        ("reserved", ctypes.c_ulong),
+    ]
+
+
+_libz = None
+
+
+def _get_libz():
+    """
+    Load the system zlib shared library. The Python zlib module does not expose inflate with Z_BLOCK,
+    which is needed to stop at deflate block boundaries, so it is called through ctypes.
+    """
+    global _libz
+    if _libz is None:
+        path = ctypes.util.find_library("z") or ctypes.util.find_library("zlib")
+        if path is None:
+            raise OSError("zlib shared library not found, it is required to index gzip archives")
+        lib = ctypes.CDLL(path)
+        lib.zlibVersion.restype = ctypes.c_char_p
+        lib.inflateInit2_.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        lib.inflate.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int]
+        lib.inflateEnd.argtypes = [ctypes.POINTER(_ZStream)]
+        lib.inflateReset.argtypes = [ctypes.POINTER(_ZStream)]
+        lib.inflatePrime.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int, ctypes.c_int]
+        lib.inflateSetDictionary.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_char_p, ctypes.c_uint]
+        _libz = lib
+    return _libz
+
+
+class Inflater:
+    """
+    Minimal ctypes wrapper around a zlib inflate stream that decompresses one deflate block at a time (Z_BLOCK)
+    and reports the stream position at block boundaries.
+    """
+
+    def __init__(self, wbits: int = 47, out_size: int = OUT_BUFFER_SIZE):
+        self._lib = _get_libz()
+        self._strm = _ZStream()
+        self._out = ctypes.create_string_buffer(out_size)
+        self._out_size = out_size
+        self._in = None  # keep a reference to the input bytes while zlib reads from them
+        ret = self._lib.inflateInit2_(ctypes.byref(self._strm), wbits, self._lib.zlibVersion(),
+                                      ctypes.sizeof(_ZStream))
+        if ret != Z_OK:
+            raise zlib.error(f"inflateInit2 failed with error {ret}")
+
+    @property
+    def avail_in(self) -> int:
+        return self._strm.avail_in
+
+    @property
+    def at_block_boundary(self) -> bool:
+        # Bit 7 of data_type is set when inflate stopped after a block end or a gzip header
+        return bool(self._strm.data_type & 128)
+
+    @property
+    def at_last_block(self) -> bool:
+        # Bit 6 of data_type is set when the block that follows is the last one of the deflate stream
+        return bool(self._strm.data_type & 64)
+
+    @property
+    def bits(self) -> int:
+        # Number of unused bits in the last consumed byte, which belong to the next block
+        return self._strm.data_type & 7
+
+    @property
+    def unused_data(self) -> bytes:
+        # Input that has been fed but not consumed
+        return self._in[len(self._in) - self._strm.avail_in:] if self._in is not None else b""
+
+    def feed(self, data: bytes):
+        self._in = data
+        self._strm.next_in = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+        self._strm.avail_in = len(data)
+
+    def prime(self, bits: int, value: int):
+        self._check(self._lib.inflatePrime(ctypes.byref(self._strm), bits, value), "inflatePrime")
+
+    def set_dictionary(self, window: bytes):
+        self._check(self._lib.inflateSetDictionary(ctypes.byref(self._strm), window, len(window)),
+                    "inflateSetDictionary")
+
+    def inflate(self) -> tuple[int, bytes]:
+        """
+        Inflate available input until the output buffer is full, the input is exhausted or a block boundary is reached.
+        :return: tuple with zlib return code (Z_OK, Z_STREAM_END or Z_BUF_ERROR) and the decompressed data
+        """
+        self._strm.next_out = ctypes.cast(self._out, ctypes.c_void_p)
+        self._strm.avail_out = self._out_size
+        ret = self._lib.inflate(ctypes.byref(self._strm), Z_BLOCK)
+        if ret not in (Z_OK, Z_STREAM_END, Z_BUF_ERROR):
+            msg = self._strm.msg.decode() if self._strm.msg else ret
+            raise zlib.error(f"Error {ret} while inflating: {msg}")
+        produced = self._out_size - self._strm.avail_out
+        return ret, ctypes.string_at(self._out, produced)
+
+    def reset(self):
+        self._check(self._lib.inflateReset(ctypes.byref(self._strm)), "inflateReset")
+
+    def close(self):
+        if self._strm is not None:
+            self._lib.inflateEnd(ctypes.byref(self._strm))
+            self._strm = None
+
+    def __del__(self):
+        self.close()
+
+    @staticmethod
+    def _check(ret: int, func: str):
+        if ret != Z_OK:
+            raise zlib.error(f"{func} failed with error {ret}")
+
+
+@dataclass
+class AccessPoint:
+    compressed_byte: int  # Offset of the first full byte of the access point in the compressed archive
+    bits: int  # Number of bits of the previous byte that belong to the access point block
+    uncompressed_byte: int  # Offset in the uncompressed data
+    line_number: int  # Line (starting in 1) which contains the first uncompressed byte of the access point
+    window: bytes  # Uncompressed data preceding the access point, empty at the start of a gzip member
+
+
+class GZipIndexBuilder:
+    """
+    Build access points for a gzip archive in one pass over its compressed data.
+    An access point is created at the first deflate block boundary after every ``spacing`` uncompressed bytes.
+    After the build, total uncompressed size and number of lines are available as attributes.
+    """
+
+    def __init__(self, spacing: int = DEFAULT_SPACING):
+        self.spacing = spacing
+        self.compressed_size = 0
+        self.uncompressed_size = 0
+        self.total_lines = 0
+
+    def build(self, chunks: Iterable[bytes]) -> Iterator[AccessPoint]:
+        inflater = Inflater(wbits=47)  # 32 + 15: decode gzip (or zlib) wrapper
+        window = b""
+        last_char = b""
+        newlines = 0
+        last_point = None
+        total_out = 0
+        total_in = 0
+        member_start = True
+        stream_end = False
+
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                inflater.feed(chunk)
+                while True:
+                    if stream_end:
+                        if inflater.avail_in == 0:
+                            break
+                        # More data after the end of a gzip member, it should be a new member
+                        inflater.reset()
+                        member_start = True
+                        stream_end = False
+
+                    try:
+                        ret, out = inflater.inflate()
+                    except zlib.error:
+                        if member_start and total_out > 0:
+                            # Trailing data after the last gzip member is not a gzip header (e.g. zero padding)
+                            logger.debug("Ignoring %d trailing bytes of non-gzip data", len(chunk) - inflater.avail_in)
+                            total_in += len(chunk)
+                            self._finish(total_in, total_out, newlines, last_char)
+                            return
+                        raise
+
+                    if out:
+                        newlines += out.count(b"\n")
+                        total_out += len(out)
+                        window = out[-WINDOW_SIZE:] if len(out) >= WINDOW_SIZE else (window + out)[-WINDOW_SIZE:]
+                        last_char = out[-1:]
+
+                    if ret == Z_STREAM_END:
+                        stream_end = True
+                        continue
+
+                    if inflater.at_block_boundary and not inflater.at_last_block:
+                        if last_point is None or total_out - last_point >= self.spacing:
+                            yield AccessPoint(
+                                compressed_byte=total_in + len(chunk) - inflater.avail_in,
+                                bits=inflater.bits,
+                                uncompressed_byte=total_out,
+                                line_number=newlines + 1,
+                                window=b"" if member_start else window,
+                            )
+                            last_point = total_out
+                        member_start = False
+
+                    if inflater.avail_in == 0 and len(out) < OUT_BUFFER_SIZE:
+                        break
+                total_in += len(chunk)
+        finally:
+            inflater.close()
+
+        if not stream_end:
+            raise zlib.error("Gzip archive is truncated")
+        self._finish(total_in, total_out, newlines, last_char)
+
+    def merge(self, chunk_indexes: Iterable[ChunkIndex], compressed_size: int) -> Iterator[AccessPoint]:
+        """
+        Build access points from chunk indexes (see ``index_gzip_chunk``), sorted by chunk id. Windows and line
+        numbers of each chunk are resolved from the data of the previous chunks.
+        """
+        window = b""
+        last_char = b""
+        total_out = 0
+        newlines = 0
+        previous = None
+
+        for chunk in chunk_indexes:
+            if chunk.start is None:
+                continue
+            if previous is None and chunk.start != 0:
+                raise ValueError(f"Chunk {chunk.chunk_id} is the first indexed chunk but does not start the archive")
+            if previous is not None and previous.end != chunk.start:
+                raise ValueError(f"Chunk {previous.chunk_id} ends at bit {previous.end} but chunk {chunk.chunk_id} "
+                                 f"starts at bit {chunk.start}, chunk boundaries are inconsistent")
+
+            # Data that precedes the chunk, padded so that window positions match the dictionaries used to inflate it
+            padded = np.frombuffer(window.rjust(WINDOW_SIZE, b"\x00"), dtype=np.uint8)
+            copied_newlines = 0
+            if chunk.window_refs is not None:
+                copied_newlines = int(chunk.window_refs[padded == NEWLINE].sum())
+
+            compressed_byte, bits = -(-chunk.deflate_start // 8), -chunk.deflate_start % 8
+            yield AccessPoint(
+                compressed_byte=compressed_byte,
+                bits=bits,
+                uncompressed_byte=total_out,
+                line_number=newlines + 1,
+                window=b"" if chunk.start_is_member else window,
+            )
+            for point in chunk.points:
+                yield AccessPoint(
+                    compressed_byte=point.compressed_byte,
+                    bits=point.bits,
+                    uncompressed_byte=total_out + point.uncompressed_byte,
+                    line_number=newlines + copied_newlines + point.line_number,
+                    window=point.window,
+                )
+
+            tail = chunk.tail
+            if chunk.tail_refs is not None:
+                positions, refs = chunk.tail_refs
+                resolved_tail = np.frombuffer(tail, dtype=np.uint8).copy()
+                resolved_tail[positions] = padded[refs]
+                tail = resolved_tail.tobytes()
+            if tail:
+                window = (window + tail)[-WINDOW_SIZE:]
+                last_char = tail[-1:]
+
+            total_out += chunk.uncompressed_size
+            newlines += chunk.newlines + copied_newlines
+            previous = chunk
+
+        if previous is None:
+            raise ValueError("No chunk contains the start of the archive")
+        if previous.end is not None:
+            raise ValueError(f"Chunk {previous.chunk_id} is the last indexed chunk but does not end the archive")
+        self._finish(compressed_size, total_out, newlines, last_char)
+
+    def _finish(self, total_in, total_out, newlines, last_char):
+        self.compressed_size = total_in
+        self.uncompressed_size = total_out
+        # Count the last line if it is not terminated by a newline
+        self.total_lines = newlines + (1 if last_char not in (b"", b"\n") else 0)
+
+
+@dataclass
+class ChunkIndex:
+    """
+    Access points found by indexing one chunk of a gzip archive without knowing the data that precedes it.
+    Offsets of the chunk access points and line numbers are relative to the start of the chunk, and are made absolute
+    when chunk indexes are merged. Bytes copied from the unknown window are tracked as references to window positions.
+    """
+    chunk_id: int
+    start: Optional[int] = None  # Bit offset where decoding of the chunk starts, None if the chunk has no boundaries
+    start_is_member: bool = False  # Chunk starts at a gzip member header instead of a deflate block
+    deflate_start: Optional[int] = None  # Bit offset of the first deflate block (after the header of a member)
+    end: Optional[int] = None  # Bit offset where the next chunk starts, None if the chunk reaches the end of the archive
+    uncompressed_size: int = 0
+    newlines: int = 0  # Newlines decoded as literals, newlines copied from the unknown window are not included
+    window_refs: Optional[np.ndarray] = None  # Number of bytes copied from each position of the unknown window
+    points: list[AccessPoint] = field(default_factory=list)  # Access points relative to the chunk start
+    tail: bytes = b""  # Last (up to 32 KiB) uncompressed bytes of the chunk
+    tail_refs: Optional[tuple] = None  # (positions in tail, window positions) of tail bytes copied from the window
+
+
+class ChunkBuffer:
+    """
+    Compressed data of a chunk, located at ``offset`` in the archive. Data past the end of the chunk is read on demand
+    from the ``continuation`` function, which receives the offset to read from and returns an iterator of data pieces.
+    With the ``size`` of the archive, data is never read past its end.
+    """
+
+    def __init__(self, data: bytes, offset: int, continuation: Optional[Callable[[int], Iterator[bytes]]] = None,
+                 size: Optional[int] = None):
+        self.offset = offset
+        self._data = bytearray(data if size is None else data[:max(size - offset, 0)])
+        self._continuation = continuation
+        self._more = None
+        self._size = size
+        self._eof = continuation is None or (size is not None and self.end >= size)
+
+    @property
+    def end(self) -> int:
+        return self.offset + len(self._data)
+
+    def get(self, start: int, end: int) -> bytes:
+        while self.end < end and not self._eof:
+            if self._more is None:
+                self._more = iter(self._continuation(self.end))
+            piece = next(self._more, b"")
+            if self._size is not None:
+                piece = piece[:self._size - self.end]
+            if piece:
+                self._data.extend(piece)
+            if not piece or (self._size is not None and self.end >= self._size):
+                self._eof = True
+        return bytes(self._data[start - self.offset:end - self.offset])
+
+
+def _peek_bits(buffer: ChunkBuffer, bit_offset: int, n: int) -> Optional[int]:
+    first = bit_offset // 8
+    data = buffer.get(first, (bit_offset + n + 7) // 8)
+    if len(data) * 8 < bit_offset % 8 + n:
+        return None
+    return (int.from_bytes(data, "little") >> (bit_offset % 8)) & ((1 << n) - 1)
+
+
+def _gzip_header_size(data: bytes) -> Optional[int]:
+    """
+    Size of the gzip member header at the start of data, or None if data does not start with a valid header
+    """
+    if len(data) < 10 or data[:3] != GZIP_MAGIC + b"\x08":
+        return None
+    flags = data[3]
+    pos = 10
+    if flags & 4:  # FEXTRA
+        if len(data) < pos + 2:
+            return None
+        pos += 2 + int.from_bytes(data[pos:pos + 2], "little")
+    for flag in (8, 16):  # FNAME, FCOMMENT (zero terminated)
+        if flags & flag:
+            pos = data.find(b"\x00", pos) + 1
+            if pos == 0:
+                return None
+    if flags & 2:  # FHCRC
+        pos += 2
+    return pos if pos <= len(data) else None
+
+
+def _valid_code_lengths_code(buffer: ChunkBuffer, bit_offset: int) -> bool:
+    """
+    Check that the code lengths code of a dynamic block header (starting at bit_offset) is a complete prefix code,
+    as zlib requires. This discards most positions that are not block boundaries without trying to inflate them.
+    """
+    hclen = _peek_bits(buffer, bit_offset + 13, 4)
+    if hclen is None:
+        return False
+    lengths = _peek_bits(buffer, bit_offset + 17, 3 * (hclen + 4))
+    if lengths is None:
+        return False
+    kraft = 0
+    for _ in range(hclen + 4):
+        length = lengths & 7
+        lengths >>= 3
+        if length:
+            kraft += 1 << (7 - length)
+    return kraft == 128
+
+
+def _new_raw_inflater(buffer: ChunkBuffer, bit_offset: int, window: Optional[bytes]) -> tuple[Inflater, int]:
+    """
+    Create a raw inflater positioned at bit_offset, returns the inflater and the byte offset of the next input byte
+    """
+    inflater = Inflater(wbits=-15)
+    if window:
+        inflater.set_dictionary(window)
+    first_byte, skip_bits = divmod(bit_offset, 8)
+    if skip_bits:
+        value = buffer.get(first_byte, first_byte + 1)[0]
+        inflater.prime(8 - skip_bits, value >> skip_bits)
+        first_byte += 1
+    return inflater, first_byte
+
+
+def _try_inflate_block(buffer: ChunkBuffer, bit_offset: int) -> bool:
+    """
+    Check if a deflate block starts at bit_offset by inflating the whole block with a dummy window
+    """
+    inflater, next_byte = _new_raw_inflater(buffer, bit_offset, _DUMMY_WINDOW)
+    produced = 0
+    try:
+        while True:
+            piece = buffer.get(next_byte, next_byte + SCAN_SIZE)
+            if not piece:
+                return False
+            next_byte += len(piece)
+            inflater.feed(piece)
+            while True:
+                ret, out = inflater.inflate()
+                produced += len(out)
+                if ret == Z_STREAM_END:
+                    return False
+                if inflater.at_block_boundary and produced > 0:
+                    return True
+                if inflater.avail_in == 0 and len(out) < OUT_BUFFER_SIZE:
+                    break
+    except zlib.error:
+        return False
+    finally:
+        inflater.close()
+
+
+def _find_first_boundary(buffer: ChunkBuffer, start: int, limit: int) -> Optional[tuple[int, bool]]:
+    """
+    Find the first position, at or after bit offset ``start`` and before ``limit``, where a gzip member or a non-final
+    dynamic Huffman deflate block begins. Returns the bit offset and whether it is a member start, or None.
+    """
+    scan_offset = start // 8
+    while scan_offset * 8 < limit:
+        region = buffer.get(scan_offset, scan_offset + SCAN_SIZE + 4)
+        if len(region) < 5:
+            return None
+        candidates = []
+
+        # Non-final dynamic blocks: BFINAL=0, BTYPE=2, HLIT <= 29 and HDIST <= 29
+        arr = np.frombuffer(region, dtype=np.uint8).astype(np.uint32)
+        words = arr[:-3] | (arr[1:-2] << 8) | (arr[2:-1] << 16) | (arr[3:] << 24)
+        for shift in range(8):
+            values = words >> shift
+            mask = ((values & 7) == 4) & (((values >> 3) & 31) <= 29) & (((values >> 8) & 31) <= 29)
+            candidates.extend(((scan_offset + int(i)) * 8 + shift, False) for i in np.flatnonzero(mask))
+
+        # Gzip members
+        pos = region.find(GZIP_MAGIC + b"\x08")
+        while pos != -1 and pos < len(words):
+            candidates.append(((scan_offset + pos) * 8, True))
+            pos = region.find(GZIP_MAGIC + b"\x08", pos + 1)
+
+        for bit_offset, is_member in sorted(candidates):
+            if bit_offset < start or bit_offset >= limit:
+                continue
+            if is_member:
+                header_size = _gzip_header_size(buffer.get(bit_offset // 8, bit_offset // 8 + MAX_HEADER_SIZE))
+                if header_size is not None and _try_inflate_block(buffer, bit_offset + header_size * 8):
+                    return bit_offset, True
+            elif _valid_code_lengths_code(buffer, bit_offset) and _try_inflate_block(buffer, bit_offset):
+                return bit_offset, False
+
+        scan_offset += len(words)
+    return None
+
+
+def index_gzip_chunk(buffer: ChunkBuffer, chunk_id: int, chunk_start: int, chunk_end: int, is_last: bool,
+                     spacing: int = DEFAULT_SPACING) -> ChunkIndex:
+    """
+    Index a chunk of a gzip archive independently of the other chunks, as in pugz/rapidgzip.
+
+    Decoding starts at the first gzip member or non-final dynamic deflate block found at or after ``chunk_start``,
+    and ends at the first such position at or after ``chunk_end``, which is where the next chunk starts decoding.
+    The 32 KiB window preceding the first block is unknown: decoding uses three inflaters in lockstep, with
+    dictionaries that encode the window position of each byte, to track which output bytes are copied from the
+    window until the last 32 KiB of output contain only literal data.
+    """
+    index = ChunkIndex(chunk_id=chunk_id)
+
+    if chunk_start == 0:
+        boundary = (0, True)
+    else:
+        boundary = _find_first_boundary(buffer, chunk_start * 8, (buffer.end if is_last else chunk_end) * 8)
+    if boundary is None:
+        logger.debug("Chunk %d has no deflate block boundaries", chunk_id)
+        return index
+    index.start, index.start_is_member = boundary
+
+    deflate_start = index.start
+    if index.start_is_member:
+        header_size = _gzip_header_size(buffer.get(index.start // 8, index.start // 8 + MAX_HEADER_SIZE))
+        deflate_start += header_size * 8
+    index.deflate_start = deflate_start
+
+    # Window positions referenced by output bytes are encoded as (hi << 8 | lo), a byte is copied from the window
+    # if the outputs of the inflaters with _HI_WINDOW and _HI_WINDOW2 dictionaries differ
+    resolved = index.start_is_member
+    windows = [None] if resolved else [_LO_WINDOW, _HI_WINDOW, _HI2_WINDOW]
+    inflaters, next_byte = [], 0
+    for window in windows:
+        inflater, next_byte = _new_raw_inflater(buffer, deflate_start, window)
+        inflaters.append(inflater)
+
+    window_refs = np.zeros(WINDOW_SIZE, dtype=np.int64)
+    tail = b""
+    tail_refs = np.empty(0, dtype=np.int32)  # window position of each tail byte, -1 for literals
+    last_ref = -1  # chunk output offset of the last byte copied from the window
+    total_out = 0
+    last_point = 0
+    stream_end = False
+
+    try:
+        piece = b""
+        while True:
+            if not piece or (inflaters[0].avail_in == 0 and len(out) < OUT_BUFFER_SIZE):
+                piece = buffer.get(next_byte, next_byte + READ_SIZE)
+                if not piece:
+                    break
+                next_byte += len(piece)
+                for inflater in inflaters:
+                    inflater.feed(piece)
+
+            results = [inflater.inflate() for inflater in inflaters]
+            ret, out = results[0]
+            in_offset = next_byte - inflaters[0].avail_in
+
+            if out:
+                if resolved:
+                    index.newlines += out.count(b"\n")
+                    refs = None
+                else:
+                    lo, hi, hi2 = (np.frombuffer(r[1], dtype=np.uint8) for r in results)
+                    copied = hi != hi2
+                    refs = np.full(len(out), -1, dtype=np.int32)
+                    if copied.any():
+                        refs[copied] = (hi[copied].astype(np.int32) << 8) | lo[copied]
+                        window_refs += np.bincount(refs[copied], minlength=WINDOW_SIZE)
+                        last_ref = total_out + int(np.flatnonzero(copied)[-1])
+                        index.newlines += int(np.count_nonzero((lo == NEWLINE) & ~copied))
+                    else:
+                        index.newlines += out.count(b"\n")
+                total_out += len(out)
+                tail = out[-WINDOW_SIZE:] if len(out) >= WINDOW_SIZE else (tail + out)[-WINDOW_SIZE:]
+                if not resolved:
+                    tail_refs = np.concatenate((tail_refs, refs))[-WINDOW_SIZE:]
+                    if total_out - last_ref > WINDOW_SIZE:
+                        # Output no longer depends on the unknown window, continue with a single inflater
+                        resolved = True
+                        tail_refs = np.empty(0, dtype=np.int32)
+                        for inflater in inflaters[1:]:
+                            inflater.close()
+                        inflaters = inflaters[:1]
+
+            if ret == Z_STREAM_END:
+                # End of gzip member, skip trailer and continue with the next member if there is one
+                member_offset = in_offset + GZIP_TRAILER_SIZE
+                header_size = _gzip_header_size(buffer.get(member_offset, member_offset + MAX_HEADER_SIZE))
+                if header_size is None:
+                    # End of the archive, or trailing data that is not a gzip header, even if past the chunk end
+                    stream_end = True
+                    break
+                if not is_last and member_offset >= chunk_end:
+                    index.end = member_offset * 8
+                    break
+                for inflater in inflaters:
+                    inflater.close()
+                deflate_offset = member_offset + header_size
+                inflaters = []
+                for _ in range(1 if resolved else len(windows)):
+                    inflater, next_byte = _new_raw_inflater(buffer, deflate_offset * 8, None)
+                    inflaters.append(inflater)
+                piece = b""
+                # Output of the new member does not depend on previous data, its start is always a valid access point
+                if total_out - last_point >= spacing:
+                    index.points.append(AccessPoint(
+                        compressed_byte=deflate_offset,
+                        bits=0,
+                        uncompressed_byte=total_out,
+                        line_number=index.newlines + 1,
+                        window=b"",
+                    ))
+                    last_point = total_out
+                continue
+
+            if inflaters[0].at_block_boundary and not inflaters[0].at_last_block:
+                bit_offset = in_offset * 8 - inflaters[0].bits
+                if not is_last and bit_offset >= chunk_end * 8 and _peek_bits(buffer, bit_offset, 3) == 4:
+                    index.end = bit_offset
+                    break
+                if resolved and total_out - last_point >= spacing:
+                    index.points.append(AccessPoint(
+                        compressed_byte=in_offset,
+                        bits=inflaters[0].bits,
+                        uncompressed_byte=total_out,
+                        line_number=index.newlines + 1,
+                        window=tail,
+                    ))
+                    last_point = total_out
+    finally:
+        for inflater in inflaters:
+            inflater.close()
+
+    if index.end is None and not stream_end:
+        raise zlib.error("Gzip archive is truncated")
+
+    index.uncompressed_size = total_out
+    index.tail = tail
+    if window_refs.any():
+        index.window_refs = window_refs
+    if tail_refs.shape[0] and (tail_refs >= 0).any():
+        positions = np.flatnonzero(tail_refs >= 0)
+        index.tail_refs = (positions, tail_refs[positions])
+    return index
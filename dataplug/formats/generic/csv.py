@@ -7,7 +7,9 @@ from typing import TYPE_CHECKING
 
 import pandas as pd
 
+from ... import tracing
 from ...entities import CloudDataFormat, CloudObjectSlice, PartitioningStrategy
+from ...storage.rangeread import read_range
 from ...preprocessing.metadata import PreprocessingMetadata
 
 if TYPE_CHECKING:
@@ -50,11 +52,15 @@ class CSVSlice(CloudObjectSlice):
         super().__init__(*args, **kwargs)
 
     def get(self):
-        res = self.cloud_object.storage.get_object(
-            Bucket=self.cloud_object.path.bucket, Key=self.cloud_object.path.key,
-            Range=f"bytes={self.range_0}-{self.range_1}"
-        )
-        body = res["Body"].read().decode("utf-8")
+        # Range is inclusive, read_range end is exclusive
+        span = tracing.current_span()
+        with span.phase("download"):
+            body = read_range(
+                self.cloud_object.storage, self.cloud_object.path.bucket, self.cloud_object.path.key,
+                self.range_0, min(self.range_1 + 1, self.cloud_object.size)
+            )
+            span.add("download.bytes", len(body))
+        body = body.decode("utf-8")
         buff = io.StringIO(body)
 
         head_offset = 0
@@ -1,39 +1,52 @@
 from __future__ import annotations
 
-import io
 import logging
 import math
 import re
-import shutil
-import time
 from typing import TYPE_CHECKING
 
 import numpy as np
 
+from ... import tracing
 from ...entities import CloudDataFormat, CloudObjectSlice, PartitioningStrategy
 from ...preprocessing.metadata import PreprocessingMetadata
+from ...storage.rangeread import read_range
 
 if TYPE_CHECKING:
-    from typing import List
+    from typing import List, Tuple
     from ...cloudobject import CloudObject
     from botocore.response import StreamingBody
 
 logger = logging.getLogger(__name__)
 
 
+# Bytes read past the end of each chunk, to complete the sequence identifier lines cut by the chunk boundary
+FASTA_OVERLAP = 16 * 1024
+
+
 def preprocess_fasta(cloud_object: CloudObject, chunk_data: StreamingBody,
-                     chunk_id: int, chunk_size: int, num_chunks: int):
-    chunk_offset = chunk_id * chunk_size
+                     chunk_id: int, chunk_size: int, num_chunks: int, chunk_range: Tuple[int, int]):
+    chunk_offset, chunk_end = chunk_range
+    span = tracing.current_span()
+
+    with span.phase("download"):
+        data = chunk_data.read()
+    span.add("download.bytes", len(data))
+
+    with span.phase("parse"):
+        sequences = _find_sequences(cloud_object, data, chunk_offset, chunk_end)
+    logger.info("Found %d sequences in chunk %d", len(sequences), chunk_id)
 
-    t0 = time.perf_counter()
-    data = chunk_data.read()
-    t1 = time.perf_counter()
+    arr = np.array(sequences, dtype=np.uint32)
+    arr_bytes = arr.tobytes()
+    return PreprocessingMetadata(metadata=arr_bytes)
 
-    logger.info("Got chunk data in %.2f s", t1 - t0)
 
-    t0 = time.perf_counter()
+def _find_sequences(cloud_object: CloudObject, data: bytes, chunk_offset: int, chunk_end: int) -> List[tuple]:
+    # data holds the chunk followed by the overlap, sequences are indexed by the chunk in which their identifier
+    # starts, and the overlap is only used to complete the identifier lines cut by the end of the chunk
     # we use greedy regex so that match offsets also gets the \n character
-    matches = list(re.finditer(rb">.+(\n)?", data))
+    matches = [match for match in re.finditer(rb">.+(\n)?", data) if chunk_offset + match.start() < chunk_end]
 
     sequences = []
     for match in matches:
@@ -42,25 +55,19 @@ def preprocess_fasta(cloud_object: CloudObject, chunk_data: StreamingBody,
         # seq_id = match.group().decode("utf-8").split(" ")[0].replace(">", "")
         sequences.append((start, end))
 
-    if matches and b"\n" not in matches[-1].group():
-        # last match corresponds to a cut sequence identifier, as newline was not read
+    if matches and b"\n" not in matches[-1].group() and chunk_offset + len(data) < cloud_object.size:
+        # last identifier line is longer than the overlap, read the rest of it
         offset = chunk_offset + matches[-1].start()
-        # read split sequence id line
+        logger.debug("Sequence identifier at offset %d is cut by the overlap", offset)
         with cloud_object.open("rb") as fasta_file:
             fasta_file.seek(offset)
-            seq_id_line = fasta_file.readline()
+            fasta_file.readline()
             # get the current offset after reading line, it will be offset for the start of the sequence
             end = fasta_file.tell()
-        # seq_id = seq_id_line.decode("utf-8").split(" ")[0].replace(">", "")
         sequences.pop()  # remove last split sequence id added previously
         sequences.append((offset, end))
 
-    t1 = time.perf_counter()
-    logger.info("Found %d sequences in %.2f s", len(sequences), t1 - t0)
-
-    arr = np.array(sequences, dtype=np.uint32)
-    arr_bytes = arr.tobytes()
-    return PreprocessingMetadata(metadata=arr_bytes)
+    return sequences
 
 
 def merge_fasta_metadata(cloud_object: CloudObject, chunk_metadata: List[PreprocessingMetadata]):
@@ -74,7 +81,14 @@ def merge_fasta_metadata(cloud_object: CloudObject, chunk_metadata: List[Preproc
     return PreprocessingMetadata(metadata=idx.tobytes(), attributes={"num_sequences": num_sequences})
 
 
-@CloudDataFormat(preprocessing_function=preprocess_fasta, finalizer_function=merge_fasta_metadata)
+def combine_fasta_metadata(cloud_object: CloudObject, chunk_metadata: List[PreprocessingMetadata]):
+    # Sequence offsets are absolute, so the indexes of consecutive chunks are combined by concatenation
+    idx = b"".join(meta.metadata for meta in chunk_metadata)
+    return PreprocessingMetadata(metadata=idx)
+
+
+@CloudDataFormat(preprocessing_function=preprocess_fasta, finalizer_function=merge_fasta_metadata,
+                 combiner_function=combine_fasta_metadata, overlap=FASTA_OVERLAP)
 class FASTA:
     num_sequences: int
 
@@ -86,38 +100,31 @@ class FASTASlice(CloudObjectSlice):
         super().__init__(*args, **kwargs)
 
     def get(self):
-        buff = io.BytesIO()
-
-        get_response = self.cloud_object.storage.get_object(
-            Bucket=self.cloud_object.path.bucket,
-            Key=self.cloud_object.path.key,
-            Range=f"bytes={self.range_0}-{self.range_1 - 1}",
-        )
-        assert get_response["ResponseMetadata"]["HTTPStatusCode"] in (200, 206)
+        storage, bucket, key = self.cloud_object.storage, self.cloud_object.path.bucket, self.cloud_object.path.key
+        span = tracing.current_span()
+        with span.phase("download"):
+            data = read_range(storage, bucket, key, self.range_0, min(self.range_1, self.cloud_object.size))
+            span.add("download.bytes", len(data))
 
-        if self.header is not None:
-            header_r0, header_r1 = self.header
-            header_response = self.cloud_object.storage.get_object(
-                Bucket=self.cloud_object.path.bucket,
-                Key=self.cloud_object.path.key,
-                Range=f"bytes={header_r0}-{header_r1 - 1}",
-            )
-            assert get_response["ResponseMetadata"]["HTTPStatusCode"] in (200, 206)
+            if self.header is not None:
+                header_r0, header_r1 = self.header
+                header_line = read_range(storage, bucket, key, header_r0, header_r1)
+                span.add("download.bytes", len(header_line))
 
-            header_line = header_response['Body'].read()
-            # Remove trailing \n and add in-sequence offset value for the first split sequence
-            buff.write(header_line[:-1] + bytes(f" offset={self.offset}", 'utf-8') + b"\n")
+        with span.phase("copy"):
+            if self.header is not None:
+                # Remove trailing \n and add in-sequence offset value for the first split sequence
+                return bytes(header_line[:-1] + bytes(f" offset={self.offset}", 'utf-8') + b"\n" + data)
+            return bytes(data)
 
-        shutil.copyfileobj(get_response['Body'], buff)
-        buff.seek(0)
 
-        return buff.getvalue()
+def _load_fasta_index(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.uint32).reshape((-1, 2))
 
 
 @PartitioningStrategy(dataformat=FASTA)
 def partition_chunks_strategy(cloud_object: CloudObject, num_chunks: int):
-    res = cloud_object.storage.get_object(Bucket=cloud_object.meta_path.bucket, Key=cloud_object.meta_path.key)
-    idx = np.frombuffer(res['Body'].read(), dtype=np.uint32).reshape((cloud_object.attributes.num_sequences, 2))
+    idx = cloud_object.load_index(_load_fasta_index)
     chunk_sz = math.ceil(cloud_object.size / num_chunks)
     ranges = [(chunk_sz * i, (chunk_sz * i) + chunk_sz) for i in range(num_chunks)]
     slices = []
@@ -5,7 +5,7 @@ from typing import TYPE_CHECKING
 
 from ...entities import PartitioningStrategy
 from ...formats.compressed.gzipped import (
-    _get_ranges_from_line_pairs,
+    _get_slices_from_line_pairs,
     GZipTextSlice, GZipText,
 )
 
@@ -38,14 +38,8 @@ def partition_reads_batches(cloud_object: CloudObject, num_batches: int) -> List
         l0, _ = line_pairs[-1]
         line_pairs[-1] = (l0, total_lines + 1)
 
-    # Get byte ranges from line pairs using GZip index
-    byte_ranges = _get_ranges_from_line_pairs(cloud_object, line_pairs)
-    chunks = [
-        GZipTextSlice(line_0, line_1, range_0, range_1)
-        for (line_0, line_1), (range_0, range_1) in zip(line_pairs, byte_ranges)
-    ]
-
-    return chunks
+    # Get byte ranges and access points from line pairs using GZip index
+    return _get_slices_from_line_pairs(cloud_object, line_pairs)
 
 
 @PartitioningStrategy(FASTQGZip)
@@ -54,25 +48,19 @@ def partition_sequences_per_chunk(cloud_object: FASTQGZip,
     total_lines = int(cloud_object.get_attribute("total_lines"))
     lines_per_chunk = seq_per_chunk * 4
     parts = ceil(total_lines / lines_per_chunk)
-    pairs = [((lines_per_chunk * i) + 1, (lines_per_chunk * i) + lines_per_chunk) for i in range(parts)]
+    # Line pairs are [line_0, line_1) (first element is inclusive, second element is exclusive)
+    pairs = [((lines_per_chunk * i) + 1, (lines_per_chunk * (i + 1)) + 1) for i in range(parts)]
 
     # Adjust last pair
-    if pairs[-1][1] > total_lines:
-        if strategy == "expand":
+    if pairs[-1][1] > total_lines + 1:
+        if strategy == "expand" or len(pairs) == 1:
             l0, _ = pairs[-1]
-            pairs[-1] = (l0, total_lines)
+            pairs[-1] = (l0, total_lines + 1)
         elif strategy == "merge":
-            l0, l1 = pairs.pop()
-            extra = l1 - l0
-            pair = pairs[-1]
-            pairs[-1] = pair[0], pair[1] + extra
+            pairs.pop()
+            l0, _ = pairs[-1]
+            pairs[-1] = (l0, total_lines + 1)
         else:
             raise Exception(f"Unknown strategy {strategy}")
 
-    byte_ranges = _get_ranges_from_line_pairs(cloud_object, pairs)
-    chunks = [
-        GZipTextSlice(line_0, line_1, range_0, range_1)
-        for (line_0, line_1), (range_0, range_1) in zip(byte_ranges, pairs)
-    ]
-
-    return chunks
+    return _get_slices_from_line_pairs(cloud_object, pairs)
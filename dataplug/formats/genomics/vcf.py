@@ -6,7 +6,9 @@ import re
 from math import ceil
 from typing import TYPE_CHECKING
 
+from ... import tracing
 from ...entities import CloudDataFormat, CloudObjectSlice, PartitioningStrategy
+from ...storage.rangeread import read_range
 from ...preprocessing.metadata import PreprocessingMetadata
 
 if TYPE_CHECKING:
@@ -86,12 +88,18 @@ class VCFSlice(CloudObjectSlice):
         super().__init__(*args, **kwargs)
 
     def get(self):
-        res = self.cloud_object.storage.get_object(
-            Bucket=self.cloud_object.path.bucket,
-            Key=self.cloud_object.path.key,
-            Range=f"bytes={self.range_0}-{self.range_1}",
-        )
-        vcf_body = res["Body"].read().decode("utf-8")
+        # Range is inclusive, read_range end is exclusive
+        span = tracing.current_span()
+        with span.phase("download"):
+            vcf_body = read_range(
+                self.cloud_object.storage,
+                self.cloud_object.path.bucket,
+                self.cloud_object.path.key,
+                self.range_0,
+                min(self.range_1 + 1, self.cloud_object.size),
+            )
+            span.add("download.bytes", len(vcf_body))
+        vcf_body = vcf_body.decode("utf-8")
         buff = io.StringIO(vcf_body)
         # logger.info(f"Getting slice {self.chunk_id}. Range is {self.range_0}-{self.range_1}")
 
@@ -6,12 +6,12 @@ import math
 import subprocess
 import tempfile
 from typing import TYPE_CHECKING
-from concurrent.futures import ThreadPoolExecutor
 
 import tqdm
 
 from ...entities import CloudDataFormat, CloudObjectSlice, PartitioningStrategy
 from ...preprocessing.metadata import PreprocessingMetadata
+from ...storage.rangeread import read_ranges
 from ...util import force_delete_path
 
 if TYPE_CHECKING:
@@ -136,40 +136,10 @@ class LiDARSlice(CloudObjectSlice):
         with laspy.open(header_buff, "r") as lasf:
             header = lasf.header
 
+        # Point intervals are placed one after the other in the local buffer
         buffer = bytearray(self.buffer_size)
-
-        # Calculate offsets for local buffer
-        buffer_offsets = []
-        previous = 0
-        for byte_range in self.las_file_byte_ranges:
-            r0, r1 = byte_range
-            size = r1 - r0
-            offset_0, offset_1 = previous, previous + size
-            buffer_offsets.append((offset_0, offset_1))
-            previous = offset_1
-
-        def _fetch_interval(args):
-            interval_byte_range, buffer_offsets = args
-            range_0, range_1 = interval_byte_range
-            # print(range_1 - range_0)
-            byte_range = f"bytes={range_0}-{range_1 - 1}"
-            # print(byte_range)
-            res = self.cloud_object.storage.get_object(Bucket=self.cloud_object.path.bucket,
-                                                       Key=self.cloud_object.path.key,
-                                                       Range=byte_range)
-            assert res.get("ResponseMetadata", {}).get("HTTPStatusCode") in (200, 206)
-            body = res["Body"].read()
-
-            offset_0, offset_1 = buffer_offsets
-            # print(offset_1, offset_1, offset_1 - offset_0)
-            mem_buff = memoryview(buffer)
-            # print(range_1 - range_0, len(body))
-            mem_buff[offset_0:offset_1] = body
-            return True
-
-        with ThreadPoolExecutor(max_workers=32) as pool:
-            res = pool.map(_fetch_interval, zip(self.las_file_byte_ranges, buffer_offsets))
-            all(res)
+        read_ranges(self.cloud_object.storage, self.cloud_object.path.bucket, self.cloud_object.path.key,
+                    self.las_file_byte_ranges, out=buffer)
 
         # Read point interval into a mini-las container
         points = laspy.PackedPointRecord.from_buffer(buffer=memoryview(buffer), point_format=header.point_format)
@@ -1,8 +1,6 @@
 from __future__ import annotations
 
-import io
 import logging
-import shutil
 from typing import TYPE_CHECKING
 
 try:
@@ -13,6 +11,7 @@ except ModuleNotFoundError:
 from ...cloudobject import CloudObject
 from ...entities import CloudDataFormat, CloudObjectSlice, PartitioningStrategy
 from ...preprocessing.metadata import PreprocessingMetadata
+from ...storage.rangeread import read_ranges
 
 if TYPE_CHECKING:
     from typing import List, Tuple
@@ -93,27 +92,17 @@ class ImzMLSlice(CloudObjectSlice):
         self.mz_range_1 = mz_range_1
         super().__init__(*args, **kwargs)
 
-    def __fetch_range_into_buffer(self, first_byte: int, last_byte: int, buffer: io.BufferedIOBase):
-        get_response = self.cloud_object.storage.get_object(
-            Bucket=self.cloud_object.path.bucket,
-            Key=self.cloud_object.path.key,
-            Range=f"bytes={first_byte}-{last_byte}",
-        )
-        assert get_response["ResponseMetadata"]["HTTPStatusCode"] in (200, 206)
-        shutil.copyfileobj(get_response["Body"], buffer)
-
     def get(self):
-        buff = io.BytesIO()
-
+        # Ranges are inclusive, read_ranges ends are exclusive
+        ranges = []
         if self.mz_range_1 is not None:
             # continuous mode, place mz at the beginning of chunk
             # read from the first byte after the UUID
-            self.__fetch_range_into_buffer(16, self.mz_range_1, buff)
-
-        self.__fetch_range_into_buffer(self.range_0, self.range_1, buff)
-        buff.seek(0)
+            ranges.append((16, self.mz_range_1 + 1))
+        ranges.append((self.range_0, self.range_1 + 1))
 
-        return buff.getvalue()
+        buff = read_ranges(self.cloud_object.storage, self.cloud_object.path.bucket, self.cloud_object.path.key, ranges)
+        return bytes(buff)
 
 
 @PartitioningStrategy(ImzML)
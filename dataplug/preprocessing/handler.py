@@ -1,82 +1,175 @@
 from __future__ import annotations
 
 import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING
 
 from boto3.s3.transfer import TransferConfig
 
+from .. import tracing
+from ..storage.metrics import submit_in_context
 from ..util import force_delete_path
 from ..version import __version__
+from .manifest import delete_partials, list_job_keys, manifest_key
 
 if TYPE_CHECKING:
     pass
 
+PARTIALS_PREFETCH = 16  # Number of staged partial results fetched ahead of the finalizer
+
 
 def monolith_joblib_handler(args):
     # Joblib delayed function expect only one argument, so we need to unpack the arguments
     preprocessing_function, parameters = args
     co = parameters["cloud_object"]
 
-    metadata = preprocessing_function(**parameters)
-    if all((metadata.metadata, metadata.metadata_file_path)):
-        raise Exception("Choose one for object preprocessing result: metadata or metadata_file_path")
+    with tracing.span("preprocess.monolithic", object=co.path.as_uri(), function=preprocessing_function.__name__) \
+            as span:
+        with span.phase("preprocess"):
+            metadata = preprocessing_function(**parameters)
+        if all((metadata.metadata, metadata.metadata_file_path)):
+            raise Exception("Choose one for object preprocessing result: metadata or metadata_file_path")
 
-    upload_metadata(co, metadata)
+        with span.phase("upload"):
+            upload_metadata(co, metadata)
 
 
 def map_joblib_handler(args):
     # Joblib delayed function expect only one argument, so we need to unpack the arguments
-    preprocessing_function, parameters = args
+    # Partial results are staged in the meta bucket, or returned through joblib if stage_partials is False
+    preprocessing_function, parameters, stage_partials = args
 
     co = parameters["cloud_object"]
     chunk_id = parameters["chunk_id"]
     chunk_size = parameters["chunk_size"]
     num_chunks = parameters["num_chunks"]
+    overlap = parameters.pop("overlap", 0)
 
     range_0 = chunk_id * chunk_size
-    range_1 = co.size if chunk_size == num_chunks - 1 \
-        else (chunk_id + 1) * chunk_size
-    get_res = co.storage.get_object(
-        Bucket=co.path.bucket, Key=co.path.key, Range=f"bytes={range_0}-{range_1 - 1}"
-    )
-    parameters["chunk_data"] = get_res["Body"]
-
-    metadata = preprocessing_function(**parameters)
-    if all((metadata.metadata, metadata.metadata_file_path)):
-        raise Exception("Choose one for object preprocessing result: metadata or metadata_file_path")
-
-    # Upload metadata body to meta bucket with the same key as the original object
-    key = f"{co.path.key}.chunk{str(chunk_id).zfill(3)}"
-    partial_meta_bin = pickle.dumps(metadata)
-    co.storage.put_object(
-        Body=partial_meta_bin,
-        Bucket=co.meta_path.bucket,
-        Key=key,
-        Metadata={"dataplug": __version__},
-    )
+    range_1 = co.size if chunk_id == num_chunks - 1 \
+        else min((chunk_id + 1) * chunk_size, co.size)
+    # The chunk is read with the overlap of the format, to parse the records that straddle its end
+    read_end = min(range_1 + overlap, co.size)
+
+    with tracing.span("preprocess.map", object=co.path.as_uri(), function=preprocessing_function.__name__,
+                      chunk_id=chunk_id, range_0=range_0, range_1=range_1, overlap=read_end - range_1) as span:
+        with span.phase("preprocess"):
+            get_res = co.storage.get_object(
+                Bucket=co.path.bucket, Key=co.path.key, Range=f"bytes={range_0}-{read_end - 1}"
+            )
+            parameters["chunk_data"] = get_res["Body"]
+            if "chunk_range" in parameters:
+                parameters["chunk_range"] = (range_0, range_1)
+
+            metadata = preprocessing_function(**parameters)
+        if all((metadata.metadata, metadata.metadata_file_path)):
+            raise Exception("Choose one for object preprocessing result: metadata or metadata_file_path")
+
+        if not stage_partials:
+            return chunk_id, metadata
+
+        # Upload metadata body to meta bucket with the same key as the original object
+        with span.phase("upload"):
+            key = f"{co.path.key}.chunk{str(chunk_id).zfill(3)}"
+            partial_meta_bin = pickle.dumps(metadata)
+            co.storage.put_object(
+                Body=partial_meta_bin,
+                Bucket=co.meta_path.bucket,
+                Key=key,
+                Metadata={"dataplug": __version__},
+            )
+            span.add("upload.bytes", len(partial_meta_bin))
 
     return chunk_id, key
 
 
+def combine_joblib_handler(args):
+    # Joblib delayed function expect only one argument, so we need to unpack the arguments
+    # Merges a group of consecutive partial results into one, which is staged or returned as the partial results
+    combiner_function, parameters, stage_partials = args
+    co = parameters["cloud_object"]
+    partial_results = parameters["partial_results"]
+    first_chunk_id = partial_results[0][0]
+
+    with tracing.span("preprocess.combine", object=co.path.as_uri(), function=combiner_function.__name__,
+                      level=parameters["level"], chunk_id=first_chunk_id, chunks=len(partial_results)) as span:
+        with span.phase("combine"):
+            metadata = combiner_function(co, _partial_metadata_generator(co, partial_results))
+
+        staged_keys = [key for _, key in partial_results if isinstance(key, str)]
+        if stage_partials:
+            with span.phase("upload"):
+                key = f"{co.path.key}.chunk{str(first_chunk_id).zfill(3)}.level{parameters['level']}"
+                partial_meta_bin = pickle.dumps(metadata)
+                co.storage.put_object(
+                    Body=partial_meta_bin,
+                    Bucket=co.meta_path.bucket,
+                    Key=key,
+                    Metadata={"dataplug": __version__},
+                )
+                span.add("upload.bytes", len(partial_meta_bin))
+            result = first_chunk_id, key
+        else:
+            result = first_chunk_id, metadata
+
+    # Combined inputs of previous levels are not needed anymore once the combined result is stored. The partial
+    # results of map jobs are kept until the final metadata is stored, to resume the job if a later phase fails
+    if parameters["level"] > 1:
+        delete_partials(co, staged_keys)
+    return result
+
+
 def reduce_joblib_handler(args):
     # Joblib delayed function expect only one argument, so we need to unpack the arguments
     finalizer_function, parameters = args
     co = parameters["cloud_object"]
 
-    def _partial_metadata_generator(cloud_object, partial_results):
-        for chunk_id, key in partial_results:
-            res = cloud_object.storage.get_object(Bucket=cloud_object.meta_path.bucket, Key=key)
-            m = pickle.loads(res["Body"].read())
-            cloud_object.storage.delete_object(Bucket=cloud_object.meta_path.bucket, Key=key)
-            yield m
-
     chunk_metadata = _partial_metadata_generator(co, parameters["partial_results"])
 
-    metadata = finalizer_function(co, chunk_metadata)
-    if all((metadata.metadata, metadata.metadata_file_path)):
-        raise Exception("Choose one for object preprocessing result: metadata or metadata_file_path")
-
-    upload_metadata(co, metadata)
+    with tracing.span("preprocess.reduce", object=co.path.as_uri(), function=finalizer_function.__name__,
+                      chunks=len(parameters["partial_results"])) as span:
+        with span.phase("finalize"):
+            metadata = finalizer_function(co, chunk_metadata)
+        if all((metadata.metadata, metadata.metadata_file_path)):
+            raise Exception("Choose one for object preprocessing result: metadata or metadata_file_path")
+
+        with span.phase("upload"):
+            upload_metadata(co, metadata)
+
+    # Delete the staged partial results of all levels and the job manifest once the final metadata is stored
+    if any(isinstance(key, str) for _, key in parameters["partial_results"]):
+        staged_keys, _ = list_job_keys(co)
+        delete_partials(co, staged_keys + [manifest_key(co)])
+
+
+def _get_partial(cloud_object, key):
+    res = cloud_object.storage.get_object(Bucket=cloud_object.meta_path.bucket, Key=key)
+    return pickle.loads(res["Body"].read())
+
+
+def _partial_metadata_generator(cloud_object, partial_results):
+    """
+    Yield the partial results in order. Results returned through joblib are yielded as they are, results staged
+    in the meta bucket are fetched concurrently, up to PARTIALS_PREFETCH ahead of the one being yielded.
+    """
+    with ThreadPoolExecutor(max_workers=PARTIALS_PREFETCH) as pool:
+        pending = deque()
+        partial_results = iter(partial_results)
+        while True:
+            while len(pending) < PARTIALS_PREFETCH:
+                partial = next(partial_results, None)
+                if partial is None:
+                    break
+                _, result = partial
+                if isinstance(result, str):
+                    pending.append(submit_in_context(pool, _get_partial, cloud_object, result))
+                else:
+                    pending.append(result)
+            if not pending:
+                return
+            result = pending.popleft()
+            yield result.result() if hasattr(result, "result") else result
 
 
 def upload_metadata(cloud_object, metadata):
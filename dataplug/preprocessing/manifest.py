@@ -0,0 +1,184 @@
+"""
+Checkpoints of mapreduce preprocessing jobs.
+
+When partial results are staged in the meta bucket, a job manifest is stored next to them (``<key>.manifest``) with
+the plan of the job (object version, preprocessing function and arguments, chunking) and the chunks that were
+completed when the job was interrupted. A later run of the same job only maps the chunks that are missing, and
+reuses the staged partial results of the others. The partial results of map jobs are kept until the final metadata is
+stored, so that a job whose combine or reduce phase fails is resumed without mapping any chunk again. Combined
+results are not reused. Staged partial results that do not belong to the job are deleted before it runs, and the
+manifest is deleted with the partial results once the final metadata is stored.
+
+Jobs are keyed by the object, so preprocessing the same object in several concurrent runs is not supported: a run
+deletes the partial results staged by the others, or reuses them if they run the same job.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING
+
+import botocore.exceptions
+
+from ..version import __version__
+
+if TYPE_CHECKING:
+    from typing import Callable, Dict, List, Optional, Tuple
+    from ..cloudobject import CloudObject
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_SUFFIX = ".manifest"
+DELETE_BATCH_SIZE = 1000  # Maximum number of keys of a DeleteObjects request
+
+
+@dataclass
+class JobManifest:
+    object_size: int
+    object_etag: Optional[str]
+    function: str  # Qualified name of the preprocessing function
+    arguments: str  # Digest of the extra arguments of the preprocessing function
+    chunk_size: int
+    num_chunks: int
+    completed: Dict[int, str] = field(default_factory=dict)  # Key of the staged partial result of each chunk
+    version: str = __version__
+
+    @classmethod
+    def for_job(cls, cloud_object: CloudObject, preprocessing_function: Callable, chunk_size: int, num_chunks: int,
+                extra_args: dict) -> JobManifest:
+        return cls(
+            object_size=cloud_object.size,
+            object_etag=(cloud_object._obj_headers or {}).get("ETag"),
+            function=f"{preprocessing_function.__module__}.{preprocessing_function.__qualname__}",
+            arguments=hashlib.sha256(repr(sorted(extra_args.items())).encode()).hexdigest(),
+            chunk_size=chunk_size,
+            num_chunks=num_chunks,
+        )
+
+    def is_same_job(self, other: JobManifest) -> bool:
+        """
+        Whether the partial results of the other job can be reused for this one
+        """
+        return (self.object_size, self.object_etag, self.function, self.arguments, self.chunk_size,
+                self.num_chunks, self.version) == \
+            (other.object_size, other.object_etag, other.function, other.arguments, other.chunk_size,
+             other.num_chunks, other.version)
+
+    def to_json(self) -> bytes:
+        return json.dumps(asdict(self)).encode("utf-8")
+
+    @classmethod
+    def from_json(cls, data: bytes) -> JobManifest:
+        manifest = json.loads(data)
+        manifest["completed"] = {int(chunk_id): key for chunk_id, key in manifest.get("completed", {}).items()}
+        return cls(**manifest)
+
+
+def manifest_key(cloud_object: CloudObject) -> str:
+    return cloud_object.path.key + MANIFEST_SUFFIX
+
+
+def load_manifest(cloud_object: CloudObject) -> Optional[JobManifest]:
+    try:
+        res = cloud_object.storage.get_object(Bucket=cloud_object.meta_path.bucket, Key=manifest_key(cloud_object))
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise e
+    try:
+        return JobManifest.from_json(res["Body"].read())
+    except (ValueError, TypeError) as e:
+        logger.warning("Ignoring invalid job manifest of %s: %s", cloud_object.path.as_uri(), e)
+        return None
+
+
+def save_manifest(cloud_object: CloudObject, manifest: JobManifest):
+    cloud_object.storage.put_object(
+        Body=manifest.to_json(),
+        Bucket=cloud_object.meta_path.bucket,
+        Key=manifest_key(cloud_object),
+        Metadata={"dataplug": __version__},
+    )
+
+
+def list_job_keys(cloud_object: CloudObject) -> Tuple[List[str], bool]:
+    """
+    Keys of the partial results of the object staged in the meta bucket by map and combine jobs, and whether there
+    is a job manifest
+    """
+    pattern = re.compile(re.escape(cloud_object.path.key) + r"\.chunk\d+(\.level\d+)?")
+    keys = []
+    has_manifest = False
+    kwargs = {"Bucket": cloud_object.meta_path.bucket, "Prefix": f"{cloud_object.path.key}."}
+    while True:
+        res = cloud_object.storage.list_objects_v2(**kwargs)
+        for obj in res.get("Contents", []):
+            if pattern.fullmatch(obj["Key"]):
+                keys.append(obj["Key"])
+            elif obj["Key"] == manifest_key(cloud_object):
+                has_manifest = True
+        if not res.get("IsTruncated"):
+            return keys, has_manifest
+        kwargs["ContinuationToken"] = res["NextContinuationToken"]
+
+
+def delete_partials(cloud_object: CloudObject, keys: List[str]):
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        cloud_object.storage.delete_objects(
+            Bucket=cloud_object.meta_path.bucket,
+            Delete={"Objects": [{"Key": key} for key in keys[i:i + DELETE_BATCH_SIZE]], "Quiet": True},
+        )
+
+
+def _completed_chunks(cloud_object: CloudObject, keys: List[str], num_chunks: int) -> Dict[int, str]:
+    # Partial results of map jobs, combined results of several chunks are not reused
+    pattern = re.compile(re.escape(cloud_object.path.key) + r"\.chunk(\d+)")
+    completed = {}
+    for key in keys:
+        match = pattern.fullmatch(key)
+        if match is not None and int(match.group(1)) < num_chunks:
+            completed[int(match.group(1))] = key
+    return completed
+
+
+def restore_checkpoint(cloud_object: CloudObject, manifest: JobManifest, resume: bool = True,
+                       save: bool = True) -> JobManifest:
+    """
+    Fill the completed chunks of the manifest with the partial results staged by a previous run of the same job,
+    if ``resume``, and delete the other staged partial results. With ``save``, the manifest is stored so that
+    this run can be resumed.
+    """
+    staged, has_manifest = list_job_keys(cloud_object)
+    previous = load_manifest(cloud_object) if resume and staged and has_manifest else None
+    if previous is not None and manifest.is_same_job(previous):
+        # Chunks staged after the manifest was last saved are also completed, as partial results are stored at once
+        manifest.completed = _completed_chunks(cloud_object, staged, manifest.num_chunks)
+        logger.info("Resuming preprocessing of %s, %d of %d chunks are completed", cloud_object.path.as_uri(),
+                    len(manifest.completed), manifest.num_chunks)
+
+    stale = [key for key in staged if key not in manifest.completed.values()]
+    if stale:
+        logger.info("Deleting %d stale partial results of %s", len(stale), cloud_object.path.as_uri())
+    if has_manifest and not save and not manifest.completed:
+        stale.append(manifest_key(cloud_object))
+    delete_partials(cloud_object, stale)
+    if save:
+        save_manifest(cloud_object, manifest)
+    return manifest
+
+
+def save_checkpoint(cloud_object: CloudObject, manifest: JobManifest):
+    """
+    Record in the manifest the chunks whose partial results are staged, e.g. after a failure of the job
+    """
+    staged, _ = list_job_keys(cloud_object)
+    if not staged:
+        # Nothing to resume, e.g. the final metadata of the object was stored and its partial results deleted
+        return
+    manifest.completed = _completed_chunks(cloud_object, staged, manifest.num_chunks)
+    logger.info("Checkpointed preprocessing of %s, %d of %d chunks are completed", cloud_object.path.as_uri(),
+                len(manifest.completed), manifest.num_chunks)
+    save_manifest(cloud_object, manifest)
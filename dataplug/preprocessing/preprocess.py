@@ -1,12 +1,22 @@
 import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
 
 import joblib
+from joblib.parallel import get_active_backend
 
-from .handler import monolith_joblib_handler, map_joblib_handler, reduce_joblib_handler
+from .handler import monolith_joblib_handler, map_joblib_handler, combine_joblib_handler, reduce_joblib_handler
+from .manifest import JobManifest, restore_checkpoint, save_checkpoint
+from ..storage.metrics import map_in_context
+from ..storage.picklableS3 import DEFAULT_MAX_POOL_CONNECTIONS
 
+logger = logging.getLogger(__name__)
 
-# Process the entire object as one batch job
-def monolithic_preprocessing(cloud_object, parallel_config, preprocessing_function, extra_args):
+MIN_CHUNK_SIZE = 1024 * 1024  # Smallest chunk size picked by adaptive chunk sizing
+
+
+def _monolithic_jobs(cloud_object, preprocessing_function, extra_args):
     preproc_signature = inspect.signature(preprocessing_function).parameters
 
     if "cloud_object" not in preproc_signature:
@@ -18,44 +28,157 @@ def monolithic_preprocessing(cloud_object, parallel_config, preprocessing_functi
     for arg in preproc_signature.keys():
         if arg not in preproc_args and arg in extra_args:
             preproc_args[arg] = extra_args[arg]
+    return [preproc_args]
 
-    with joblib.parallel_config(**parallel_config):
-        jl = joblib.Parallel()
-        gen = jl([joblib.delayed(monolith_joblib_handler)((preprocessing_function, preproc_args))])
-        # joblib returns a generator
-        res = list(gen).pop()
 
-
-# Partition the object in chunks and preprocess it in parallel
-def mapreduce_preprocessing(cloud_object, parallel_config, chunk_size, preprocessing_function, finalizer_function,
-                            extra_args):
+def _map_jobs(cloud_object, chunk_size, preprocessing_function, extra_args, overlap=0):
     preproc_signature = inspect.signature(preprocessing_function).parameters
     if not {"chunk_data", "chunk_id", "chunk_size", "num_chunks"}.issubset(preproc_signature.keys()):
         raise Exception("Preprocessing function must have "
                         "(chunk_data, chunk_id, chunk_size, num_chunks) as parameters")
 
     jobs = []
-    num_chunks = cloud_object.size // chunk_size
+    # The last chunk holds the remainder, up to the end of the object
+    num_chunks = ceil(cloud_object.size / chunk_size)
     for chunk_id in range(num_chunks):
         preproc_args = {"cloud_object": cloud_object, "chunk_id": chunk_id, "chunk_size": chunk_size,
-                        "num_chunks": num_chunks, "chunk_data": None}
+                        "num_chunks": num_chunks, "chunk_data": None, "overlap": overlap}
+        if "chunk_range" in preproc_signature:
+            # Logical boundaries of the chunk, as chunk_data also holds the overlap
+            preproc_args["chunk_range"] = None
         # Add extra args if there are any other arguments in the signature
         for arg in preproc_signature.keys():
-            if arg not in preproc_args:
+            if arg not in preproc_args and arg in extra_args:
                 preproc_args[arg] = extra_args[arg]
         jobs.append(preproc_args)
+    return jobs
+
+
+def adaptive_chunk_size(total_size, parallel_config, chunks_per_worker):
+    """
+    Chunk size that splits total_size bytes in about chunks_per_worker chunks per worker of the joblib backend
+    configured by parallel_config, and at least MIN_CHUNK_SIZE bytes
+    """
+    assert chunks_per_worker > 0, "Chunks per worker must be greater than 0"
+    with joblib.parallel_config(**parallel_config):
+        # n_jobs=None resolves the number of workers set in the parallel config
+        num_workers = max(joblib.effective_n_jobs(n_jobs=None), 1)
+    return max(ceil(total_size / (num_workers * chunks_per_worker)), MIN_CHUNK_SIZE)
+
+
+# joblib backends that run jobs in the local machine, which can return partial results without staging them
+LOCAL_BACKENDS = {"LokyBackend", "ThreadingBackend", "MultiprocessingBackend", "SequentialBackend"}
+
+
+def _is_local_backend():
+    backend, _ = get_active_backend()
+    return type(backend).__name__ in LOCAL_BACKENDS
+
+
+# Process the entire object as one batch job
+def monolithic_preprocessing(cloud_object, parallel_config, preprocessing_function, extra_args):
+    monolithic_preprocessing_many([cloud_object], parallel_config, preprocessing_function, extra_args)
+
+
+# Process many objects, each as one batch job, in a single parallel call
+def monolithic_preprocessing_many(cloud_objects, parallel_config, preprocessing_function, extra_args):
+    jobs = [job for co in cloud_objects for job in _monolithic_jobs(co, preprocessing_function, extra_args)]
 
     with joblib.parallel_config(**parallel_config):
         jl = joblib.Parallel()
-        # Run partial chunking preprocessing jobs in parallel
-        gen = jl([joblib.delayed(map_joblib_handler)((preprocessing_function, job)) for job in jobs])
+        gen = jl([joblib.delayed(monolith_joblib_handler)((preprocessing_function, job)) for job in jobs])
         # joblib returns a generator
-        partial_results = list(gen)
+        res = list(gen)
+
+
+# Partition the object in chunks and preprocess it in parallel
+def mapreduce_preprocessing(cloud_object, parallel_config, chunk_size, preprocessing_function, finalizer_function,
+                            extra_args, stage_partials=None, combiner_function=None, reduce_fanout=None,
+                            overlap=0, resume=True):
+    mapreduce_preprocessing_many([(cloud_object, chunk_size)], parallel_config, preprocessing_function,
+                                 finalizer_function, extra_args, stage_partials, combiner_function, reduce_fanout,
+                                 overlap, resume)
+
+
+def _run_per_object(function, *iterables):
+    # Requests for the checkpoints of many objects are made concurrently
+    with ThreadPoolExecutor(max_workers=DEFAULT_MAX_POOL_CONNECTIONS) as pool:
+        return map_in_context(pool, function, *iterables)
+
+
+# Partition many objects in chunks and preprocess them, the chunks of all objects are mapped in a single
+# parallel call and the partial results of all objects are reduced in another.
+# Partial results are returned through joblib with local backends, and staged in the meta bucket with distributed
+# backends (or as set by stage_partials).
+# With a combiner function and a reduce fanout, partial results are reduced in a tree: groups of reduce_fanout
+# consecutive partial results are combined in parallel waves until at most reduce_fanout remain for the finalizer.
+# Each mapper reads overlap bytes past the end of its chunk, in the same request.
+# Chunks whose partial results were staged by a previous run of the same job are not mapped again if resume,
+# see the manifest module. Staged runs save a job manifest, which records the completed chunks if any phase fails
+def mapreduce_preprocessing_many(objects_chunk_sizes, parallel_config, preprocessing_function, finalizer_function,
+                                 extra_args, stage_partials=None, combiner_function=None, reduce_fanout=None,
+                                 overlap=0, resume=True):
+    if reduce_fanout is not None:
+        assert combiner_function is not None, "Combiner function must be defined for tree reduction"
+        assert reduce_fanout >= 2, "Reduce fanout must be at least 2"
+    cloud_objects = [cloud_object for cloud_object, _ in objects_chunk_sizes]
+    object_jobs = [_map_jobs(cloud_object, chunk_size, preprocessing_function, extra_args, overlap)
+                   for cloud_object, chunk_size in objects_chunk_sizes]
+    job_args = {arg: value for arg, value in extra_args.items()
+                if arg in inspect.signature(preprocessing_function).parameters}
+    manifests = [JobManifest.for_job(cloud_object, preprocessing_function, chunk_size, len(jobs), job_args)
+                 for (cloud_object, chunk_size), jobs in zip(objects_chunk_sizes, object_jobs)]
+
+    with joblib.parallel_config(**parallel_config):
+        if stage_partials is None:
+            stage_partials = not _is_local_backend()
+        manifests = _run_per_object(lambda co, manifest: restore_checkpoint(co, manifest, resume, stage_partials),
+                                    cloud_objects, manifests)
+
+        # Partial results of the completed chunks are read from the meta bucket
+        partial_results = [sorted(manifest.completed.items()) for manifest in manifests]
+        jobs = [(object_idx, job) for object_idx, (jobs, manifest) in enumerate(zip(object_jobs, manifests))
+                for job in jobs if job["chunk_id"] not in manifest.completed]
+
+        jl = joblib.Parallel()
+        try:
+            # Run partial chunking preprocessing jobs in parallel
+            gen = jl([joblib.delayed(map_joblib_handler)((preprocessing_function, job, stage_partials))
+                      for _, job in jobs])
+            # joblib returns a generator
+            for (object_idx, _), partial_result in zip(jobs, gen):
+                partial_results[object_idx].append(partial_result)
+            # Sort partial results by chunk_id
+            for results in partial_results:
+                results.sort(key=lambda x: x[0])
 
-        # Sort partial results by chunk_id
-        partial_results.sort(key=lambda x: x[0])
+            level = 0
+            while reduce_fanout is not None and any(len(results) > reduce_fanout for results in partial_results):
+                # Run a wave of combiners, over groups of consecutive partial results of all objects
+                level += 1
+                combine_jobs = []
+                for object_idx, (cloud_object, results) in enumerate(zip(cloud_objects, partial_results)):
+                    if len(results) <= reduce_fanout:
+                        continue
+                    for i in range(0, len(results), reduce_fanout):
+                        args = {"cloud_object": cloud_object, "partial_results": results[i:i + reduce_fanout],
+                                "level": level}
+                        combine_jobs.append((object_idx, args))
+                    partial_results[object_idx] = []
+                gen = jl([joblib.delayed(combine_joblib_handler)((combiner_function, args, stage_partials))
+                          for _, args in combine_jobs])
+                for (object_idx, _), partial_result in zip(combine_jobs, gen):
+                    partial_results[object_idx].append(partial_result)
 
-        # Run finalizer function to merge all partial results
-        args = {"cloud_object": cloud_object, "partial_results": partial_results}
-        gen = jl([joblib.delayed(reduce_joblib_handler)((finalizer_function, args))])
-        res = list(gen).pop()
+            # Run finalizer function to merge all partial results
+            reduce_jobs = [
+                {"cloud_object": cloud_object, "partial_results": results}
+                for (cloud_object, _), results in zip(objects_chunk_sizes, partial_results)
+            ]
+            gen = jl([joblib.delayed(reduce_joblib_handler)((finalizer_function, args)) for args in reduce_jobs])
+            res = list(gen)
+        except BaseException:
+            if stage_partials:
+                logger.error("Preprocessing failed, saving checkpoints to resume it")
+                _run_per_object(save_checkpoint, cloud_objects, manifests)
+            raise
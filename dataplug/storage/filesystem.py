@@ -1,9 +1,16 @@
 from __future__ import annotations
 
+import datetime
 import io
+import mmap
 import os
 import pathlib
+import re
 import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import suppress
 
 import botocore
 from typing import TYPE_CHECKING, Union, IO, Any
@@ -11,41 +18,371 @@ from botocore.response import StreamingBody
 
 
 if TYPE_CHECKING:
-    from mypy_boto3_s3.type_defs import DeleteTypeDef
+    from typing import Dict, List, Optional, Tuple
+    from mypy_boto3_s3.type_defs import DeleteTypeDef, CompletedMultipartUploadTypeDef
+
+UPLOADS_DIR = ".dataplug-uploads"  # Directory in the root where parts of multipart uploads are staged
+DEFAULT_MAX_KEYS = 1000
+COPY_BUFFER_SIZE = 1048576
+MAX_OPEN_MAPS = 64  # Memory maps kept open by a storage instance, each one holds a file descriptor
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def _not_found(operation_name: str, code: str = "404"):
+    return botocore.exceptions.ClientError(
+        error_response={"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": 404}},
+        operation_name=operation_name
+    )
+
+
+def _response_metadata(status: int = 200) -> dict:
+    return {"HTTPStatusCode": status, "RetryAttempts": 0}
+
+
+class _MmapReader(io.RawIOBase):
+    """
+    Raw stream over a byte range of a memory-mapped file. Data is copied directly from the page cache
+    into the reader's buffer, without intermediate copies.
+    """
+
+    def __init__(self, view: Union[memoryview, bytes]):
+        self._view = memoryview(view)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self._view) - self._pos)
+        memoryview(b).cast("B")[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        data = self._view[self._pos:self._pos + size].tobytes()
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+class _MmapStreamingBody(StreamingBody):
+    """
+    StreamingBody that also supports ``readinto``, so that ranged reads can be written in place into
+    a preallocated buffer
+    """
+
+    def readinto(self, b) -> int:
+        n = self._raw_stream.readinto(b)
+        self._amount_read += n
+        return n
 
 
 class FileSystemS3API:
-    def __init__(self):
-        self.__file_handles = {}
+    """
+    Storage backend with the subset of the S3 client API used by Dataplug, backed by a local directory.
+    Buckets are directories under ``root`` and keys are paths relative to their bucket. Objects are read through
+    memory maps shared by all the requests of a process, so ranged reads do not copy data through intermediate
+    buffers. The maps of the last ``MAX_OPEN_MAPS`` objects read are kept open, call ``close`` to release them.
+    Instances can be pickled and passed to CloudObject as its storage.
+    """
+
+    def __init__(self, root: str = "."):
+        self.root = pathlib.Path(root).absolute()
+        self.__maps: OrderedDict[pathlib.Path, Tuple[Tuple[int, int, int], Union[mmap.mmap, bytes]]] = OrderedDict()
+        self.__maps_lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"root": str(self.root)}
+
+    def __setstate__(self, state):
+        self.__init__(state["root"])
 
-    def __del__(self):
-        for path, fh in self.__file_handles.items():
-            fh.close()
+    def _bucket_path(self, Bucket: str) -> pathlib.Path:
+        if not Bucket or "/" in Bucket or Bucket.startswith("."):
+            raise ValueError(f"Invalid bucket name {Bucket}")
+        return self.root / Bucket
+
+    def _build_path(self, Bucket: str, Key: str) -> pathlib.Path:
+        bucket_path = self._bucket_path(Bucket)
+        path = pathlib.Path(os.path.normpath(bucket_path / Key))
+        if path != bucket_path and bucket_path not in path.parents:
+            raise ValueError(f"Key {Key} is outside of bucket {Bucket}")
+        return path
+
+    def _open_as_file(self, Bucket: str, Key: str, mode: str = "rb") -> IO[Any]:
+        path = self._build_path(Bucket, Key)
+        if not path.is_file():
+            raise _not_found("GetObject", "NoSuchKey")
+        return path.open(mode)
+
+    def _get_map(self, path: pathlib.Path, stat: os.stat_result) -> memoryview:
+        version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self.__maps_lock:
+            cached = self.__maps.get(path)
+            if cached is not None and cached[0] == version:
+                self.__maps.move_to_end(path)
+                return memoryview(cached[1])
+            if stat.st_size == 0:
+                # Empty files can not be mapped
+                data = b""
+            else:
+                with path.open("rb") as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if cached is not None:
+                self._close_map(cached[1])
+            self.__maps[path] = (version, data)
+            self.__maps.move_to_end(path)
+            while len(self.__maps) > MAX_OPEN_MAPS:
+                _, (_, evicted) = self.__maps.popitem(last=False)
+                self._close_map(evicted)
+            # The view is taken while the map is in the cache, so that it is not closed under the reader
+            return memoryview(data)
+
+    def _forget_map(self, path: pathlib.Path):
+        with self.__maps_lock:
+            cached = self.__maps.pop(path, None)
+            if cached is not None:
+                self._close_map(cached[1])
+
+    @staticmethod
+    def _close_map(data: Union[mmap.mmap, bytes]):
+        if isinstance(data, mmap.mmap):
+            # Maps still used by readers can not be closed, they are closed when the last reader releases them
+            with suppress(BufferError):
+                data.close()
+
+    def close(self):
+        """
+        Close the memory maps of the objects read, the storage can still be used afterwards
+        """
+        with self.__maps_lock:
+            for _, data in self.__maps.values():
+                self._close_map(data)
+            self.__maps.clear()
+
+    @staticmethod
+    def _etag(stat: os.stat_result) -> str:
+        # Cheap version identifier instead of the MD5 of the contents, changes whenever the file is rewritten.
+        # Returned by every request, including the writes
+        return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    @staticmethod
+    def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+        """
+        Parse a Range header with the semantics of S3, returns the half-open (start, end) byte range to read.
+        Supports ``bytes=a-b`` (inclusive), ``bytes=a-`` and ``bytes=-n`` (last n bytes). As in S3, a header that
+        can not be parsed (or with multiple ranges) is ignored and None is returned, to read the whole object.
+        Raises an InvalidRange error (416) for ranges that are not satisfiable.
+        """
+        match = RANGE_RE.fullmatch(range_header.strip())
+        if match is None:
+            return None
+        first, last = match.group(1), match.group(2)
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = int(last) + 1 if last else size
+        elif last:
+            start = max(size - int(last), 0)
+            end = size if int(last) > 0 else 0
+        else:
+            return None
+
+        if start >= size or end <= start:
+            raise botocore.exceptions.ClientError(
+                error_response={
+                    "Error": {
+                        "Code": "InvalidRange",
+                        "Message": "The requested range is not satisfiable",
+                        "RangeRequested": range_header,
+                        "ActualObjectSize": str(size),
+                    },
+                    "ResponseMetadata": {"HTTPStatusCode": 416},
+                },
+                operation_name="GetObject",
+            )
+        return start, min(end, size)
+
+    def _write(self, path: pathlib.Path, body: Union[IO[Any], StreamingBody, bytes, bytearray, str]) -> str:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file and replace the object atomically, concurrent readers keep the old version
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with tmp_path.open("wb") as f:
+                if hasattr(body, "read"):
+                    while True:
+                        chunk = body.read(COPY_BUFFER_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                else:
+                    if isinstance(body, str):
+                        body = body.encode("utf-8")
+                    f.write(body)
+            # The file keeps its inode and modification time when it is renamed, so the ETag of the version
+            # written is the one returned by later requests
+            etag = self._etag(tmp_path.stat())
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        self._forget_map(path)
+        return etag
+
+    def _upload_path(self, Bucket: str, Key: str, UploadId: str) -> pathlib.Path:
+        path = self.root / UPLOADS_DIR / UploadId
+        if not (path / "key").is_file() or (path / "key").read_text() != f"{Bucket}/{Key}":
+            raise _not_found("UploadPart", "NoSuchUpload")
+        return path
+
+    def _iter_keys(self, Bucket: str, prefix: str):
+        """
+        Yield the sorted keys of a bucket that start with prefix, only walking the directories that can contain them
+        """
+        bucket_path = self._bucket_path(Bucket)
+        if not bucket_path.is_dir():
+            raise _not_found("ListObjectsV2", "NoSuchBucket")
+        start_dir = bucket_path / prefix.rpartition("/")[0]
+        if not start_dir.is_dir():
+            return
+        keys = []
+        for dirpath, _, filenames in os.walk(start_dir):
+            rel_dir = pathlib.Path(dirpath).relative_to(bucket_path).as_posix()
+            for filename in filenames:
+                if filename.startswith(".") and filename.endswith(".tmp"):
+                    continue
+                key = filename if rel_dir == "." else f"{rel_dir}/{filename}"
+                if key.startswith(prefix):
+                    keys.append(key)
+        keys.sort()
+        yield from keys
+
+    def _list(self, Bucket: str, Prefix: str, Delimiter: Optional[str], MaxKeys: int, after: Optional[str]):
+        contents: List[dict] = []
+        common_prefixes: List[str] = []
+        last = None
+        truncated = False
+        for key in self._iter_keys(Bucket, Prefix):
+            if after is not None and key <= after:
+                continue
+            if Delimiter:
+                idx = key.find(Delimiter, len(Prefix))
+                if idx != -1:
+                    common_prefix = key[:idx + len(Delimiter)]
+                    if common_prefixes and common_prefixes[-1] == common_prefix:
+                        continue
+                    if after is not None and after.startswith(common_prefix):
+                        continue
+                    if len(contents) + len(common_prefixes) == MaxKeys:
+                        truncated = True
+                        break
+                    common_prefixes.append(common_prefix)
+                    last = common_prefix
+                    continue
+            if len(contents) + len(common_prefixes) == MaxKeys:
+                truncated = True
+                break
+            stat = self._build_path(Bucket, key).stat()
+            contents.append({
+                "Key": key,
+                "Size": stat.st_size,
+                "LastModified": datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc),
+                "ETag": self._etag(stat),
+                "StorageClass": "STANDARD",
+            })
+            last = key
+
+        res = {
+            "Name": Bucket,
+            "Prefix": Prefix,
+            "MaxKeys": MaxKeys,
+            "IsTruncated": truncated,
+            "ResponseMetadata": _response_metadata(),
+        }
+        if contents:
+            res["Contents"] = contents
+        if Delimiter:
+            res["Delimiter"] = Delimiter
+            res["CommonPrefixes"] = [{"Prefix": p} for p in common_prefixes]
+        return res, (last if truncated else None)
 
     def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, *args, **kwargs):
-        raise NotImplementedError()
+        shutil.rmtree(self._upload_path(Bucket, Key, UploadId))
+        return {"ResponseMetadata": _response_metadata(204)}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str,
+                                  MultipartUpload: Optional[CompletedMultipartUploadTypeDef] = None, *args, **kwargs):
+        upload_path = self._upload_path(Bucket, Key, UploadId)
+        part_numbers = [part["PartNumber"] for part in (MultipartUpload or {}).get("Parts", [])]
+        if part_numbers != sorted(part_numbers):
+            raise botocore.exceptions.ClientError(
+                error_response={"Error": {"Code": "InvalidPartOrder"}}, operation_name="CompleteMultipartUpload"
+            )
+        for part_number in part_numbers:
+            if not (upload_path / str(part_number)).is_file():
+                raise botocore.exceptions.ClientError(
+                    error_response={"Error": {"Code": "InvalidPart"}}, operation_name="CompleteMultipartUpload"
+                )
+
+        class _Parts(io.RawIOBase):
+            def __init__(self):
+                self._files = iter(part_numbers)
+                self._current = None
+
+            def readable(self):
+                return True
 
-    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, *args, **kwargs):
-        raise NotImplementedError()
+            def read(self, size=-1):
+                while True:
+                    if self._current is None:
+                        part_number = next(self._files, None)
+                        if part_number is None:
+                            return b""
+                        self._current = (upload_path / str(part_number)).open("rb")
+                    data = self._current.read(size)
+                    if data:
+                        return data
+                    self._current.close()
+                    self._current = None
+
+        etag = self._write(self._build_path(Bucket, Key), _Parts())
+        shutil.rmtree(upload_path)
+        return {"Bucket": Bucket, "Key": Key, "ETag": etag, "ResponseMetadata": _response_metadata()}
 
     def create_bucket(self, Bucket: str, *args, **kwargs):
-        pathlib.Path(Bucket).mkdir(parents=True, exist_ok=True)
+        self._bucket_path(Bucket).mkdir(parents=True, exist_ok=True)
+        return {"Location": f"/{Bucket}", "ResponseMetadata": _response_metadata()}
 
     def create_multipart_upload(self, Bucket: str, Key: str, *args, **kwargs):
-        raise NotImplementedError()
+        self._build_path(Bucket, Key)
+        upload_id = uuid.uuid4().hex
+        upload_path = self.root / UPLOADS_DIR / upload_id
+        upload_path.mkdir(parents=True)
+        (upload_path / "key").write_text(f"{Bucket}/{Key}")
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id, "ResponseMetadata": _response_metadata()}
 
     def delete_object(self, Bucket: str, Key: str, *args, **kwargs):
         path = self._build_path(Bucket, Key)
-        if path.exists() and path.is_file():
+        if not self._bucket_path(Bucket).is_dir():
+            raise _not_found("DeleteObject", "NoSuchBucket")
+        # As in S3, deleting a key that does not exist succeeds
+        if path.is_file():
             path.unlink()
-        else:
-            raise botocore.exceptions.ClientError(
-                error_response={"Error": {"Code": "404"}}, operation_name="DeleteObject"
-            )
+            self._forget_map(path)
+        return {"ResponseMetadata": _response_metadata(204)}
 
     def delete_objects(self, Bucket: str, Delete: DeleteTypeDef, *args, **kwargs):
+        deleted = []
         for obj in Delete["Objects"]:
             self.delete_object(Bucket, obj["Key"])
+            deleted.append({"Key": obj["Key"]})
+        return {"Deleted": deleted, "ResponseMetadata": _response_metadata()}
 
     def download_file(self, Bucket: str, Key: str, Filename: str, *args, **kwargs):
         with self._open_as_file(Bucket, Key, "rb") as f1:
@@ -58,101 +395,141 @@ class FileSystemS3API:
 
     def get_object(self, Bucket: str, Key: str, *args, **kwargs):
         path = self._build_path(Bucket, Key)
-        if path.exists() and path.is_file():
-            size = path.stat().st_size
-            if "Range" in kwargs:
-                range_0, range_1 = kwargs["Range"].replace("bytes=", "").split("-")
-                range_0, range_1 = int(range_0), int(range_1)
-                with path.open("rb") as f:
-                    # Read all chunk into memory, as we could seek after the intended range if we just open the file
-                    f.seek(range_0)
-                    chunk = f.read(range_1 - range_0)
-                buff = io.BytesIO(chunk)
-                return {
-                    "Body": StreamingBody(raw_stream=buff, content_length=range_1 - range_0),
-                    "ContentLength": range_1 - range_0,
-                    "ResponseMetadata": {"HTTPStatusCode": 206},
-                }
-            else:
-                return {
-                    "Body": StreamingBody(raw_stream=path.open("rb"), content_length=size),
-                    "ContentLength": size,
-                    "ResponseMetadata": {"HTTPStatusCode": 200},
-                }
+        try:
+            stat = path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            raise _not_found("GetObject", "NoSuchKey")
+        if not path.is_file():
+            raise _not_found("GetObject", "NoSuchKey")
+
+        size = stat.st_size
+        data = self._get_map(path, stat)
+        res = {
+            "LastModified": datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc),
+            "ETag": self._etag(stat),
+            "AcceptRanges": "bytes",
+        }
+        byte_range = self._parse_range(kwargs["Range"], size) if kwargs.get("Range") else None
+        if byte_range is not None:
+            range_0, range_1 = byte_range
+            length = range_1 - range_0
+            res.update({
+                "Body": _MmapStreamingBody(raw_stream=_MmapReader(data[range_0:range_0 + length]),
+                                           content_length=length),
+                "ContentLength": length,
+                "ContentRange": f"bytes {range_0}-{range_0 + length - 1}/{size}",
+                "ResponseMetadata": _response_metadata(206),
+            })
         else:
-            raise botocore.exceptions.ClientError(
-                error_response={"Error": {"Code": "404"}}, operation_name="GetObject"
-            )
+            res.update({
+                "Body": _MmapStreamingBody(raw_stream=_MmapReader(data), content_length=size),
+                "ContentLength": size,
+                "ResponseMetadata": _response_metadata(200),
+            })
+        return res
 
     def head_bucket(self, Bucket: str, *args, **kwargs):
         # check if directory exists
-        path = pathlib.Path(Bucket)
+        path = self._bucket_path(Bucket)
         if path.exists() and path.is_dir():
-            return {}
+            return {"ResponseMetadata": _response_metadata()}
         else:
-            raise botocore.exceptions.ClientError(
-                error_response={"Error": {"Code": "404"}}, operation_name="HeadBucket"
-            )
+            raise _not_found("HeadBucket")
 
     def head_object(self, Bucket: str, Key: str, *args, **kwargs):
-        path = pathlib.Path(os.path.join(Bucket, Key))
+        path = self._build_path(Bucket, Key)
         if path.exists() and path.is_file():
-            size = path.stat().st_size
-            return {"ContentLength": size}
+            stat = path.stat()
+            return {
+                "ContentLength": stat.st_size,
+                "LastModified": datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc),
+                "ETag": self._etag(stat),
+                "AcceptRanges": "bytes",
+                "ResponseMetadata": _response_metadata(),
+            }
         else:
-            raise botocore.exceptions.ClientError(
-                error_response={"Error": {"Code": "404"}}, operation_name="HeadObject"
-            )
+            raise _not_found("HeadObject")
 
     def list_buckets(self):
-        raise NotImplementedError()
+        buckets = []
+        if self.root.is_dir():
+            for path in sorted(self.root.iterdir()):
+                if path.is_dir() and not path.name.startswith("."):
+                    buckets.append({
+                        "Name": path.name,
+                        "CreationDate": datetime.datetime.fromtimestamp(path.stat().st_ctime,
+                                                                        tz=datetime.timezone.utc)
+                    })
+        return {"Buckets": buckets, "ResponseMetadata": _response_metadata()}
 
     def list_multipart_uploads(self, Bucket: str, *args, **kwargs):
-        raise NotImplementedError()
+        uploads = []
+        uploads_path = self.root / UPLOADS_DIR
+        if uploads_path.is_dir():
+            for path in sorted(uploads_path.iterdir()):
+                bucket, _, key = (path / "key").read_text().partition("/")
+                if bucket == Bucket and key.startswith(kwargs.get("Prefix", "")):
+                    uploads.append({"Key": key, "UploadId": path.name})
+        return {"Bucket": Bucket, "Uploads": uploads, "IsTruncated": False, "ResponseMetadata": _response_metadata()}
 
     def list_objects(self, Bucket: str, *args, **kwargs):
-        prefix = kwargs.get("Prefix", "")
-        path = self._build_path(Bucket, prefix)
-
-        if path.exists() and path.is_file():
-            return {"Contents": [{"Key": path.relative_to(path.parent).as_posix()}]}
-        if path.exists() and path.is_dir():
-            return {"Contents": [{"Key": p.relative_to(path).as_posix()} for p in path.glob("**/*") if p.is_file()]}
-        else:
-            # List parent if it is an incomplete path
-            parent = path.parent
-            keys = []
-            for p in parent.glob("**/*"):
-                if p.is_file() and p.relative_to(parent).as_posix().startswith(prefix):
-                    keys.append(p.as_posix())
-            return {"Contents": [{"Key": k} for k in keys]}
+        res, next_marker = self._list(
+            Bucket, kwargs.get("Prefix", ""), kwargs.get("Delimiter"), kwargs.get("MaxKeys", DEFAULT_MAX_KEYS),
+            kwargs.get("Marker") or None
+        )
+        res["Marker"] = kwargs.get("Marker", "")
+        if next_marker is not None:
+            res["NextMarker"] = next_marker
+        return res
 
     def list_objects_v2(self, Bucket: str, *args, **kwargs):
-        return self.list_objects(Bucket, *args, **kwargs)
+        after = kwargs.get("ContinuationToken") or kwargs.get("StartAfter") or None
+        res, next_token = self._list(
+            Bucket, kwargs.get("Prefix", ""), kwargs.get("Delimiter"), kwargs.get("MaxKeys", DEFAULT_MAX_KEYS), after
+        )
+        res["KeyCount"] = len(res.get("Contents", [])) + len(res.get("CommonPrefixes", []))
+        if "ContinuationToken" in kwargs:
+            res["ContinuationToken"] = kwargs["ContinuationToken"]
+        if "StartAfter" in kwargs:
+            res["StartAfter"] = kwargs["StartAfter"]
+        if next_token is not None:
+            res["NextContinuationToken"] = next_token
+        return res
 
     def list_parts(self, Bucket: str, Key: str, UploadId: str, *args, **kwargs):
-        raise NotImplementedError()
+        upload_path = self._upload_path(Bucket, Key, UploadId)
+        parts = []
+        for path in upload_path.iterdir():
+            if path.name.isdigit():
+                parts.append({"PartNumber": int(path.name), "Size": path.stat().st_size})
+        parts.sort(key=lambda part: part["PartNumber"])
+        return {"Bucket": Bucket, "Key": Key, "UploadId": UploadId, "Parts": parts, "IsTruncated": False,
+                "ResponseMetadata": _response_metadata()}
 
     def put_object(self, Bucket: str, Key: str, *args, **kwargs):
-        if "Body" in kwargs:
-            path = self._build_path(Bucket, Key)
-            path.parent.mkdir(parents=True, exist_ok=True)
-            with path.open("wb") as f:
-                if hasattr(kwargs["Body"], "read"):
-                    shutil.copyfileobj(kwargs["Body"], f)
-                else:
-                    f.write(kwargs["Body"])
-        else:
-            path = self._build_path(Bucket, Key)
-            path.parent.mkdir(parents=True, exist_ok=True)
-            path.touch()
+        path = self._build_path(Bucket, Key)
+        etag = self._write(path, kwargs.get("Body", b""))
+        return {"ETag": etag, "ResponseMetadata": _response_metadata()}
 
-    def upload_file(self, Bucket: str, Key: str, Filename: str, *args, **kwargs) -> None:
+    def upload_file(self, Filename: str, Bucket: str, Key: str, *args, **kwargs) -> None:
+        # Same argument order as boto3
         with open(Filename, "rb") as f:
-            self.put_object(Bucket, Key, Body=f, *args, **kwargs)
+            self.upload_fileobj(f, Bucket, Key, *args, **kwargs)
+
+    def upload_fileobj(self, Fileobj: Union[IO[Any], StreamingBody], Bucket: str, Key: str,
+                       *args, **kwargs) -> None:
+        callback = kwargs.get("Callback")
+
+        class _Progress:
+            def read(self, size=-1):
+                data = Fileobj.read(size)
+                if callback is not None and data:
+                    callback(len(data))
+                return data
 
-    def upload_fileobj(self, Bucket: str, Key: str, Fileobj: Union[IO[Any], StreamingBody], *args, **kwargs) -> None:
-        self.put_object(Bucket, Key, Body=Fileobj, *args, **kwargs)
+        self.put_object(Bucket, Key, Body=_Progress())
 
     def upload_part(self, Bucket: str, Key: str, PartNumber: int, UploadId: str, *args, **kwargs):
-        raise NotImplementedError()
+        upload_path = self._upload_path(Bucket, Key, UploadId)
+        etag = self._write(upload_path / str(PartNumber), kwargs.get("Body", b""))
+        return {"ETag": etag, "ResponseMetadata": _response_metadata()}
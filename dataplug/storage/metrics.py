@@ -0,0 +1,208 @@
+"""
+Accounting of storage requests.
+
+Every request made through ``PickleableS3ClientProxy`` is recorded (operation, object, latency, bytes transferred,
+retries and errors) into the collectors active in the current context, and passed to the registered callbacks.
+Collectors are scoped with ``collect_metrics``, so that workers can attribute requests to a slice or a
+preprocessing chunk and return the stats with their results::
+
+    with collect_metrics() as metrics:
+        data = data_slice.get()
+    return data, metrics.to_dict()
+
+Collectors are context-local (``contextvars``): they are inherited by the tasks submitted to thread pools with
+``submit_in_context`` (as done by the range read engine), but not by threads or processes started by other means.
+Recording is skipped when there are no collectors nor callbacks.
+"""
+from __future__ import annotations
+
+import bisect
+import contextvars
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor, Future
+    from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Upper bounds (in seconds) of the latency histogram buckets, the last bucket has no upper bound
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_collectors: contextvars.ContextVar[Tuple[StorageMetrics, ...]] = contextvars.ContextVar("dataplug_storage_metrics",
+                                                                                        default=())
+_callbacks: List[Callable[[RequestRecord], None]] = []
+
+
+@dataclass(frozen=True)
+class RequestRecord:
+    operation: str  # Client method, e.g. "get_object"
+    bucket: Optional[str]
+    key: Optional[str]
+    latency: float  # Seconds until the response (for GETs, until the headers, the body is streamed afterwards)
+    bytes_in: int = 0  # Bytes downloaded
+    bytes_out: int = 0  # Bytes uploaded
+    retries: int = 0  # Retries made by botocore for this request
+    error: Optional[str] = None  # Error code if the request failed
+
+
+@dataclass
+class OperationStats:
+    requests: int = 0
+    errors: int = 0
+    retries: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    latency_sum: float = 0.0
+    latency_max: float = 0.0
+    latency_histogram: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    def add(self, record: RequestRecord):
+        self.requests += 1
+        self.errors += record.error is not None
+        self.retries += record.retries
+        self.bytes_in += record.bytes_in
+        self.bytes_out += record.bytes_out
+        self.latency_sum += record.latency
+        self.latency_max = max(self.latency_max, record.latency)
+        self.latency_histogram[bisect.bisect_left(LATENCY_BUCKETS, record.latency)] += 1
+
+    def merge(self, other: OperationStats):
+        self.requests += other.requests
+        self.errors += other.errors
+        self.retries += other.retries
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.latency_sum += other.latency_sum
+        self.latency_max = max(self.latency_max, other.latency_max)
+        self.latency_histogram = [a + b for a, b in zip(self.latency_histogram, other.latency_histogram)]
+
+    @property
+    def latency_mean(self) -> float:
+        return self.latency_sum / self.requests if self.requests else 0.0
+
+
+class StorageMetrics:
+    """
+    Thread-safe collector of storage request stats, aggregated by operation and by object (``bucket/key``).
+    Collectors can be pickled, merged and converted to plain dictionaries.
+    """
+
+    def __init__(self):
+        self.operations: Dict[str, OperationStats] = {}
+        self.objects: Dict[str, OperationStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, record: RequestRecord):
+        with self._lock:
+            self.operations.setdefault(record.operation, OperationStats()).add(record)
+            if record.key is not None:
+                self.objects.setdefault(f"{record.bucket}/{record.key}", OperationStats()).add(record)
+
+    def merge(self, other: StorageMetrics) -> StorageMetrics:
+        """
+        Add the stats of another collector (e.g. returned by a worker) to this one
+        """
+        with self._lock:
+            for name, stats in other.operations.items():
+                self.operations.setdefault(name, OperationStats()).merge(stats)
+            for name, stats in other.objects.items():
+                self.objects.setdefault(name, OperationStats()).merge(stats)
+        return self
+
+    def for_object(self, bucket: str, key: str) -> OperationStats:
+        return self.objects.get(f"{bucket}/{key}", OperationStats())
+
+    @property
+    def requests(self) -> int:
+        return sum(stats.requests for stats in self.operations.values())
+
+    @property
+    def bytes_in(self) -> int:
+        return sum(stats.bytes_in for stats in self.operations.values())
+
+    @property
+    def bytes_out(self) -> int:
+        return sum(stats.bytes_out for stats in self.operations.values())
+
+    @property
+    def retries(self) -> int:
+        return sum(stats.retries for stats in self.operations.values())
+
+    def to_dict(self) -> dict:
+        return {
+            "operations": {name: asdict(stats) for name, stats in self.operations.items()},
+            "objects": {name: asdict(stats) for name, stats in self.objects.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> StorageMetrics:
+        metrics = cls()
+        metrics.operations = {name: OperationStats(**stats) for name, stats in data.get("operations", {}).items()}
+        metrics.objects = {name: OperationStats(**stats) for name, stats in data.get("objects", {}).items()}
+        return metrics
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.merge(StorageMetrics.from_dict(state))
+
+    def __repr__(self):
+        return f"StorageMetrics(requests={self.requests}, bytes_in={self.bytes_in}, bytes_out={self.bytes_out}, " \
+               f"retries={self.retries})"
+
+
+@contextmanager
+def collect_metrics(metrics: Optional[StorageMetrics] = None) -> Iterator[StorageMetrics]:
+    """
+    Record the storage requests made in this context into ``metrics`` (a new collector if None).
+    Contexts can be nested, requests are recorded in all the active collectors.
+    """
+    metrics = metrics if metrics is not None else StorageMetrics()
+    token = _collectors.set(_collectors.get() + (metrics,))
+    try:
+        yield metrics
+    finally:
+        _collectors.reset(token)
+
+
+def add_callback(callback: Callable[[RequestRecord], None]):
+    """
+    Call ``callback`` with the ``RequestRecord`` of every storage request of this process, e.g. to export them to a
+    monitoring system. Callbacks are called from the thread that made the request and must be thread-safe.
+    """
+    _callbacks.append(callback)
+
+
+def remove_callback(callback: Callable[[RequestRecord], None]):
+    _callbacks.remove(callback)
+
+
+def submit_in_context(pool: Executor, fn: Callable[..., Any], *args) -> Future:
+    """
+    Submit ``fn(*args)`` to ``pool``, to run in a copy of the caller's context. Requests made by ``fn`` are
+    recorded in the metrics collectors of the caller, and its spans are children of the caller's span.
+    """
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def map_in_context(pool: Executor, fn: Callable[..., Any], *iterables: Iterable) -> List[Any]:
+    """
+    Like ``pool.map``, with every call submitted by ``submit_in_context``. Returns the list of results.
+    """
+    futures = [submit_in_context(pool, fn, *args) for args in zip(*iterables)]
+    return [future.result() for future in futures]
+
+
+def is_enabled() -> bool:
+    return bool(_callbacks) or bool(_collectors.get())
+
+
+def record_request(record: RequestRecord):
+    for metrics in _collectors.get():
+        metrics.record(record)
+    for callback in list(_callbacks):
+        callback(record)
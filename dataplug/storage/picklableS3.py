@@ -2,14 +2,21 @@ from __future__ import annotations
 
 import json
 import logging
+import os
+import threading
 import time
 import uuid
 from contextlib import suppress
+from datetime import datetime, timedelta, timezone
 from pathlib import _PosixFlavour, PurePath
 from typing import TYPE_CHECKING
 
 import boto3
+import botocore
 import botocore.client
+import botocore.exceptions
+
+from . import metrics
 
 if TYPE_CHECKING:
     from typing import Optional
@@ -17,6 +24,9 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MAX_POOL_CONNECTIONS = 64  # botocore default is 10, too few for parallel range reads
+CREDENTIALS_REFRESH_MARGIN = 300  # Refresh temporary credentials 5 minutes before they expire
+
 S3_FULL_ACCESS_POLICY = json.dumps(
     {
         "Id": "BucketPolicy",
@@ -34,6 +44,153 @@ S3_FULL_ACCESS_POLICY = json.dumps(
 )
 
 
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+_sts_credentials = {}
+_sts_lock = threading.Lock()
+
+
+def get_s3_client(credentials: Optional[dict], endpoint_url: Optional[str], region_name: Optional[str],
+                  botocore_config_kwargs: dict):
+    """
+    Get the S3 client of this process for the given credentials, endpoint and configuration, creating it if needed.
+    Clients are thread-safe, sharing them also shares their connection pool. Without credentials, the client
+    sends unsigned requests.
+    """
+    global _clients_pid
+    key = (
+        credentials["AccessKeyId"] if credentials else None,
+        credentials["SecretAccessKey"] if credentials else None,
+        credentials.get("SessionToken") if credentials else None,
+        endpoint_url,
+        region_name,
+        json.dumps(botocore_config_kwargs, sort_keys=True, default=str),
+    )
+    with _clients_lock:
+        # Connections can not be shared with forked processes
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(key)
+        if client is None:
+            logger.debug("Creating S3 client for endpoint %s", endpoint_url)
+            config = botocore.client.Config(**botocore_config_kwargs)
+            if credentials is None:
+                config = config.merge(botocore.client.Config(signature_version=botocore.UNSIGNED))
+            # Sessions are not thread-safe, use a new one for every client
+            session = boto3.session.Session()
+            client = session.client(
+                "s3",
+                aws_access_key_id=credentials["AccessKeyId"] if credentials else None,
+                aws_secret_access_key=credentials["SecretAccessKey"] if credentials else None,
+                aws_session_token=credentials.get("SessionToken") if credentials else None,
+                endpoint_url=endpoint_url,
+                region_name=region_name,
+                config=config,
+            )
+            _clients[key] = client
+        return client
+
+
+def _expires_soon(credentials: dict) -> bool:
+    expiration = credentials.get("Expiration")
+    if expiration is None:
+        return False
+    if isinstance(expiration, str):
+        expiration = datetime.fromisoformat(expiration)
+    return expiration - datetime.now(timezone.utc) < timedelta(seconds=CREDENTIALS_REFRESH_MARGIN)
+
+
+def _get_local_credentials() -> dict:
+    """
+    Credentials of the default boto3 credential chain (environment variables, AWS configuration file, ...)
+    """
+    local_credentials = boto3.session.Session().get_credentials()
+    if local_credentials is None:
+        raise ValueError("No AWS credentials found, provide credentials or use an anonymous client")
+    frozen = local_credentials.get_frozen_credentials()
+    credentials = {"AccessKeyId": frozen.access_key, "SecretAccessKey": frozen.secret_key}
+    if frozen.token:
+        credentials["SessionToken"] = frozen.token
+    return credentials
+
+
+def _get_sts_credentials(endpoint_url: Optional[str], region_name: Optional[str], role_arn: Optional[str],
+                         token_duration_seconds: int, botocore_config_kwargs: dict) -> tuple[dict, Optional[str]]:
+    """
+    Request temporary credentials with STS, returns the credentials and the role session name.
+    Credentials are cached per process until they are about to expire.
+    """
+    key = (endpoint_url, region_name, role_arn, token_duration_seconds)
+    with _sts_lock:
+        cached = _sts_credentials.get(key)
+        if cached is not None and not _expires_soon(cached[0]):
+            return cached
+
+        logger.debug("Requesting temporary credentials for S3 authentication")
+        sts_admin = boto3.session.Session().client(
+            "sts",
+            region_name=region_name,
+            endpoint_url=endpoint_url,
+            config=botocore.client.Config(**botocore_config_kwargs),
+        )
+
+        session_name = None
+        if role_arn is not None:
+            session_name = "-".join(
+                ["dataplug", str(int(time.time())), uuid.uuid4().hex]
+            )
+            logger.debug(
+                "Assuming role %s with generated session name %s",
+                role_arn,
+                session_name,
+            )
+
+            response = sts_admin.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName=session_name,
+                Policy=S3_FULL_ACCESS_POLICY,
+                DurationSeconds=token_duration_seconds,
+            )
+        else:
+            logger.debug("Getting session token")
+            response = sts_admin.get_session_token(
+                DurationSeconds=token_duration_seconds
+            )
+
+        _sts_credentials[key] = (response["Credentials"], session_name)
+        return _sts_credentials[key]
+
+
+# Positional parameters of the managed transfer methods of boto3 S3 clients
+_TRANSFER_PARAMETERS = {
+    "download_file": ("Bucket", "Key", "Filename"),
+    "download_fileobj": ("Bucket", "Key", "Fileobj"),
+    "upload_file": ("Filename", "Bucket", "Key"),
+    "upload_fileobj": ("Fileobj", "Bucket", "Key"),
+}
+
+
+def _body_size(body) -> int:
+    """
+    Size of a request body (bytes or a seekable file-like object), 0 if unknown
+    """
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    with suppress(TypeError):
+        return len(body)
+    with suppress(AttributeError, OSError, ValueError):
+        position = body.tell()
+        size = body.seek(0, os.SEEK_END) - position
+        body.seek(position)
+        return size
+    return 0
+
+
 class PickleableS3ClientProxy:
     """
     A Pickleable S3 client proxy that can be pickled and unpickled.
@@ -43,8 +200,14 @@ class PickleableS3ClientProxy:
     For it, we request temporary credentials to S3 using STS. To request temporary credentials, we
     authenticate using the locally configured credentials (through the environment variables or the
     AWS configuration file) and assume a role with full access to S3. The temporary credentials are
-    saved in the instance and used to create an S3 client, and to create a new client when the object
-    is unpickled.
+    saved in the instance and used to get an S3 client, also when the object is unpickled. S3 clients
+    are shared by all the proxies of a process with the same credentials, endpoint and configuration.
+
+    Temporary credentials are requested on the first call that needs them (a request, or pickling the proxy),
+    cached per process and refreshed before they expire. Credentials given to the proxy are never replaced, a
+    warning is logged when they are about to expire. STS can be skipped with ``use_sts=False``, to use the
+    locally configured credentials directly, or with ``anonymous=True``, to send unsigned requests (e.g. to local
+    S3-compatible services that do not check credentials).
     """
 
     def __init__(
@@ -55,21 +218,21 @@ class PickleableS3ClientProxy:
             role_arn: Optional[str] = None,
             token_duration_seconds: Optional[int] = None,
             botocore_config_kwargs: Optional[dict] = None,
+            max_pool_connections: Optional[int] = None,
+            use_sts: bool = True,
+            anonymous: bool = False,
     ):
         self.region_name = region_name
         self.endpoint_url = endpoint_url
-        self.botocore_config_kwargs = botocore_config_kwargs or {}
+        self.botocore_config_kwargs = dict(botocore_config_kwargs or {})
+        if max_pool_connections is not None:
+            self.botocore_config_kwargs["max_pool_connections"] = max_pool_connections
+        self.botocore_config_kwargs.setdefault("max_pool_connections", DEFAULT_MAX_POOL_CONNECTIONS)
         self.role_arn = role_arn
         self.session_name = None
         self.token_duration_seconds = token_duration_seconds or 86400  # 24 hours
-
-        logger.debug("Requesting temporary credentials for S3 authentication")
-        sts_admin = boto3.client(
-            "sts",
-            region_name=region_name,
-            endpoint_url=endpoint_url,
-            config=botocore.client.Config(**self.botocore_config_kwargs),
-        )
+        self.use_sts = use_sts
+        self.anonymous = anonymous
 
         if credentials:
             # check if credentials are valid
@@ -79,193 +242,214 @@ class PickleableS3ClientProxy:
                 raise ValueError(
                     "Invalid credentials. AccessKeyId and SecretAccessKey are required if credentials are provided."
                 )
-            self.credentials = credentials
+        self._credentials = credentials
+        self._owns_credentials = False  # Whether the credentials were obtained by the proxy, which refreshes them
+        self._expiration_warned = False
+        self._client_instance = None
+        self._client_credentials = None
+        self._client_pid = None
 
-        elif role_arn is not None:
-            self.session_name = "-".join(
-                ["dataplug", str(int(time.time())), uuid.uuid4().hex]
-            )
-            logger.debug(
-                "Assuming role %s with generated session name %s",
-                self.role_arn,
-                self.session_name,
-            )
+    @property
+    def credentials(self) -> Optional[dict]:
+        """
+        Credentials used to sign requests, None for anonymous requests. Temporary credentials are requested
+        (or refreshed if they are about to expire) on access.
+        """
+        if self.anonymous:
+            return None
+        if self._credentials is not None and not self._owns_credentials:
+            if not self._expiration_warned and _expires_soon(self._credentials):
+                logger.warning("The credentials given to the S3 client expire at %s and can not be refreshed",
+                               self._credentials["Expiration"])
+                self._expiration_warned = True
+            return self._credentials
+        if self._credentials is None or _expires_soon(self._credentials):
+            if not self.use_sts and self.role_arn is None:
+                self._credentials = _get_local_credentials()
+            else:
+                self._credentials, self.session_name = _get_sts_credentials(
+                    self.endpoint_url, self.region_name, self.role_arn, self.token_duration_seconds,
+                    self.botocore_config_kwargs
+                )
+            self._owns_credentials = True
+        return self._credentials
 
-            response = sts_admin.assume_role(
-                RoleArn=self.role_arn,
-                RoleSessionName=self.session_name,
-                Policy=S3_FULL_ACCESS_POLICY,
-                DurationSeconds=self.token_duration_seconds,
-            )
-            self.credentials = response["Credentials"]
+    @credentials.setter
+    def credentials(self, credentials: Optional[dict]):
+        self._credentials = credentials
+        self._owns_credentials = False
+        self._expiration_warned = False
 
-        else:
-            logger.debug("Getting session token")
-            response = sts_admin.get_session_token(
-                DurationSeconds=self.token_duration_seconds
-            )
-            self.credentials = response["Credentials"]
-
-        self.__client = boto3.client(
-            "s3",
-            aws_access_key_id=self.credentials["AccessKeyId"],
-            aws_secret_access_key=self.credentials["SecretAccessKey"],
-            aws_session_token=self.credentials.get("SessionToken"),
-            endpoint_url=self.endpoint_url,
-            region_name=self.region_name,
-            config=botocore.client.Config(**self.botocore_config_kwargs),
-        )
-
-    def _new_client(self):
-        session = boto3.Session(
-            aws_access_key_id=self.credentials["AccessKeyId"],
-            aws_secret_access_key=self.credentials["SecretAccessKey"],
-            aws_session_token=self.credentials.get("SessionToken"),
-            region_name=self.region_name,
-        )
-        return session.client(
-            "s3",
-            endpoint_url=self.endpoint_url,
-            config=botocore.client.Config(**self.botocore_config_kwargs),
-        )
+    @property
+    def _client(self):
+        credentials = self.credentials
+        # The proxy can be copied to a forked process, whose registry creates its own client
+        if (self._client_instance is None or credentials is not self._client_credentials
+                or self._client_pid != os.getpid()):
+            self._client_instance = get_s3_client(credentials, self.endpoint_url, self.region_name,
+                                                  self.botocore_config_kwargs)
+            self._client_credentials = credentials
+            self._client_pid = os.getpid()
+        return self._client_instance
 
     def __getstate__(self):
         logger.debug("Pickling S3 client")
         return {
             "credentials": self.credentials,
+            "owns_credentials": self._owns_credentials,
             "endpoint_url": self.endpoint_url,
             "region_name": self.region_name,
             "botocore_config_kwargs": self.botocore_config_kwargs,
             "role_arn": self.role_arn,
             "session_name": self.session_name,
             "token_duration_seconds": self.token_duration_seconds,
+            "use_sts": self.use_sts,
+            "anonymous": self.anonymous,
         }
 
     def __setstate__(self, state):
         logger.debug("Restoring S3 client")
-        self.credentials = state["credentials"]
+        self._credentials = state["credentials"]
+        self._owns_credentials = state.get("owns_credentials", False)
+        self._expiration_warned = False
         self.endpoint_url = state["endpoint_url"]
         self.region_name = state["region_name"]
         self.botocore_config_kwargs = state["botocore_config_kwargs"]
         self.role_arn = state["role_arn"]
         self.session_name = state["session_name"]
         self.token_duration_seconds = state["token_duration_seconds"]
+        self.use_sts = state.get("use_sts", True)
+        self.anonymous = state.get("anonymous", False)
+        self._client_instance = None
+        self._client_credentials = None
+        self._client_pid = None
 
-        self.__client = boto3.client(
-            "s3",
-            aws_access_key_id=self.credentials["AccessKeyId"],
-            aws_secret_access_key=self.credentials["SecretAccessKey"],
-            aws_session_token=self.credentials.get("SessionToken"),
-            endpoint_url=self.endpoint_url,
-            region_name=self.region_name,
-            config=botocore.client.Config(**self.botocore_config_kwargs),
-        )
-
-    def abort_multipart_upload(self, *args, **kwargs):
-        response = self.__client.abort_multipart_upload(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
+    def _request(self, operation: str, **kwargs):
+        """
+        Make a request with the client, recording it in the active metrics collectors (see ``metrics``)
+        """
+        if not metrics.is_enabled():
+            response = getattr(self._client, operation)(**kwargs)
+            logger.debug("%s", response.get("ResponseMetadata", {}))
+            return response
+
+        bytes_out = _body_size(kwargs.get("Body"))
+        t0 = time.perf_counter()
+        try:
+            response = getattr(self._client, operation)(**kwargs)
+        except botocore.exceptions.ClientError as error:
+            metadata = error.response.get("ResponseMetadata", {})
+            metrics.record_request(metrics.RequestRecord(
+                operation, kwargs.get("Bucket"), kwargs.get("Key"), time.perf_counter() - t0,
+                retries=metadata.get("RetryAttempts", 0),
+                error=error.response.get("Error", {}).get("Code") or str(metadata.get("HTTPStatusCode")),
+            ))
+            raise
+        latency = time.perf_counter() - t0
+        metadata = response.get("ResponseMetadata", {})
+        logger.debug("%s", metadata)
+        metrics.record_request(metrics.RequestRecord(
+            operation, kwargs.get("Bucket"), kwargs.get("Key"), latency,
+            # The body of GET responses is streamed, its length is accounted as transferred with the response
+            bytes_in=response.get("ContentLength", 0) if operation == "get_object" else 0,
+            bytes_out=bytes_out,
+            retries=metadata.get("RetryAttempts", 0),
+        ))
         return response
 
-    def complete_multipart_upload(self, *args, **kwargs):
-        response = self.__client.complete_multipart_upload(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def _transfer(self, operation: str, *args, **kwargs):
+        """
+        Run a managed transfer (upload_file, download_fileobj, ...), which is recorded as a single request of the
+        whole transfer: requests made by the transfer manager are not recorded individually
+        """
+        if not metrics.is_enabled():
+            getattr(self._client, operation)(*args, **kwargs)
+            logger.debug("%s", {"HTTP-Status": "200"})
+            return
+
+        params = dict(zip(_TRANSFER_PARAMETERS[operation], args), **kwargs)
+        size = _body_size(params.get("Fileobj")) if operation == "upload_fileobj" else 0
+        t0 = time.perf_counter()
+        getattr(self._client, operation)(*args, **kwargs)
+        logger.debug("%s", {"HTTP-Status": "200"})
+        if "Filename" in params:
+            with suppress(OSError):
+                size = os.path.getsize(params["Filename"])
+        metrics.record_request(metrics.RequestRecord(
+            operation, params.get("Bucket"), params.get("Key"), time.perf_counter() - t0,
+            bytes_in=size if operation.startswith("download") else 0,
+            bytes_out=size if operation.startswith("upload") else 0,
+        ))
 
-    def create_multipart_upload(self, *args, **kwargs):
-        response = self.__client.create_multipart_upload(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def abort_multipart_upload(self, **kwargs):
+        return self._request("abort_multipart_upload", **kwargs)
+
+    def complete_multipart_upload(self, **kwargs):
+        return self._request("complete_multipart_upload", **kwargs)
+
+    def create_multipart_upload(self, **kwargs):
+        return self._request("create_multipart_upload", **kwargs)
 
     def download_file(self, *args, **kwargs):
-        self.__client.download_file(*args, **kwargs)
-        logger.debug("%s", {"HTTP-Status": "200"})
+        self._transfer("download_file", *args, **kwargs)
 
     def download_fileobj(self, *args, **kwargs):
-        self.__client.download_fileobj(*args, **kwargs)
-        logger.debug("%s", {"HTTP-Status": "200"})
+        self._transfer("download_fileobj", *args, **kwargs)
 
     def generate_presigned_post(self, *args, **kwargs):
-        response = self.__client.generate_presigned_post(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
+        response = self._client.generate_presigned_post(*args, **kwargs)
+        logger.debug("%s", response)
         return response
 
     def generate_presigned_url(self, *args, **kwargs):
-        response = self.__client.generate_presigned_url(*args, **kwargs)
+        response = self._client.generate_presigned_url(*args, **kwargs)
         logger.debug("%s", response)
         return response
 
-    def get_object(self, *args, **kwargs):
-        response = self.__client.get_object(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def get_object(self, **kwargs):
+        return self._request("get_object", **kwargs)
 
-    def delete_object(self, *args, **kwargs) -> DeleteObjectOutputTypeDef:
-        response = self.__client.delete_object(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def delete_object(self, **kwargs) -> DeleteObjectOutputTypeDef:
+        return self._request("delete_object", **kwargs)
 
-    def delete_objects(self, *args, **kwargs) -> DeleteObjectsOutputTypeDef:
-        response = self.__client.delete_objects(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def delete_objects(self, **kwargs) -> DeleteObjectsOutputTypeDef:
+        return self._request("delete_objects", **kwargs)
 
-    def head_bucket(self, *args, **kwargs):
-        response = self.__client.head_bucket(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def head_bucket(self, **kwargs):
+        return self._request("head_bucket", **kwargs)
 
-    def head_object(self, *args, **kwargs):
-        response = self.__client.head_object(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def head_object(self, **kwargs):
+        return self._request("head_object", **kwargs)
 
     def list_buckets(self):
-        response = self.__client.list_buckets()
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+        return self._request("list_buckets")
 
-    def list_multipart_uploads(self, *args, **kwargs):
-        response = self.__client.list_multipart_uploads(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def list_multipart_uploads(self, **kwargs):
+        return self._request("list_multipart_uploads", **kwargs)
 
-    def list_objects(self, *args, **kwargs):
-        response = self.__client.list_objects(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def list_objects(self, **kwargs):
+        return self._request("list_objects", **kwargs)
 
-    def list_objects_v2(self, *args, **kwargs):
-        response = self.__client.list_objects_v2(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def list_objects_v2(self, **kwargs):
+        return self._request("list_objects_v2", **kwargs)
 
-    def list_parts(self, *args, **kwargs):
-        response = self.__client.list_parts(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def list_parts(self, **kwargs):
+        return self._request("list_parts", **kwargs)
 
-    def put_object(self, *args, **kwargs):
-        response = self.__client.put_object(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def put_object(self, **kwargs):
+        return self._request("put_object", **kwargs)
 
     def upload_file(self, *args, **kwargs):
-        self.__client.upload_file(*args, **kwargs)
-        logger.debug("%s", {"HTTP-Status": "200"})
+        self._transfer("upload_file", *args, **kwargs)
 
     def upload_fileobj(self, *args, **kwargs):
-        self.__client.upload_fileobj(*args, **kwargs)
-        logger.debug("%s", {"HTTP-Status": "200"})
+        self._transfer("upload_fileobj", *args, **kwargs)
 
-    def upload_part(self, *args, **kwargs):
-        response = self.__client.upload_part(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def upload_part(self, **kwargs):
+        return self._request("upload_part", **kwargs)
 
-    def create_bucket(self, *args, **kwargs):
-        response = self.__client.create_bucket(*args, **kwargs)
-        logger.debug("%s", response.get("ResponseMetadata", {}))
-        return response
+    def create_bucket(self, **kwargs):
+        return self._request("create_bucket", **kwargs)
 
 
 class _S3Flavour(_PosixFlavour):
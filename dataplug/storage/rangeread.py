@@ -0,0 +1,285 @@
+"""
+Shared engine for reading byte ranges of objects.
+
+Ranges are split in parts of at most ``part_size`` bytes that are fetched in parallel from a process-wide thread pool
+and written directly into a single preallocated buffer. Parts that fail with a transient error are retried.
+Nearby ranges are coalesced into a single request and scattered into their destination buffers.
+Ranges are half-open: ``(start, end)`` reads bytes ``start`` to ``end - 1``.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import botocore.exceptions
+
+from .metrics import submit_in_context
+
+if TYPE_CHECKING:
+    from typing import List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024  # 8 MiB
+DEFAULT_MAX_GAP = 1024 * 1024  # 1 MiB, read in about the latency of one extra request
+DEFAULT_MAX_WORKERS = 32
+DEFAULT_MAX_ATTEMPTS = 4
+RETRY_BACKOFF = 0.1  # seconds, doubled after each failed attempt
+READ_SIZE = 1048576
+
+RETRYABLE_ERROR_CODES = {"SlowDown", "Throttling", "ThrottlingException", "RequestTimeout", "InternalError"}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+_max_workers = DEFAULT_MAX_WORKERS
+
+
+def set_max_workers(max_workers: int):
+    """
+    Set the number of threads of the process-wide pool used to fetch parts. Parts already submitted to the current
+    pool are completed before it is shut down.
+    """
+    global _executor, _max_workers
+    with _executor_lock:
+        _max_workers = max_workers
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Threads are not inherited by forked processes, each process needs its own pool
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix="dataplug-range")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, botocore.exceptions.ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        code = error.response.get("Error", {}).get("Code")
+        return status >= 500 or code in RETRYABLE_ERROR_CODES
+    return isinstance(error, (botocore.exceptions.BotoCoreError, OSError))
+
+
+def _fetch_part(storage, bucket: str, key: str, start: int, end: int, dest: memoryview, max_attempts: int):
+    for attempt in range(1, max_attempts + 1):
+        try:
+            res = storage.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+            body = res["Body"]
+            try:
+                received = 0
+                if hasattr(body, "readinto"):
+                    # Bodies that support it (e.g. local storage) are read in place, without intermediate copies
+                    while received < len(dest):
+                        n = body.readinto(dest[received:])
+                        if not n:
+                            break
+                        received += n
+                while received < len(dest):
+                    data = body.read(min(READ_SIZE, len(dest) - received))
+                    if not data:
+                        break
+                    dest[received:received + len(data)] = data
+                    received += len(data)
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+            if received != len(dest):
+                raise IOError(f"Got {received} bytes for range {start}-{end - 1} of {bucket}/{key}, "
+                              f"expected {len(dest)}")
+            return
+        except Exception as error:
+            if attempt == max_attempts or not _is_retryable(error):
+                raise
+            logger.debug("Attempt %d to read range %d-%d of %s/%s failed: %s", attempt, start, end - 1, bucket, key,
+                         error)
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+def _fetch_parts(storage, requests: Sequence[Tuple[str, str, int, int, memoryview]], part_size: int,
+                 max_attempts: int):
+    """
+    Fetch (bucket, key, start, end, destination) requests, split in parts of at most part_size bytes
+    """
+    parts = []
+    for bucket, key, start, end, dest in requests:
+        for part_start in range(start, end, part_size):
+            part_end = min(part_start + part_size, end)
+            parts.append((bucket, key, part_start, part_end, dest[part_start - start:part_end - start]))
+    if not parts:
+        return
+
+    def _fetch(part):
+        _fetch_part(storage, *part, max_attempts)
+
+    # The first part is fetched by the calling thread, pool threads never wait for other parts.
+    executor = get_executor()
+    futures = [submit_in_context(executor, _fetch, part) for part in parts[1:]]
+    try:
+        _fetch(parts[0])
+        for future in futures:
+            future.result()
+    except BaseException:
+        # Parts that have not started are cancelled, and the caller returns once the running ones, which write
+        # into its buffers, are done. The error of the first failed part is raised.
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise
+
+
+@dataclass
+class RangePlan:
+    requests: List[Tuple[int, int]]  # Merged (start, end) ranges to fetch, sorted
+    pieces: List[Tuple[int, int, int]]  # (request index, offset in request, length) for each of the planned ranges
+
+
+def plan_ranges(ranges: Sequence[Tuple[int, int]], max_gap: int = DEFAULT_MAX_GAP) -> RangePlan:
+    """
+    Merge byte ranges separated by at most max_gap bytes (or overlapping) into fewer, larger requests.
+    Every request costs a round trip of tens of milliseconds on object storage, so reading a small gap between
+    two ranges is usually cheaper than issuing a request for each.
+    """
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+    requests: List[Tuple[int, int]] = []
+    pieces: List[Optional[Tuple[int, int, int]]] = [None] * len(ranges)
+
+    for i in order:
+        start, end = ranges[i]
+        if requests and start - requests[-1][1] <= max_gap:
+            request_start, request_end = requests[-1]
+            requests[-1] = (request_start, max(request_end, end))
+        else:
+            requests.append((start, end))
+        pieces[i] = (len(requests) - 1, start - requests[-1][0], end - start)
+
+    return RangePlan(requests=requests, pieces=pieces)
+
+
+def read_ranges_into(
+        storage,
+        bucket: str,
+        key: str,
+        ranges: Sequence[Tuple[int, int]],
+        buffers: Sequence[Union[bytearray, memoryview]],
+        part_size: int = DEFAULT_PART_SIZE,
+        max_gap: int = DEFAULT_MAX_GAP,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+):
+    """
+    Read byte ranges of an object, each into its own destination buffer. Nearby ranges are coalesced into a single
+    request (see ``plan_ranges``) and scattered into their buffers.
+    :param storage: S3 client (or compatible storage) used for the GET requests
+    :param ranges: List of half-open (start, end) byte ranges
+    :param buffers: Destination buffer for each range, of at least the size of the range
+    :param part_size: Maximum size of a single GET request, larger requests are fetched in parallel parts
+    :param max_gap: Maximum number of unrequested bytes between two ranges to fetch them in the same request
+    :param max_attempts: Maximum number of attempts to fetch each part
+    """
+    plan = plan_ranges(ranges, max_gap)
+    views = [memoryview(buffer) for buffer in buffers]
+    for (start, end), view in zip(ranges, views):
+        if len(view) < end - start:
+            raise ValueError(f"Buffer of {len(view)} bytes is smaller than range {start}-{end - 1}")
+
+    # Requests made of a single range are read directly into the destination buffer
+    request_pieces = [[] for _ in plan.requests]
+    for i, (request_idx, _, _) in enumerate(plan.pieces):
+        request_pieces[request_idx].append(i)
+
+    requests = []
+    scratch = {}
+    for request_idx, (start, end) in enumerate(plan.requests):
+        pieces = request_pieces[request_idx]
+        if len(pieces) == 1 and plan.pieces[pieces[0]][2] == end - start:
+            dest = views[pieces[0]][:end - start]
+        else:
+            dest = scratch[request_idx] = memoryview(bytearray(end - start))
+        requests.append((bucket, key, start, end, dest))
+
+    _fetch_parts(storage, requests, part_size, max_attempts)
+
+    for request_idx, dest in scratch.items():
+        for i in request_pieces[request_idx]:
+            _, offset, length = plan.pieces[i]
+            views[i][:length] = dest[offset:offset + length]
+
+
+def read_ranges(
+        storage,
+        bucket: str,
+        key: str,
+        ranges: Sequence[Tuple[int, int]],
+        out: Optional[Union[bytearray, memoryview]] = None,
+        part_size: int = DEFAULT_PART_SIZE,
+        max_gap: int = DEFAULT_MAX_GAP,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> Union[bytearray, memoryview]:
+    """
+    Read byte ranges of an object into a buffer, where they are placed one after the other in the given order.
+    See ``read_ranges_into`` for the parameters.
+    :param out: Preallocated buffer of at least the total size of the ranges, a new bytearray is created if None
+    :return: The buffer with the data of the ranges
+    """
+    total_size = sum(end - start for start, end in ranges)
+    if out is None:
+        out = bytearray(total_size)
+    elif len(out) < total_size:
+        raise ValueError(f"Buffer of {len(out)} bytes is smaller than the {total_size} bytes of the ranges")
+
+    view = memoryview(out)
+    buffers = []
+    offset = 0
+    for start, end in ranges:
+        buffers.append(view[offset:offset + end - start])
+        offset += end - start
+
+    read_ranges_into(storage, bucket, key, ranges, buffers, part_size=part_size, max_gap=max_gap,
+                     max_attempts=max_attempts)
+    return out
+
+
+def read_range(
+        storage,
+        bucket: str,
+        key: str,
+        start: int,
+        end: int,
+        part_size: int = DEFAULT_PART_SIZE,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> bytearray:
+    """
+    Read the half-open byte range [start, end) of an object, see ``read_ranges``
+    """
+    return read_ranges(storage, bucket, key, [(start, end)], part_size=part_size, max_attempts=max_attempts)
+
+
+def read_object_ranges(
+        storage,
+        requests: Sequence[Tuple[str, str, int, int]],
+        part_size: int = DEFAULT_PART_SIZE,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> List[bytearray]:
+    """
+    Read byte ranges of several objects concurrently.
+    :param requests: List of (bucket, key, start, end) requests, with half-open byte ranges
+    :return: The data of each request
+    """
+    buffers = [bytearray(end - start) for _, _, start, end in requests]
+    _fetch_parts(
+        storage,
+        [(bucket, key, start, end, memoryview(buffer)) for (bucket, key, start, end), buffer in zip(requests, buffers)],
+        part_size,
+        max_attempts,
+    )
+    return buffers
@@ -0,0 +1,576 @@
+"""
+Local HTTP stand-in for S3, for benchmarking and testing without an object storage service.
+
+The server implements the subset of the S3 REST API used by Dataplug (objects, ranged reads, listings and multipart
+uploads) with path-style addressing and without authentication, on top of a ``FileSystemS3API`` directory.
+Network conditions of object storage can be emulated by injecting a fixed latency before each response
+and limiting the bandwidth of each response body.
+
+Usage::
+
+    with S3Server(latency=0.02, bandwidth=100 * 1024 ** 2) as server:
+        co = CloudObject.from_s3(CSV, "s3://bucket/file.csv", s3_config=server.storage_config())
+        ...
+        print(server.stats)
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import botocore.exceptions
+
+from .filesystem import FileSystemS3API
+
+if TYPE_CHECKING:
+    from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+S3_XMLNS = "http://s3.amazonaws.com/doc/2006-03-01/"
+WRITE_SIZE = 65536
+
+# HTTP status of the error codes raised by FileSystemS3API
+ERROR_STATUS = {
+    "404": 404,
+    "NoSuchKey": 404,
+    "NoSuchBucket": 404,
+    "NoSuchUpload": 404,
+    "InvalidRange": 416,
+    "InvalidPart": 400,
+    "InvalidPartOrder": 400,
+}
+
+
+def _iso_date(dt) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _http_date(dt) -> str:
+    return formatdate(dt.timestamp(), usegmt=True)
+
+
+def _xml(root: str, *elements: str, namespace: bool = True) -> bytes:
+    xmlns = f' xmlns="{S3_XMLNS}"' if namespace else ""
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n<{root}{xmlns}>' + "".join(elements) + f"</{root}>").encode("utf-8")
+
+
+def _element(tag: str, value) -> str:
+    if isinstance(value, bool):
+        value = "true" if value else "false"
+    return f"<{tag}>{escape(str(value))}</{tag}>"
+
+
+def _find_all(root: ElementTree.Element, tag: str):
+    # Elements may come with or without the S3 namespace
+    return root.findall(tag) + root.findall(f"{{{S3_XMLNS}}}{tag}")
+
+
+def _find_text(element: ElementTree.Element, tag: str) -> Optional[str]:
+    found = _find_all(element, tag)
+    return found[0].text if found else None
+
+
+class _RequestBody:
+    """
+    Readable request body, decoding chunked transfer encoding and the aws-chunked content encoding of boto3
+    streaming uploads
+    """
+
+    def __init__(self, handler: BaseHTTPRequestHandler):
+        self._rfile = handler.rfile
+        self._chunked = handler.headers.get("Transfer-Encoding", "").lower() == "chunked"
+        self._aws_chunked = "aws-chunked" in handler.headers.get("Content-Encoding", "")
+        self._remaining = int(handler.headers.get("Content-Length", 0))
+        self._chunk_remaining = 0
+        self._aws_chunk = b""
+        self._done = False
+
+    def _read_raw(self, size: int) -> bytes:
+        if self._chunked:
+            data = bytearray()
+            while len(data) < size and not self._done:
+                if self._chunk_remaining == 0:
+                    line = self._rfile.readline()
+                    self._chunk_remaining = int(line.split(b";")[0].strip() or b"0", 16)
+                    if self._chunk_remaining == 0:
+                        # Skip trailers up to the empty line
+                        while self._rfile.readline() not in (b"\r\n", b"\n", b""):
+                            pass
+                        self._done = True
+                        break
+                piece = self._rfile.read(min(size - len(data), self._chunk_remaining))
+                data += piece
+                self._chunk_remaining -= len(piece)
+                if self._chunk_remaining == 0:
+                    self._rfile.readline()
+            return bytes(data)
+        size = min(size, self._remaining)
+        data = self._rfile.read(size) if size > 0 else b""
+        self._remaining -= len(data)
+        return data
+
+    def _readline_raw(self) -> bytes:
+        line = bytearray()
+        while not line.endswith(b"\r\n"):
+            c = self._read_raw(1)
+            if not c:
+                break
+            line += c
+        return bytes(line)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = 1 << 62
+        if not self._aws_chunked:
+            return self._read_raw(size)
+        data = bytearray()
+        while len(data) < size and not self._done:
+            if self._chunk_remaining == 0:
+                header = self._readline_raw()
+                length = int(header.split(b";")[0].strip() or b"0", 16)
+                if length == 0:
+                    # Drain the trailing checksums
+                    while self._read_raw(WRITE_SIZE):
+                        pass
+                    self._done = True
+                    break
+                self._aws_chunk = self._read_raw(length)
+                self._read_raw(2)  # CRLF after the chunk data
+                self._chunk_remaining = length
+            piece = self._aws_chunk[len(self._aws_chunk) - self._chunk_remaining:][:size - len(data)]
+            data += piece
+            self._chunk_remaining -= len(piece)
+        return bytes(data)
+
+    def drain(self):
+        while self.read(WRITE_SIZE):
+            pass
+
+
+class _S3RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: _S3HTTPServer
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    # Request parsing
+
+    def _parse(self) -> Tuple[Optional[str], Optional[str], Dict[str, str]]:
+        url = urlsplit(self.path)
+        parts = unquote(url.path).lstrip("/").split("/", 1)
+        bucket = parts[0] or None
+        key = parts[1] if len(parts) > 1 and parts[1] else None
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        return bucket, key, query
+
+    # Responses
+
+    def _send(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None):
+        self.server.emulate_latency()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body:
+            self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self._write_body(body)
+
+    def _write_body(self, data):
+        view = memoryview(data)
+        for offset in range(0, len(view), WRITE_SIZE):
+            piece = view[offset:offset + WRITE_SIZE]
+            self.server.emulate_bandwidth(len(piece))
+            self.wfile.write(piece)
+            self.server.count_bytes(len(piece))
+
+    def _send_error(self, code: str, status: int, message: str = ""):
+        body = b""
+        if self.command != "HEAD":
+            # Error documents have no namespace
+            body = _xml("Error", _element("Code", code), _element("Message", message or code), namespace=False)
+        self._send(status, body)
+
+    def _handle(self, operation: str, func):
+        self.server.count_request(operation)
+        body = _RequestBody(self)
+        try:
+            func(body)
+        except botocore.exceptions.ClientError as error:
+            code = error.response.get("Error", {}).get("Code", "InternalError")
+            status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or ERROR_STATUS.get(code, 400)
+            body.drain()
+            self._send_error("NoSuchKey" if code == "404" and operation.endswith("Object") else code, status)
+        except ValueError as error:
+            body.drain()
+            self._send_error("InvalidArgument", 400, str(error))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as error:
+            logger.exception("Error handling %s", operation)
+            body.drain()
+            self._send_error("InternalError", 500, str(error))
+
+    # HTTP methods
+
+    def do_HEAD(self):
+        bucket, key, _ = self._parse()
+        if key is None:
+            self._handle("HeadBucket", lambda _: self._head_bucket(bucket))
+        else:
+            self._handle("HeadObject", lambda _: self._head_object(bucket, key))
+
+    def do_GET(self):
+        bucket, key, query = self._parse()
+        if bucket is None:
+            self._handle("ListBuckets", lambda _: self._list_buckets())
+        elif key is None:
+            if query.get("list-type") == "2":
+                self._handle("ListObjectsV2", lambda _: self._list_objects(bucket, query, v2=True))
+            else:
+                self._handle("ListObjects", lambda _: self._list_objects(bucket, query, v2=False))
+        else:
+            self._handle("GetObject", lambda _: self._get_object(bucket, key))
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        if key is None:
+            self._handle("CreateBucket", lambda body: self._create_bucket(bucket, body))
+        elif "uploadId" in query:
+            self._handle("UploadPart", lambda body: self._upload_part(bucket, key, query, body))
+        else:
+            self._handle("PutObject", lambda body: self._put_object(bucket, key, body))
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        if key is None and "delete" in query:
+            self._handle("DeleteObjects", lambda body: self._delete_objects(bucket, body))
+        elif "uploads" in query:
+            self._handle("CreateMultipartUpload", lambda body: self._create_multipart_upload(bucket, key, body))
+        elif "uploadId" in query:
+            self._handle("CompleteMultipartUpload",
+                         lambda body: self._complete_multipart_upload(bucket, key, query, body))
+        else:
+            self._handle("Unknown", lambda body: self._not_implemented(body))
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        if key is None:
+            self._handle("DeleteBucket", lambda body: self._not_implemented(body))
+        elif "uploadId" in query:
+            self._handle("AbortMultipartUpload", lambda _: self._abort_multipart_upload(bucket, key, query))
+        else:
+            self._handle("DeleteObject", lambda _: self._delete_object(bucket, key))
+
+    # Operations
+
+    def _not_implemented(self, body: _RequestBody):
+        body.drain()
+        self._send_error("NotImplemented", 501, "Operation not supported by the S3 stand-in server")
+
+    def _head_bucket(self, bucket: str):
+        self.server.storage.head_bucket(Bucket=bucket)
+        self._send(200)
+
+    def _create_bucket(self, bucket: str, body: _RequestBody):
+        body.drain()
+        self.server.storage.create_bucket(Bucket=bucket)
+        self._send(200, headers={"Location": f"/{bucket}"})
+
+    def _list_buckets(self):
+        res = self.server.storage.list_buckets()
+        buckets = "".join(
+            "<Bucket>" + _element("Name", b["Name"]) + _element("CreationDate", _iso_date(b["CreationDate"]))
+            + "</Bucket>" for b in res["Buckets"]
+        )
+        self._send(200, _xml("ListAllMyBucketsResult", f"<Buckets>{buckets}</Buckets>"))
+
+    def _object_headers(self, res: dict) -> Dict[str, str]:
+        headers = {
+            "ETag": res["ETag"],
+            "Last-Modified": _http_date(res["LastModified"]),
+            "Accept-Ranges": "bytes",
+            "Content-Type": "binary/octet-stream",
+        }
+        if "ContentRange" in res:
+            headers["Content-Range"] = res["ContentRange"]
+        return headers
+
+    def _head_object(self, bucket: str, key: str):
+        res = self.server.storage.head_object(Bucket=bucket, Key=key)
+        self.server.emulate_latency()
+        self.send_response(200)
+        for name, value in self._object_headers(res).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(res["ContentLength"]))
+        self.end_headers()
+
+    def _get_object(self, bucket: str, key: str):
+        kwargs = {"Range": self.headers["Range"]} if self.headers.get("Range") else {}
+        res = self.server.storage.get_object(Bucket=bucket, Key=key, **kwargs)
+        self.server.emulate_latency()
+        self.send_response(res["ResponseMetadata"]["HTTPStatusCode"])
+        for name, value in self._object_headers(res).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(res["ContentLength"]))
+        self.end_headers()
+        body = res["Body"]
+        try:
+            while True:
+                data = body.read(WRITE_SIZE)
+                if not data:
+                    break
+                self._write_body(data)
+        finally:
+            body.close()
+
+    def _put_object(self, bucket: str, key: str, body: _RequestBody):
+        res = self.server.storage.put_object(Bucket=bucket, Key=key, Body=body)
+        self._send(200, headers={"ETag": res["ETag"]})
+
+    def _delete_object(self, bucket: str, key: str):
+        self.server.storage.delete_object(Bucket=bucket, Key=key)
+        self._send(204)
+
+    def _delete_objects(self, bucket: str, body: _RequestBody):
+        request = ElementTree.fromstring(body.read())
+        deleted = []
+        for obj in _find_all(request, "Object"):
+            key = _find_text(obj, "Key")
+            self.server.storage.delete_object(Bucket=bucket, Key=key)
+            deleted.append("<Deleted>" + _element("Key", key) + "</Deleted>")
+        self._send(200, _xml("DeleteResult", *deleted))
+
+    def _list_objects(self, bucket: str, query: Dict[str, str], v2: bool):
+        kwargs = {"Prefix": query.get("prefix", ""), "MaxKeys": int(query.get("max-keys", 1000))}
+        if query.get("delimiter"):
+            kwargs["Delimiter"] = query["delimiter"]
+        if v2:
+            if query.get("continuation-token"):
+                kwargs["ContinuationToken"] = query["continuation-token"]
+            if query.get("start-after"):
+                kwargs["StartAfter"] = query["start-after"]
+            res = self.server.storage.list_objects_v2(Bucket=bucket, **kwargs)
+        else:
+            if query.get("marker"):
+                kwargs["Marker"] = query["marker"]
+            res = self.server.storage.list_objects(Bucket=bucket, **kwargs)
+
+        elements = [
+            _element("Name", bucket),
+            _element("Prefix", res["Prefix"]),
+            _element("MaxKeys", res["MaxKeys"]),
+            _element("IsTruncated", res["IsTruncated"]),
+        ]
+        for name in ("Delimiter", "Marker", "NextMarker", "KeyCount", "ContinuationToken",
+                     "NextContinuationToken", "StartAfter"):
+            if name in res:
+                elements.append(_element(name, res[name]))
+        for obj in res.get("Contents", []):
+            elements.append(
+                "<Contents>" + _element("Key", obj["Key"]) + _element("LastModified", _iso_date(obj["LastModified"]))
+                + _element("ETag", obj["ETag"]) + _element("Size", obj["Size"])
+                + _element("StorageClass", obj["StorageClass"]) + "</Contents>"
+            )
+        for prefix in res.get("CommonPrefixes", []):
+            elements.append("<CommonPrefixes>" + _element("Prefix", prefix["Prefix"]) + "</CommonPrefixes>")
+        self._send(200, _xml("ListBucketResult", *elements))
+
+    def _create_multipart_upload(self, bucket: str, key: str, body: _RequestBody):
+        body.drain()
+        res = self.server.storage.create_multipart_upload(Bucket=bucket, Key=key)
+        self._send(200, _xml("InitiateMultipartUploadResult", _element("Bucket", bucket), _element("Key", key),
+                             _element("UploadId", res["UploadId"])))
+
+    def _upload_part(self, bucket: str, key: str, query: Dict[str, str], body: _RequestBody):
+        res = self.server.storage.upload_part(Bucket=bucket, Key=key, PartNumber=int(query["partNumber"]),
+                                              UploadId=query["uploadId"], Body=body)
+        self._send(200, headers={"ETag": res["ETag"]})
+
+    def _complete_multipart_upload(self, bucket: str, key: str, query: Dict[str, str], body: _RequestBody):
+        request = ElementTree.fromstring(body.read())
+        parts = [{"PartNumber": int(_find_text(part, "PartNumber")), "ETag": _find_text(part, "ETag")}
+                 for part in _find_all(request, "Part")]
+        res = self.server.storage.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=query["uploadId"],
+                                                            MultipartUpload={"Parts": parts})
+        self._send(200, _xml("CompleteMultipartUploadResult", _element("Location", f"/{bucket}/{key}"),
+                             _element("Bucket", bucket), _element("Key", key), _element("ETag", res["ETag"])))
+
+    def _abort_multipart_upload(self, bucket: str, key: str, query: Dict[str, str]):
+        self.server.storage.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=query["uploadId"])
+        self._send(204)
+
+
+class _S3HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, storage: FileSystemS3API, latency: float, jitter: float,
+                 bandwidth: Optional[float]):
+        super().__init__(address, _S3RequestHandler)
+        self.storage = storage
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self._stats_lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients close idle keep-alive connections at any time
+        logger.debug("Connection from %s closed", client_address, exc_info=True)
+
+    def emulate_latency(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def emulate_bandwidth(self, size: int):
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    def count_request(self, operation: str):
+        with self._stats_lock:
+            self.requests[operation] += 1
+
+    def count_bytes(self, size: int):
+        with self._stats_lock:
+            self.bytes_sent += size
+
+
+class S3Server:
+    """
+    S3 stand-in server running in a background thread of the current process.
+
+    :param root: Directory where buckets are stored (see FileSystemS3API), a temporary directory that is removed
+                 when the server stops if None
+    :param host: Address to listen on
+    :param port: Port to listen on, a free port is chosen if 0
+    :param latency: Seconds to wait before sending each response, to emulate the time to first byte of object storage
+    :param jitter: Maximum random delay in seconds added to the latency of each response
+    :param bandwidth: Maximum throughput of each response body in bytes per second, unlimited if None
+    """
+
+    def __init__(
+            self,
+            root: Optional[str] = None,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            bandwidth: Optional[float] = None,
+    ):
+        self._tmp_dir = None
+        if root is None:
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix="dataplug-s3-")
+            root = self._tmp_dir.name
+        self.storage = FileSystemS3API(root)
+        self._server = _S3HTTPServer((host, port), self.storage, latency, jitter, bandwidth)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self) -> dict:
+        """
+        Number of requests served by operation and number of body bytes sent since start (or the last reset)
+        """
+        with self._server._stats_lock:
+            return {"requests": dict(self._server.requests), "total_requests": sum(self._server.requests.values()),
+                    "bytes_sent": self._server.bytes_sent}
+
+    def reset_stats(self):
+        with self._server._stats_lock:
+            self._server.requests.clear()
+            self._server.bytes_sent = 0
+
+    def set_network(self, latency: Optional[float] = None, jitter: Optional[float] = None,
+                    bandwidth: Optional[float] = None):
+        """
+        Change the emulated network conditions of a running server
+        """
+        if latency is not None:
+            self._server.latency = latency
+        if jitter is not None:
+            self._server.jitter = jitter
+        if bandwidth is not None:
+            self._server.bandwidth = bandwidth or None
+
+    def storage_config(self, **kwargs) -> dict:
+        """
+        Storage configuration for CloudObject (``s3_config``) to access this server. Requests are not signed and use
+        path-style addressing. Keyword arguments are added to the configuration.
+        """
+        config = {
+            "endpoint_url": self.endpoint_url,
+            "region_name": "us-east-1",
+            "anonymous": True,
+            "botocore_config_kwargs": {"s3": {"addressing_style": "path"}},
+        }
+        config.update(kwargs)
+        return config
+
+    def start(self) -> S3Server:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, name="dataplug-s3-server",
+                                            daemon=True)
+            self._thread.start()
+            logger.info("S3 stand-in server listening on %s", self.endpoint_url)
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        self.storage.close()
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+
+    def __enter__(self) -> S3Server:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local S3 stand-in server for Dataplug")
+    parser.add_argument("--root", default=".", help="Directory where buckets are stored")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latency of each response in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum random latency added in seconds")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Bandwidth of each response in MiB/s")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    bandwidth = args.bandwidth * 1024 * 1024 if args.bandwidth else None
+    server = S3Server(args.root, args.host, args.port, args.latency, args.jitter, bandwidth)
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
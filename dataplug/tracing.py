@@ -0,0 +1,251 @@
+"""
+Pluggable tracing of slice reads and preprocessing.
+
+``CloudObjectSlice.get`` calls and the preprocessing handlers run in spans of the process-wide tracer, which is a
+no-op by default. Within a span, formats time the phases of their work (e.g. ``download``, ``inflate``, ``parse``)
+with ``current_span().phase(name)`` or ``current_span().iter(name, iterable)``, which accumulate the exclusive time
+of each phase into the ``<phase>.seconds`` attribute of the span, and count bytes with ``span.add``::
+
+    from dataplug import tracing
+
+    tracer = tracing.RecordingTracer()
+    tracing.set_tracer(tracer)
+    data_slice.get()
+    print(tracer.summary())
+
+Use ``OpenTelemetryTracer`` to export spans with OpenTelemetry (requires ``opentelemetry-api``). The tracer is set per
+process: workers in other processes must set it themselves.
+"""
+from __future__ import annotations
+
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+try:
+    from opentelemetry import trace as otel_trace
+except ModuleNotFoundError:
+    otel_trace = None
+
+if TYPE_CHECKING:
+    from typing import Any, ContextManager, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar[Span] = contextvars.ContextVar("dataplug_current_span")
+_END = object()
+
+
+class Span:
+    """
+    Span of the no-op tracer, base class of the spans of other tracers.
+    Phases of a span must be timed from a single thread.
+    """
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add(self, key: str, value: float):
+        """
+        Add ``value`` to a numeric attribute, e.g. a byte count
+        """
+        pass
+
+    def phase(self, name: str) -> ContextManager:
+        """
+        Time a phase of the span, adding its duration to the ``<name>.seconds`` attribute.
+        The time of nested phases is only accounted to the innermost phase.
+        """
+        return nullcontext()
+
+    def iter(self, name: str, iterable: Iterable) -> Iterable:
+        """
+        Time the production of each item of ``iterable`` as phase ``name`` and add the length of the items to the
+        ``<name>.bytes`` attribute
+        """
+        return iterable
+
+
+_NOOP_SPAN = Span()
+
+
+class RecordingSpan(Span):
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None, parent: Optional[RecordingSpan] = None):
+        self.name = name
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.counters: Dict[str, float] = {}  # Accumulated attributes, phase times and byte counts
+        self.parent = parent
+        self.start: float = time.perf_counter()
+        self.end: Optional[float] = None
+        self._phases: List[float] = []  # Time of the nested phases of each active phase
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add(self, key: str, value: float):
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        self._phases.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            nested = self._phases.pop()
+            self.add(f"{name}.seconds", elapsed - nested)
+            if self._phases:
+                self._phases[-1] += elapsed
+
+    def iter(self, name: str, iterable: Iterable) -> Iterator:
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                item = next(iterator, _END)
+            if item is _END:
+                return
+            self.add(f"{name}.bytes", len(item))
+            yield item
+
+
+class Tracer:
+    """
+    No-op tracer, base class of tracers
+    """
+
+    def start_span(self, name: str, attributes: Dict[str, Any]) -> ContextManager[Span]:
+        return nullcontext(_NOOP_SPAN)
+
+
+@dataclass
+class SpanRecord:
+    name: str
+    start: float  # time.perf_counter() at start
+    duration: float
+    attributes: Dict[str, Any]
+    counters: Dict[str, float]
+    parent: Optional[str]
+
+
+class RecordingTracer(Tracer):
+    """
+    Tracer that keeps the finished spans in memory, e.g. for benchmarks. Spans can also be logged at debug level.
+    """
+
+    def __init__(self, log: bool = False):
+        self.log = log
+        self.spans: List[SpanRecord] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def start_span(self, name: str, attributes: Dict[str, Any]) -> Iterator[Span]:
+        parent = _current_span.get(None)
+        span = RecordingSpan(name, attributes, parent)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_attribute("error", repr(e))
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            record = SpanRecord(name, span.start, span.duration, span.attributes, span.counters,
+                                parent.name if isinstance(parent, RecordingSpan) else None)
+            with self._lock:
+                self.spans.append(record)
+            if self.log:
+                logger.debug("%s took %.3f s %s %s", name, record.duration, record.attributes, record.counters)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Number of spans, total duration and sum of the counters (phase times, byte counts), by span name
+        """
+        summary = {}
+        with self._lock:
+            spans = list(self.spans)
+        for record in spans:
+            entry = summary.setdefault(record.name, {"count": 0, "seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += record.duration
+            for key, value in record.counters.items():
+                entry[key] = entry.get(key, 0) + value
+        return summary
+
+
+class _OpenTelemetrySpan(RecordingSpan):
+    def __init__(self, name: str, attributes: Dict[str, Any], otel_span):
+        super().__init__(name, attributes)
+        self.otel_span = otel_span
+
+    def set_attribute(self, key: str, value: Any):
+        super().set_attribute(key, value)
+        self.otel_span.set_attribute(key, value)
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    Tracer that exports spans with OpenTelemetry. Accumulated attributes (phase times, byte counts) are set on the
+    OpenTelemetry span when it ends.
+    """
+
+    def __init__(self, tracer=None):
+        if otel_trace is None:
+            raise ModuleNotFoundError("OpenTelemetry tracing requires opentelemetry-api, "
+                                      "install it with pip install opentelemetry-api")
+        from .version import __version__
+
+        self._tracer = tracer or otel_trace.get_tracer("dataplug", __version__)
+
+    @contextmanager
+    def start_span(self, name: str, attributes: Dict[str, Any]) -> Iterator[Span]:
+        with self._tracer.start_as_current_span(name, attributes=attributes) as otel_span:
+            span = _OpenTelemetrySpan(name, attributes, otel_span)
+            token = _current_span.set(span)
+            try:
+                yield span
+            finally:
+                _current_span.reset(token)
+                otel_span.set_attributes(span.counters)
+
+
+_tracer: Tracer = Tracer()
+
+
+def set_tracer(tracer: Optional[Tracer]):
+    """
+    Set the tracer of this process, None to disable tracing
+    """
+    global _tracer
+    _tracer = tracer if tracer is not None else Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, **attributes) -> ContextManager[Span]:
+    """
+    Start a span with the tracer of this process, as the current span of the context
+    """
+    return _tracer.start_span(name, attributes)
+
+
+def current_span() -> Span:
+    """
+    The innermost active span of the context, a no-op span if there is none
+    """
+    return _current_span.get(_NOOP_SPAN)
@@ -0,0 +1,24 @@
+import random
+
+import pytest
+
+from dataplug.storage.filesystem import FileSystemS3API
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = FileSystemS3API(str(tmp_path))
+    storage.create_bucket(Bucket=BUCKET)
+    yield storage
+    storage.close()
+
+
+def fastq_lines(num_reads, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(num_reads):
+        lines += [f"@read{i}", "".join(rnd.choice("ACGT") for _ in range(rnd.randint(20, 120))), "+",
+                  "".join(rnd.choice("ABCDEFGHIJ") for _ in range(10))]
+    return lines
@@ -0,0 +1,106 @@
+import pickle
+
+import pytest
+
+from dataplug import CloudObject
+from dataplug.cache import index_cache
+from dataplug.cloudobject import FOLDER_HEADERS
+from dataplug.entities import CloudDataFormat
+from dataplug.formats.genomics.fasta import FASTA
+
+from .conftest import BUCKET
+
+
+def _load_index(data):
+    return bytes(data)
+
+
+def test_load_index_caches_the_version_read(storage):
+    storage.create_bucket(Bucket=BUCKET + ".meta")
+    storage.put_object(Bucket=BUCKET, Key="genome.fasta", Body=b">sequence\nACGT\n")
+    storage.put_object(Bucket=BUCKET + ".meta", Key="genome.fasta", Body=b"old index")
+    co = CloudObject.from_s3(FASTA, f"s3://{BUCKET}/genome.fasta", storage=storage)
+    co.fetch()
+    assert co._meta_headers
+
+    # The metadata is replaced after its headers were fetched
+    storage.put_object(Bucket=BUCKET + ".meta", Key="genome.fasta", Body=b"new index, longer")
+    assert co.load_index(_load_index) == b"new index, longer"
+    assert co._meta_headers["ETag"] == storage.head_object(Bucket=BUCKET + ".meta", Key="genome.fasta")["ETag"]
+
+    # Objects with fresh headers are served from the cache
+    hits = index_cache.hits
+    fresh = CloudObject.from_s3(FASTA, f"s3://{BUCKET}/genome.fasta", storage=storage)
+    fresh.fetch()
+    assert fresh.load_index(_load_index) == b"new index, longer"
+    assert index_cache.hits == hits + 1
+
+
+@CloudDataFormat(preprocessing_function=lambda cloud_object: None, is_folder=True)
+class Folder:
+    pass
+
+
+@pytest.fixture
+def open_bodies(storage, monkeypatch):
+    # Bodies of the GET responses that have not been closed
+    open_bodies = []
+    get_object = storage.get_object
+
+    def tracking_get_object(**kwargs):
+        res = get_object(**kwargs)
+        body = res["Body"]
+        open_bodies.append(body)
+        close = body.close
+
+        def tracking_close():
+            if body in open_bodies:
+                open_bodies.remove(body)
+            close()
+
+        body.close = tracking_close
+        return res
+
+    monkeypatch.setattr(storage, "get_object", tracking_get_object)
+    return open_bodies
+
+
+def _put_samples(storage):
+    storage.create_bucket(Bucket=BUCKET + ".meta")
+    for name in ["preprocessed", "raw", "orphan"]:
+        storage.put_object(Bucket=BUCKET, Key=f"{name}.fasta", Body=b">sequence\nACGT\n")
+    storage.put_object(Bucket=BUCKET + ".meta", Key="preprocessed.fasta", Body=b"")
+    storage.put_object(Bucket=BUCKET + ".meta", Key="preprocessed.fasta.attrs", Body=pickle.dumps({"num_sequences": 1}))
+    # Attributes left without metadata, e.g. by an interrupted preprocessing
+    storage.put_object(Bucket=BUCKET + ".meta", Key="orphan.fasta.attrs", Body=pickle.dumps({"num_sequences": 1}))
+
+
+def test_from_s3_many(storage, open_bodies):
+    _put_samples(storage)
+    uris = [f"s3://{BUCKET}/{name}.fasta" for name in ["preprocessed", "missing", "raw", "orphan"]]
+
+    cloud_objects = CloudObject.from_s3_many(FASTA, uris, storage=storage, ignore_missing=True)
+    assert [co.path.key for co in cloud_objects] == ["preprocessed.fasta", "raw.fasta", "orphan.fasta"]
+    preprocessed, raw, orphan = cloud_objects
+    assert preprocessed.size == len(b">sequence\nACGT\n")
+    assert preprocessed.is_preprocessed() and preprocessed["num_sequences"] == 1
+    assert raw._meta_headers is None and raw._attrs is None
+    assert orphan._meta_headers is None and orphan._attrs is None
+    assert open_bodies == []
+
+    with pytest.raises(KeyError, match="missing.fasta"):
+        CloudObject.from_s3_many(FASTA, uris, storage=storage)
+    assert open_bodies == []
+
+    unfetched = CloudObject.from_s3_many(FASTA, uris, storage=storage, fetch=False)
+    assert len(unfetched) == 4 and all(co._obj_headers is None for co in unfetched)
+
+
+def test_fetch_many_folders(storage):
+    storage.create_bucket(Bucket=BUCKET + ".meta")
+    cloud_objects = CloudObject.from_s3_many(Folder, [f"s3://{BUCKET}/folder/", f"s3://{BUCKET}/other/"],
+                                             storage=storage)
+    # Folders are not requested, they have placeholder headers
+    assert len(cloud_objects) == 2
+    assert all(co._obj_headers == FOLDER_HEADERS and co._meta_headers is None for co in cloud_objects)
+    assert CloudObject.fetch_many([]) == []
@@ -0,0 +1,27 @@
+import pytest
+
+from dataplug import CloudDataset
+from dataplug.entities import CloudObjectSlice
+from dataplug.formats.genomics.fasta import FASTA
+
+from .conftest import BUCKET
+
+
+@pytest.mark.parametrize("num_partitions", [1, 3, 8])
+def test_partition_empty_slices(storage, num_partitions):
+    for i in range(4):
+        storage.put_object(Bucket=BUCKET, Key=f"samples/{i}.fasta", Body=f">sequence{i}\nACGT\n".encode())
+    dataset = CloudDataset.from_s3(FASTA, f"s3://{BUCKET}/samples/", storage=storage)
+    dataset.preprocess(parallel_config={"backend": "threading"}, chunk_size=1024)
+
+    created = []
+
+    def empty_slices(cloud_object, num_chunks):
+        slices = [CloudObjectSlice(0, 0) for _ in range(num_chunks)]
+        created.extend(slices)
+        return slices
+
+    partitions = dataset.partition(empty_slices, num_partitions=num_partitions)
+    assert 0 < len(partitions) <= num_partitions
+    assert all(partition.slices for partition in partitions)
+    assert sorted(id(s) for partition in partitions for s in partition.slices) == sorted(map(id, created))
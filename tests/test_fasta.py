@@ -0,0 +1,53 @@
+import re
+
+import numpy as np
+import pytest
+
+from dataplug import CloudObject
+from dataplug.formats.genomics.fasta import FASTA, FASTA_OVERLAP
+
+from .conftest import BUCKET
+
+
+def _fasta(header_length=40):
+    return b"".join(b">sequence%d " % i + b"x" * header_length + b"\n" + b"ACGT" * 50 + b"\n" for i in range(300))
+
+
+def _expected_index(data):
+    return np.array([(m.start(), m.end()) for m in re.finditer(rb">.+(\n)?", data)], dtype=np.uint32).ravel()
+
+
+def _load_index(data):
+    return np.frombuffer(data, dtype=np.uint32).copy()
+
+
+@pytest.mark.parametrize("header_length", [40, FASTA_OVERLAP + 100])
+def test_headers_cut_by_chunks_are_indexed_once(storage, monkeypatch, header_length):
+    data = _fasta(header_length)
+    storage.put_object(Bucket=BUCKET, Key="genome.fasta", Body=data)
+    co = CloudObject.from_s3(FASTA, f"s3://{BUCKET}/genome.fasta", storage=storage)
+
+    # The first chunk ends in the middle of the identifier line of the 11th sequence
+    header_start = data.index(b">sequence10 ")
+    chunk_size = header_start + 5
+    ranges = []
+    get_object = storage.get_object
+
+    def recording_get_object(**kwargs):
+        if kwargs["Key"] == "genome.fasta" and "Range" in kwargs:
+            ranges.append(kwargs["Range"])
+        return get_object(**kwargs)
+
+    monkeypatch.setattr(storage, "get_object", recording_get_object)
+    co.preprocess(parallel_config={"backend": "threading"}, chunk_size=chunk_size)
+
+    assert np.array_equal(co.load_index(_load_index), _expected_index(data))
+    assert co["num_sequences"] == 300
+
+    # Chunks are read with the overlap, clamped to the size of the object
+    reads = sorted(tuple(map(int, r[len("bytes="):].split("-"))) for r in ranges)
+    num_chunks = -(-len(data) // chunk_size)
+    assert {
+        (i * chunk_size, min((i + 1) * chunk_size + FASTA_OVERLAP, len(data)) - 1) for i in range(num_chunks)
+    } <= set(reads)
+    assert all(end < len(data) for _, end in reads)
@@ -0,0 +1,94 @@
+import os
+
+import botocore.exceptions
+import pytest
+
+from dataplug.storage.filesystem import MAX_OPEN_MAPS, FileSystemS3API
+
+from .conftest import BUCKET
+
+
+def _open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="Requires /proc to count file descriptors")
+def test_memory_maps_are_bounded(storage):
+    for i in range(MAX_OPEN_MAPS * 3):
+        storage.put_object(Bucket=BUCKET, Key=f"objects/{i}", Body=f"object {i}".encode())
+
+    fds = _open_fds()
+    for i in range(MAX_OPEN_MAPS * 3):
+        res = storage.get_object(Bucket=BUCKET, Key=f"objects/{i}", Range="bytes=0-5")
+        assert res["Body"].read() == b"object"
+    assert _open_fds() <= fds + MAX_OPEN_MAPS
+
+    del res  # The map of the last object is in use while its body is alive
+    storage.close()
+    assert _open_fds() <= fds
+    # The storage can still be used after closing it
+    assert storage.get_object(Bucket=BUCKET, Key="objects/0")["Body"].read() == b"object 0"
+
+
+def test_map_in_use_is_not_closed(storage):
+    storage.put_object(Bucket=BUCKET, Key="a", Body=b"0123456789")
+    body = storage.get_object(Bucket=BUCKET, Key="a", Range="bytes=2-")["Body"]
+    storage.close()
+    storage.put_object(Bucket=BUCKET, Key="a", Body=b"replaced")
+    assert body.read() == b"23456789"
+
+
+def test_etags_match_across_requests(storage):
+    put_etag = storage.put_object(Bucket=BUCKET, Key="object", Body=b"version 1")["ETag"]
+    assert storage.head_object(Bucket=BUCKET, Key="object")["ETag"] == put_etag
+    assert storage.get_object(Bucket=BUCKET, Key="object")["ETag"] == put_etag
+    assert storage.list_objects_v2(Bucket=BUCKET)["Contents"][0]["ETag"] == put_etag
+
+    upload_id = storage.create_multipart_upload(Bucket=BUCKET, Key="object")["UploadId"]
+    part_etag = storage.upload_part(Bucket=BUCKET, Key="object", PartNumber=1, UploadId=upload_id,
+                                    Body=b"version 2")["ETag"]
+    etag = storage.complete_multipart_upload(
+        Bucket=BUCKET, Key="object", UploadId=upload_id,
+        MultipartUpload={"Parts": [{"PartNumber": 1, "ETag": part_etag}]},
+    )["ETag"]
+    assert etag != put_etag
+    assert storage.head_object(Bucket=BUCKET, Key="object")["ETag"] == etag
+
+
+def test_delete_missing_object(storage):
+    storage.put_object(Bucket=BUCKET, Key="object", Body=b"data")
+    for _ in range(2):
+        res = storage.delete_object(Bucket=BUCKET, Key="object")
+        assert res["ResponseMetadata"]["HTTPStatusCode"] == 204
+    assert storage.list_objects_v2(Bucket=BUCKET)["KeyCount"] == 0
+
+    res = storage.delete_objects(Bucket=BUCKET, Delete={"Objects": [{"Key": "object"}, {"Key": "missing"}]})
+    assert [obj["Key"] for obj in res["Deleted"]] == ["object", "missing"]
+
+    with pytest.raises(botocore.exceptions.ClientError, match="NoSuchBucket"):
+        storage.delete_object(Bucket="missing-bucket", Key="object")
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 10)),
+    ("bytes=10-99", (10, 100)),
+    ("bytes=90-200", (90, 100)),  # Clipped to the object size
+    ("bytes=40-", (40, 100)),
+    ("bytes=-10", (90, 100)),
+    ("bytes=-200", (0, 100)),
+    (" bytes=5-5 ", (5, 6)),
+    ("bytes=9-5", None),  # Invalid ranges are ignored, the whole object is read
+    ("bytes=0-1,5-9", None),
+    ("bytes=-", None),
+    ("items=0-9", None),
+])
+def test_parse_range(header, expected):
+    assert FileSystemS3API._parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=-0"])
+def test_parse_unsatisfiable_range(header):
+    with pytest.raises(botocore.exceptions.ClientError) as error:
+        FileSystemS3API._parse_range(header, 100)
+    assert error.value.response["Error"]["Code"] == "InvalidRange"
+    assert error.value.response["ResponseMetadata"]["HTTPStatusCode"] == 416
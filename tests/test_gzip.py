@@ -0,0 +1,69 @@
+import gzip
+
+import pytest
+
+from dataplug import CloudObject, tracing
+from dataplug.formats.compressed.gzipped import GZipText, _load_gzip_index, partition_num_chunks
+
+from .conftest import BUCKET, fastq_lines
+
+SPACING = 100_000
+
+
+RAW = ("\n".join(fastq_lines(20_000)) + "\n").encode()
+ARCHIVES = {
+    "single": gzip.compress(RAW),
+    "multi": b"".join(gzip.compress(RAW[i:i + 100_000]) for i in range(0, len(RAW), 100_000)),
+}
+
+
+def _check_index(index):
+    # Access points are sorted, within the archive, and their line numbers match the uncompressed data
+    assert index["uncompressed_byte"].is_monotonic_increasing
+    assert index["uncompressed_byte"].iloc[-1] < len(RAW)
+    for uncompressed_byte, line_number in zip(index["uncompressed_byte"], index["line_number"]):
+        assert RAW.count(b"\n", 0, uncompressed_byte) + 1 == line_number
+
+
+@pytest.mark.parametrize("variant", ["single", "multi"])
+@pytest.mark.parametrize("num_chunks", [3, 7])
+def test_mapreduce_index_matches_monolithic(storage, variant, num_chunks):
+    data = ARCHIVES[variant]
+    storage.put_object(Bucket=BUCKET, Key="reads.fastq.gz", Body=data)
+    co = CloudObject.from_s3(GZipText, f"s3://{BUCKET}/reads.fastq.gz", storage=storage)
+
+    co.preprocess(extra_args={"spacing": SPACING}, force=True)
+    monolithic_lines = co["total_lines"]
+    monolithic_index = co.load_index(_load_gzip_index)
+    _check_index(monolithic_index)
+
+    chunk_size = -(-len(data) // num_chunks)
+    co.preprocess(parallel_config={"backend": "threading"}, extra_args={"spacing": SPACING},
+                  chunk_size=chunk_size, force=True)
+    mapreduce_index = co.load_index(_load_gzip_index)
+    _check_index(mapreduce_index)
+
+    assert co["total_lines"] == monolithic_lines == 80_000
+    # Chunks add at most one access point each, where their decoding starts
+    assert len(mapreduce_index) <= len(monolithic_index) + num_chunks
+
+
+def test_slice_reads_are_traced(storage):
+    storage.put_object(Bucket=BUCKET, Key="reads.fastq.gz", Body=ARCHIVES["single"])
+    co = CloudObject.from_s3(GZipText, f"s3://{BUCKET}/reads.fastq.gz", storage=storage)
+    co.preprocess(extra_args={"spacing": SPACING})
+    data_slice = co.partition(partition_num_chunks, n_chunks=4)[1]
+
+    tracer = tracing.RecordingTracer()
+    tracing.set_tracer(tracer)
+    try:
+        lines = data_slice.get()
+        assert list(data_slice.iter_lines()) == lines
+        assert b"".join(data_slice.iter_chunks()) == data_slice.get_bytes() == ("\n".join(lines) + "\n").encode()
+    finally:
+        tracing.set_tracer(None)
+
+    summary = tracer.summary()
+    for name in ["slice.get", "slice.iter_lines", "slice.iter_chunks", "slice.get_bytes"]:
+        assert summary[name]["count"] == 1
+        assert summary[name]["download.bytes"] > 0
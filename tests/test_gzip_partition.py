@@ -0,0 +1,30 @@
+import gzip
+
+import pytest
+
+from dataplug import CloudObject
+from dataplug.formats.compressed.gzipped import GZipText, partition_num_chunks
+
+from .conftest import BUCKET, fastq_lines
+
+LINES = fastq_lines(20_000)
+
+
+@pytest.fixture
+def fastq_gz(storage):
+    storage.put_object(Bucket=BUCKET, Key="reads.fastq.gz", Body=gzip.compress(("\n".join(LINES) + "\n").encode()))
+    return CloudObject.from_s3(GZipText, f"s3://{BUCKET}/reads.fastq.gz", storage=storage)
+
+
+@pytest.mark.parametrize("spacing, n_chunks", [(None, 2), (300_000, 8), (100_000, 4), (100_000, 40)])
+def test_partition_num_chunks_is_balanced(fastq_gz, spacing, n_chunks):
+    fastq_gz.preprocess(extra_args={"spacing": spacing} if spacing else None, force=True)
+    slices = fastq_gz.partition(partition_num_chunks, n_chunks, line_alignment=4)
+
+    assert 1 <= len(slices) <= n_chunks
+    lines = [s.get() for s in slices]
+    assert [line for part in lines for line in part] == LINES
+    # Partitions start at a record, and no partition is reduced to the records that precede an access point
+    assert all(s.line_0 % 4 == 1 for s in slices)
+    if len(slices) > 1:
+        assert min(len(part) for part in lines) > len(LINES) / (4 * n_chunks)
@@ -0,0 +1,90 @@
+import pytest
+
+from dataplug import CloudObject
+from dataplug.formats.genomics.fasta import FASTA, preprocess_fasta
+from dataplug.preprocessing.manifest import (
+    JobManifest,
+    list_job_keys,
+    load_manifest,
+    manifest_key,
+    restore_checkpoint,
+    save_manifest,
+)
+
+from .conftest import BUCKET
+
+META_BUCKET = BUCKET + ".meta"
+NUM_CHUNKS = 4
+
+
+@pytest.fixture
+def cloud_object(storage):
+    storage.create_bucket(Bucket=META_BUCKET)
+    storage.put_object(Bucket=BUCKET, Key="genome.fasta", Body=b">sequence\nACGT\n" * 100)
+    co = CloudObject.from_s3(FASTA, f"s3://{BUCKET}/genome.fasta", storage=storage)
+    co.fetch()
+    return co
+
+
+def _manifest(cloud_object, chunk_size=400, extra_args=None):
+    return JobManifest.for_job(cloud_object, preprocess_fasta, chunk_size, NUM_CHUNKS, extra_args or {})
+
+
+def _stage(cloud_object, *suffixes):
+    for suffix in suffixes:
+        cloud_object.storage.put_object(Bucket=META_BUCKET, Key=f"genome.fasta.{suffix}", Body=b"partial")
+
+
+def _staged(cloud_object):
+    keys, has_manifest = list_job_keys(cloud_object)
+    return sorted(key[len("genome.fasta."):] for key in keys), has_manifest
+
+
+def test_manifest_json_round_trip(cloud_object):
+    manifest = _manifest(cloud_object)
+    manifest.completed = {0: "genome.fasta.chunk000", 3: "genome.fasta.chunk003"}
+    assert JobManifest.from_json(manifest.to_json()) == manifest
+    assert manifest.object_etag == cloud_object._obj_headers["ETag"]
+
+
+def test_restore_same_job(cloud_object):
+    save_manifest(cloud_object, _manifest(cloud_object))
+    _stage(cloud_object, "chunk000", "chunk002", "chunk004", "chunk000.level1", "unrelated")
+
+    manifest = restore_checkpoint(cloud_object, _manifest(cloud_object))
+    assert manifest.completed == {0: "genome.fasta.chunk000", 2: "genome.fasta.chunk002"}
+    # Combined results and chunks out of the plan are deleted, other keys are not partial results
+    assert _staged(cloud_object) == (["chunk000", "chunk002"], True)
+    assert cloud_object.storage.head_object(Bucket=META_BUCKET, Key="genome.fasta.unrelated")
+    assert load_manifest(cloud_object).completed == manifest.completed
+
+
+@pytest.mark.parametrize("other_job", [{"chunk_size": 200}, {"extra_args": {"spacing": 1}}])
+def test_restore_other_job(cloud_object, other_job):
+    save_manifest(cloud_object, _manifest(cloud_object, **other_job))
+    _stage(cloud_object, "chunk000", "chunk001")
+
+    manifest = restore_checkpoint(cloud_object, _manifest(cloud_object))
+    assert manifest.completed == {}
+    assert _staged(cloud_object) == ([], True)
+    assert load_manifest(cloud_object) == manifest
+
+
+def test_restore_without_manifest_or_resume(cloud_object):
+    _stage(cloud_object, "chunk000")
+    assert restore_checkpoint(cloud_object, _manifest(cloud_object), save=False).completed == {}
+    assert _staged(cloud_object) == ([], False)
+
+    save_manifest(cloud_object, _manifest(cloud_object))
+    _stage(cloud_object, "chunk000")
+    assert restore_checkpoint(cloud_object, _manifest(cloud_object), resume=False, save=False).completed == {}
+    # Unstaged runs do not keep the manifest of a job with no completed chunks
+    assert _staged(cloud_object) == ([], False)
+
+
+def test_invalid_manifest_is_ignored(cloud_object):
+    cloud_object.storage.put_object(Bucket=META_BUCKET, Key=manifest_key(cloud_object), Body=b"{not json")
+    _stage(cloud_object, "chunk000")
+    assert load_manifest(cloud_object) is None
+    assert restore_checkpoint(cloud_object, _manifest(cloud_object)).completed == {}
+    assert _staged(cloud_object) == ([], True)
@@ -0,0 +1,94 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import botocore.exceptions
+import pytest
+
+from dataplug.storage import metrics, rangeread
+from dataplug.storage.metrics import StorageMetrics, collect_metrics, map_in_context
+from dataplug.storage.picklableS3 import PickleableS3ClientProxy
+
+from .conftest import BUCKET
+
+DATA = bytes(range(256)) * 400
+
+
+@pytest.fixture
+def proxy(storage):
+    # Requests of the proxy are made to the local storage instead of an S3 client
+    proxy = PickleableS3ClientProxy(anonymous=True)
+    proxy._client_instance = storage
+    proxy._client_pid = os.getpid()
+    storage.put_object(Bucket=BUCKET, Key="data", Body=DATA)
+    return proxy
+
+
+def test_collectors_nest(proxy):
+    with collect_metrics() as outer:
+        proxy.head_object(Bucket=BUCKET, Key="data")
+        with collect_metrics() as inner:
+            proxy.get_object(Bucket=BUCKET, Key="data")["Body"].read()
+        proxy.head_object(Bucket=BUCKET, Key="data")
+    proxy.head_object(Bucket=BUCKET, Key="data")
+
+    assert outer.requests == 3
+    assert outer.operations["head_object"].requests == 2
+    assert inner.requests == 1
+    assert inner.bytes_in == outer.bytes_in == len(DATA)
+    assert not metrics.is_enabled()
+
+
+def test_request_stats(proxy):
+    records = []
+    metrics.add_callback(records.append)
+    try:
+        with collect_metrics() as collector:
+            proxy.put_object(Bucket=BUCKET, Key="object", Body=b"x" * 1000)
+            proxy.get_object(Bucket=BUCKET, Key="data", Range="bytes=100-199")["Body"].read()
+            with pytest.raises(botocore.exceptions.ClientError):
+                proxy.head_object(Bucket=BUCKET, Key="missing")
+    finally:
+        metrics.remove_callback(records.append)
+
+    put = collector.operations["put_object"]
+    assert (put.requests, put.bytes_out, put.bytes_in, put.errors) == (1, 1000, 0, 0)
+    get = collector.operations["get_object"]
+    assert (get.requests, get.bytes_in, get.bytes_out, get.errors) == (1, 100, 0, 0)
+    head = collector.operations["head_object"]
+    assert (head.requests, head.errors) == (1, 1)
+    assert collector.for_object(BUCKET, "missing").errors == 1
+    assert collector.for_object(BUCKET, "data").bytes_in == 100
+    assert [record.operation for record in records] == ["put_object", "get_object", "head_object"]
+    assert records[-1].error in ("404", "NoSuchKey")
+
+
+def test_pickle_round_trip(proxy):
+    with collect_metrics() as collector:
+        proxy.get_object(Bucket=BUCKET, Key="data")["Body"].read()
+        proxy.put_object(Bucket=BUCKET, Key="object", Body=b"x" * 10)
+
+    restored = pickle.loads(pickle.dumps(collector))
+    assert restored.to_dict() == collector.to_dict()
+    assert StorageMetrics().merge(restored).merge(collector).bytes_in == 2 * len(DATA)
+
+
+def test_collectors_are_inherited_by_range_read_threads(proxy):
+    part_size = len(DATA) // 8
+    with collect_metrics() as collector:
+        data = rangeread.read_range(proxy, BUCKET, "data", 0, len(DATA), part_size=part_size)
+    assert data == DATA
+    assert collector.operations["get_object"].requests == 8
+    assert collector.bytes_in == len(DATA)
+
+
+def test_collectors_are_inherited_by_pool_tasks(proxy):
+    def head(key):
+        return proxy.head_object(Bucket=BUCKET, Key=key)["ContentLength"]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        with collect_metrics() as collector:
+            assert map_in_context(pool, head, ["data"] * 8) == [len(DATA)] * 8
+        # Tasks submitted outside of the collector scope are not recorded
+        map_in_context(pool, head, ["data"])
+    assert collector.operations["head_object"].requests == 8
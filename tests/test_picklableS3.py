@@ -0,0 +1,85 @@
+import logging
+import os
+import pickle
+from datetime import datetime, timedelta, timezone
+
+import botocore
+
+from dataplug.storage import picklableS3
+from dataplug.storage.picklableS3 import PickleableS3ClientProxy
+
+
+def _temporary_credentials(name, expires_in):
+    return {"AccessKeyId": name, "SecretAccessKey": "secret", "SessionToken": "token",
+            "Expiration": datetime.now(timezone.utc) + timedelta(seconds=expires_in)}
+
+
+def _fake_sts(monkeypatch, expires_in):
+    requested = []
+
+    def get_sts_credentials(*args):
+        requested.append(args)
+        return _temporary_credentials(f"sts{len(requested)}", expires_in), "session"
+
+    monkeypatch.setattr(picklableS3, "_get_sts_credentials", get_sts_credentials)
+    return requested
+
+
+def test_given_credentials_are_not_replaced(monkeypatch, caplog):
+    requested = _fake_sts(monkeypatch, 3600)
+    credentials = _temporary_credentials("user", 60)
+    proxy = PickleableS3ClientProxy(credentials=credentials)
+
+    with caplog.at_level(logging.WARNING, logger=picklableS3.__name__):
+        assert proxy.credentials is credentials
+        assert proxy.credentials is credentials
+    assert requested == []
+    assert len([r for r in caplog.records if "can not be refreshed" in r.getMessage()]) == 1
+
+    restored = pickle.loads(pickle.dumps(proxy))
+    assert restored.credentials["AccessKeyId"] == "user"
+    assert requested == []
+
+
+def test_sts_credentials_are_refreshed(monkeypatch):
+    requested = _fake_sts(monkeypatch, 60)
+    proxy = PickleableS3ClientProxy()
+    assert proxy.credentials["AccessKeyId"] == "sts1"
+    assert proxy.credentials["AccessKeyId"] == "sts2"
+
+    # Workers refresh the credentials requested by the proxy they were sent
+    restored = pickle.loads(pickle.dumps(proxy))
+    assert restored.credentials["AccessKeyId"] == "sts4"
+    assert len(requested) == 4
+
+
+def test_anonymous_requests_are_unsigned(monkeypatch):
+    requested = _fake_sts(monkeypatch, 3600)
+    proxy = PickleableS3ClientProxy(anonymous=True, endpoint_url="http://localhost:9000")
+    assert proxy.credentials is None
+    assert proxy._client.meta.config.signature_version is botocore.UNSIGNED
+
+    restored = pickle.loads(pickle.dumps(proxy))
+    assert restored.credentials is None
+    assert restored._client.meta.config.signature_version is botocore.UNSIGNED
+    assert requested == []
+
+
+def test_clients_are_shared(monkeypatch):
+    credentials = _temporary_credentials("user", 3600)
+    first = PickleableS3ClientProxy(credentials=credentials, endpoint_url="http://localhost:9000")
+    second = PickleableS3ClientProxy(credentials=dict(credentials), endpoint_url="http://localhost:9000")
+    assert first._client is second._client
+    assert pickle.loads(pickle.dumps(first))._client is first._client
+
+    other_credentials = PickleableS3ClientProxy(credentials=_temporary_credentials("other", 3600),
+                                                endpoint_url="http://localhost:9000")
+    other_endpoint = PickleableS3ClientProxy(credentials=credentials, endpoint_url="http://localhost:9001")
+    clients = {id(first._client), id(other_credentials._client), id(other_endpoint._client)}
+    assert len(clients) == 3
+
+    # A forked process creates its own clients, also for the proxies it inherited
+    client = first._client
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    assert first._client is not client
+    assert first._client is second._client
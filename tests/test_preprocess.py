@@ -0,0 +1,51 @@
+import functools
+from math import ceil
+
+import pytest
+
+from dataplug import CloudObject
+from dataplug.formats.genomics.fasta import FASTA
+from dataplug.preprocessing.preprocess import MIN_CHUNK_SIZE, adaptive_chunk_size
+
+from .conftest import BUCKET
+
+DATA = b"".join(f">sequence{i}\n".encode() + b"ACGT" * 40 + b"\n" for i in range(2000))
+
+
+@pytest.mark.parametrize("chunk_size", [10_000, 65_536, len(DATA) - 1, len(DATA)])
+def test_last_chunk_holds_the_remainder(storage, monkeypatch, chunk_size):
+    storage.put_object(Bucket=BUCKET, Key="genome.fasta", Body=DATA)
+    co = CloudObject.from_s3(FASTA, f"s3://{BUCKET}/genome.fasta", storage=storage)
+
+    chunk_ranges = []
+    preprocessing_function = FASTA.preprocessing_function
+
+    @functools.wraps(preprocessing_function)
+    def recording_preprocessing_function(*args, **kwargs):
+        chunk_ranges.append(kwargs["chunk_range"])
+        return preprocessing_function(*args, **kwargs)
+
+    monkeypatch.setattr(FASTA, "preprocessing_function", recording_preprocessing_function)
+    co.preprocess(parallel_config={"backend": "threading"}, chunk_size=chunk_size)
+
+    chunk_ranges.sort()
+    assert len(chunk_ranges) == ceil(len(DATA) / chunk_size)
+    assert chunk_ranges[0][0] == 0
+    assert all(end == start for (_, end), (start, _) in zip(chunk_ranges, chunk_ranges[1:]))
+    assert chunk_ranges[-1][1] == len(DATA)
+    assert co["num_sequences"] == 2000
+
+
+def test_adaptive_chunk_size():
+    parallel_config = {"backend": "threading", "n_jobs": 4}
+    assert adaptive_chunk_size(100 * MIN_CHUNK_SIZE, parallel_config, 5) == 5 * MIN_CHUNK_SIZE
+    assert adaptive_chunk_size(100 * MIN_CHUNK_SIZE + 1, parallel_config, 5) == 5 * MIN_CHUNK_SIZE + 1
+    for total_size in [0, 1, MIN_CHUNK_SIZE, 3 * MIN_CHUNK_SIZE]:
+        assert adaptive_chunk_size(total_size, parallel_config, 4) == MIN_CHUNK_SIZE
+
+
+def test_empty_object_is_not_chunked(storage):
+    storage.put_object(Bucket=BUCKET, Key="empty.fasta", Body=b"")
+    co = CloudObject.from_s3(FASTA, f"s3://{BUCKET}/empty.fasta", storage=storage)
+    with pytest.raises(AssertionError, match="Empty objects can not be preprocessed in chunks"):
+        co.preprocess(parallel_config={"backend": "threading"}, chunks_per_worker=4)
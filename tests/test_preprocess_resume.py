@@ -0,0 +1,72 @@
+import functools
+import random
+
+import numpy as np
+import pytest
+
+from dataplug import CloudObject
+from dataplug.formats.genomics.fasta import FASTA
+
+from .conftest import BUCKET
+
+CHUNK_SIZE = 16 * 1024
+
+
+def _fasta(num_sequences, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(num_sequences):
+        lines.append(f">sequence{i}")
+        sequence = "".join(rnd.choice("ACGT") for _ in range(rnd.randint(100, 2000)))
+        lines += [sequence[j:j + 80] for j in range(0, len(sequence), 80)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def _load_index(data):
+    return np.frombuffer(data, dtype=np.uint32).copy()
+
+
+def _meta_keys(storage):
+    res = storage.list_objects_v2(Bucket=BUCKET + ".meta")
+    return sorted(obj["Key"] for obj in res.get("Contents", []))
+
+
+@pytest.mark.parametrize("failing", ["combiner_function", "finalizer_function"])
+def test_resume_after_reduce_failure(storage, monkeypatch, failing):
+    storage.put_object(Bucket=BUCKET, Key="genome.fasta", Body=_fasta(200))
+    co = CloudObject.from_s3(FASTA, f"s3://{BUCKET}/genome.fasta", storage=storage)
+    kwargs = {"parallel_config": {"backend": "threading", "n_jobs": 2}, "chunk_size": CHUNK_SIZE,
+              "stage_partials": True, "reduce_fanout": 2, "force": True}
+
+    co.preprocess(**kwargs)
+    expected = co.load_index(_load_index)
+    assert _meta_keys(storage) == ["genome.fasta", "genome.fasta.attrs"]
+
+    mapped = []
+    preprocessing_function = FASTA.preprocessing_function
+
+    @functools.wraps(preprocessing_function)
+    def counting_preprocessing_function(*args, **kwargs):
+        mapped.append(kwargs["chunk_id"])
+        return preprocessing_function(*args, **kwargs)
+
+    def failing_function(*args, **kwargs):
+        raise RuntimeError("evicted")
+
+    monkeypatch.setattr(FASTA, "preprocessing_function", counting_preprocessing_function)
+    with monkeypatch.context() as m:
+        m.setattr(FASTA, failing, failing_function)
+        with pytest.raises(RuntimeError):
+            co.preprocess(**kwargs)
+    num_chunks = len(mapped)
+    assert num_chunks > 4
+    # Partial results of the map jobs are kept after a failure of the reduction
+    chunk_keys = [key for key in _meta_keys(storage) if key.startswith("genome.fasta.chunk") and "level" not in key]
+    assert len(chunk_keys) == num_chunks
+    assert "genome.fasta.manifest" in _meta_keys(storage)
+
+    mapped.clear()
+    co.preprocess(**kwargs)
+    assert mapped == []
+    assert np.array_equal(co.load_index(_load_index), expected)
+    assert _meta_keys(storage) == ["genome.fasta", "genome.fasta.attrs"]
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import botocore.exceptions
+import pytest
+
+from dataplug.storage import rangeread
+
+from .conftest import BUCKET
+
+DATA = bytes(range(256)) * 1024
+
+
+class FailingStorage:
+    """
+    Storage that fails the GET requests of some ranges with a non-retryable error
+    """
+
+    def __init__(self, storage, failing_starts, delay=0.0):
+        self.storage = storage
+        self.failing_starts = failing_starts
+        self.delay = delay
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, Range):
+        start = int(Range[len("bytes="):].split("-")[0])
+        with self.lock:
+            self.active += 1
+        try:
+            time.sleep(self.delay)
+            if start in self.failing_starts:
+                raise botocore.exceptions.ClientError(
+                    {"Error": {"Code": "AccessDenied", "Message": f"range {start}"}}, "GetObject")
+            return self.storage.get_object(Bucket=Bucket, Key=Key, Range=Range)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def data_storage(storage):
+    storage.put_object(Bucket=BUCKET, Key="data", Body=DATA)
+    return storage
+
+
+def test_read_range(data_storage):
+    assert rangeread.read_range(data_storage, BUCKET, "data", 1000, 200_000, part_size=16_384) == DATA[1000:200_000]
+
+
+def test_error_of_first_part_is_raised(data_storage):
+    part_size = len(DATA) // 16
+    storage = FailingStorage(data_storage, {0, part_size * 8}, delay=0.01)
+    with pytest.raises(botocore.exceptions.ClientError, match="range 0"):
+        rangeread.read_range(storage, BUCKET, "data", 0, len(DATA), part_size=part_size)
+    # Running parts are done when the error is raised, and they do not write into the buffer afterwards
+    assert storage.active == 0
+
+
+def test_error_of_other_part_is_raised(data_storage):
+    part_size = len(DATA) // 16
+    storage = FailingStorage(data_storage, {part_size * 3})
+    with pytest.raises(botocore.exceptions.ClientError, match=f"range {part_size * 3}"):
+        rangeread.read_range(storage, BUCKET, "data", 0, len(DATA), part_size=part_size)
+    assert storage.active == 0
+
+
+def test_plan_ranges_coalesces_nearby_ranges():
+    plan = rangeread.plan_ranges([(300, 400), (0, 100), (150, 200), (1000, 1100)], max_gap=100)
+    assert plan.requests == [(0, 400), (1000, 1100)]
+    # Pieces are in the order of the ranges
+    assert plan.pieces == [(0, 300, 100), (0, 0, 100), (0, 150, 50), (1, 0, 100)]
+
+
+def test_plan_ranges_overlapping_and_distant_ranges():
+    plan = rangeread.plan_ranges([(0, 100), (50, 80), (90, 150), (250, 300)], max_gap=50)
+    assert plan.requests == [(0, 150), (250, 300)]
+    assert plan.pieces == [(0, 0, 100), (0, 50, 30), (0, 90, 60), (1, 0, 50)]
+
+    plan = rangeread.plan_ranges([(0, 100), (101, 200)], max_gap=0)
+    assert plan.requests == [(0, 100), (101, 200)]
+    assert rangeread.plan_ranges([], max_gap=0).requests == []
+
+
+def test_read_ranges_scatters_coalesced_requests(data_storage):
+    ranges = [(5000, 6000), (0, 10), (6500, 7000), (100_000, 100_100)]
+    out = rangeread.read_ranges(data_storage, BUCKET, "data", ranges, max_gap=1024)
+    assert bytes(out) == b"".join(DATA[start:end] for start, end in ranges)
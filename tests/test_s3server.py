@@ -0,0 +1,83 @@
+import io
+import time
+
+import botocore.exceptions
+import pytest
+
+from dataplug.storage.picklableS3 import PickleableS3ClientProxy
+from dataplug.storage.s3server import S3Server
+
+DATA = bytes(range(256)) * 40_000  # 10 MB, uploaded in several parts by the transfer manager
+
+
+@pytest.fixture
+def server(tmp_path):
+    with S3Server(str(tmp_path)) as server:
+        yield server
+
+
+@pytest.fixture
+def client(server):
+    client = PickleableS3ClientProxy(**server.storage_config())
+    client.create_bucket(Bucket="bucket")
+    return client
+
+
+def test_put_get_list(client):
+    client.put_object(Bucket="bucket", Key="dir/object", Body=DATA[:1000])
+    res = client.get_object(Bucket="bucket", Key="dir/object")
+    assert res["Body"].read() == DATA[:1000]
+    assert res["ETag"] == client.head_object(Bucket="bucket", Key="dir/object")["ETag"]
+
+    res = client.get_object(Bucket="bucket", Key="dir/object", Range="bytes=100-199")
+    assert res["ContentLength"] == 100
+    assert res["Body"].read() == DATA[100:200]
+    assert client.get_object(Bucket="bucket", Key="dir/object", Range="bytes=-10")["Body"].read() == DATA[990:1000]
+    with pytest.raises(botocore.exceptions.ClientError) as error:
+        client.get_object(Bucket="bucket", Key="dir/object", Range="bytes=1000-")
+    assert error.value.response["Error"]["Code"] == "InvalidRange"
+
+    client.put_object(Bucket="bucket", Key="other", Body=b"")
+    res = client.list_objects_v2(Bucket="bucket", Delimiter="/")
+    assert [obj["Key"] for obj in res["Contents"]] == ["other"]
+    assert [prefix["Prefix"] for prefix in res["CommonPrefixes"]] == ["dir/"]
+    res = client.list_objects_v2(Bucket="bucket", Prefix="dir/")
+    assert [(obj["Key"], obj["Size"]) for obj in res["Contents"]] == [("dir/object", 1000)]
+
+    with pytest.raises(botocore.exceptions.ClientError) as error:
+        client.head_object(Bucket="bucket", Key="missing")
+    assert error.value.response["ResponseMetadata"]["HTTPStatusCode"] == 404
+
+
+def test_multipart_upload(client, server):
+    upload_id = client.create_multipart_upload(Bucket="bucket", Key="object")["UploadId"]
+    parts = []
+    part_size = 5 * 1024 * 1024
+    for part_number, start in enumerate(range(0, len(DATA), part_size), 1):
+        res = client.upload_part(Bucket="bucket", Key="object", PartNumber=part_number, UploadId=upload_id,
+                                 Body=DATA[start:start + part_size])
+        parts.append({"PartNumber": part_number, "ETag": res["ETag"]})
+    client.complete_multipart_upload(Bucket="bucket", Key="object", UploadId=upload_id,
+                                     MultipartUpload={"Parts": parts})
+    assert client.get_object(Bucket="bucket", Key="object")["Body"].read() == DATA
+
+    # Managed transfers send chunked bodies
+    client.upload_fileobj(io.BytesIO(DATA), "bucket", "transfer")
+    assert server.storage.get_object(Bucket="bucket", Key="transfer")["Body"].read() == DATA
+
+
+def test_set_network_latency(client, server):
+    client.put_object(Bucket="bucket", Key="object", Body=b"data")
+
+    def head_time():
+        t0 = time.perf_counter()
+        client.head_object(Bucket="bucket", Key="object")
+        return time.perf_counter() - t0
+
+    head_time()
+    assert min(head_time() for _ in range(3)) < 0.2
+    server.set_network(latency=0.3)
+    assert head_time() >= 0.3
+    server.set_network(latency=0.0)
+    assert head_time() < 0.2
+    assert server.stats["requests"]["HeadObject"] >= 6
@@ -0,0 +1,59 @@
+import gzip
+import zlib
+
+import pytest
+
+from dataplug.formats.compressed.zran import GZipIndexBuilder, inflate_from_access_point
+
+from .conftest import fastq_lines
+
+SPACING = 50_000
+READ_SIZE = 4096
+
+RAW = ("\n".join(fastq_lines(10_000)) + "\n").encode()
+
+
+def _sync_flushed(data):
+    # Sync flushes end with an empty stored block, which is aligned to the original bytes
+    compressor = zlib.compressobj(wbits=31)
+    out = []
+    for i in range(0, len(data), 30_000):
+        out.append(compressor.compress(data[i:i + 30_000]))
+        out.append(compressor.flush(zlib.Z_SYNC_FLUSH))
+    out.append(compressor.flush())
+    return b"".join(out)
+
+
+ARCHIVES = {
+    "single": gzip.compress(RAW),
+    "sync_flush": _sync_flushed(RAW),
+    "multi": b"".join(gzip.compress(RAW[i:i + 200_000]) for i in range(0, len(RAW), 200_000)),
+}
+
+
+def _chunks(data):
+    return (data[i:i + READ_SIZE] for i in range(0, len(data), READ_SIZE))
+
+
+@pytest.mark.parametrize("variant", list(ARCHIVES))
+def test_inflate_from_bit_offset_access_points(variant):
+    data = ARCHIVES[variant]
+    builder = GZipIndexBuilder(spacing=SPACING)
+    points = list(builder.build(_chunks(data)))
+    assert builder.uncompressed_size == len(RAW)
+
+    primed = [point for point in points if point.bits]
+    assert primed
+    for point in primed:
+        # The first byte holds the last bits of the previous block and the first bits of the access point block
+        out = b"".join(inflate_from_access_point(_chunks(data[point.compressed_byte - 1:]), point.bits, point.window))
+        assert out == RAW[point.uncompressed_byte:]
+
+
+def test_inflate_stops_with_the_input():
+    data = ARCHIVES["single"]
+    point = next(point for point in GZipIndexBuilder(spacing=SPACING).build(_chunks(data)) if point.bits)
+    end = point.compressed_byte + 20_000
+    out = b"".join(inflate_from_access_point(_chunks(data[point.compressed_byte - 1:end]), point.bits, point.window))
+    assert 0 < len(out) < len(RAW) - point.uncompressed_byte
+    assert out == RAW[point.uncompressed_byte:point.uncompressed_byte + len(out)]